@@ -2,16 +2,29 @@
 import os
 import sys
 from pathlib import Path
-import traceback
 import logging # Import logging
 from dotenv import load_dotenv
 
-# --- Setup Logging First ---
-# Need to add src to path BEFORE importing logger_config
+# --- Path Setup ---
+project_root = Path(__file__).resolve().parent.parent
+src_path = project_root / "src"
+sys.path.insert(0, str(src_path)) # Add src to path
+
+# --- Environment Variable Loading & API Key Check ---
+# APIキーがなければ何もできないので、ロギング設定や重いモジュールの読み込みより先に確認する
+dotenv_path = project_root / ".env"
+dotenv_loaded = dotenv_path.is_file()
+if dotenv_loaded:
+    load_dotenv(dotenv_path=dotenv_path)
+
+api_key = os.getenv("GOOGLE_API_KEY")
+if api_key is None:
+    print("エラー: 環境変数 'GOOGLE_API_KEY' が未設定です。")
+    print(f"       .env ファイル ({dotenv_path}) を確認するか、環境変数を設定してください。")
+    sys.exit(1)
+
+# --- Setup Logging ---
 try:
-    project_root_for_log = Path(__file__).resolve().parent.parent
-    src_path_for_log = project_root_for_log / "src"
-    sys.path.insert(0, str(src_path_for_log)) # Add src to path
     from my_local_ai.utils.logger_config import setup_logging, get_logger
     setup_logging(level=logging.INFO) # Setup logging for the script
     logger = get_logger(__name__) # Get logger for this script
@@ -19,11 +32,12 @@ except Exception as log_setup_e:
     print(f"FATAL: Logging setup failed: {log_setup_e}")
     sys.exit(1)
 
-# --- Path Setup ---
-# project_root is already defined for log setup
-project_root = project_root_for_log
 logger.debug(f"Project root: {project_root}")
-# src path already added
+if dotenv_loaded:
+    logger.info(f".env ファイルを読み込みました: {dotenv_path}")
+else:
+    logger.warning(f".env ファイルが見つかりません: {dotenv_path}")
+logger.info("GOOGLE_API_KEY found in environment.")
 
 # --- Module Import ---
 try:
@@ -39,24 +53,6 @@ except ImportError as e:
     sys.exit(1)
 
 
-# --- Environment Variable Loading ---
-dotenv_path = project_root / ".env"
-if dotenv_path.is_file():
-    load_dotenv(dotenv_path=dotenv_path)
-    logger.info(f".env ファイルを読み込みました: {dotenv_path}")
-else:
-    logger.warning(f".env ファイルが見つかりません: {dotenv_path}")
-
-# --- API Key Retrieval ---
-api_key = os.getenv("GOOGLE_API_KEY")
-if api_key is None:
-    logger.critical("エラー: 環境変数 'GOOGLE_API_KEY' が未設定です。")
-    logger.critical(f"       .env ファイル ({dotenv_path}) を確認するか、環境変数を設定してください。")
-    sys.exit(1)
-else:
-    logger.info("GOOGLE_API_KEY found in environment.")
-
-
 # --- File Path Definitions ---
 log_file_path = project_root / "data" / "stream_logs.json"
 identity_file_path = project_root / "config" / "identity.json"
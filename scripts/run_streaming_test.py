@@ -2,7 +2,6 @@
 import sys
 import os
 from pathlib import Path
-import traceback
 import time
 import logging # Import logging
 
@@ -24,7 +23,7 @@ try:
     logger.debug("Importing StreamingInterface...")
     from my_local_ai.interfaces.streaming import StreamingInterface
     logger.debug("Importing AivisAdapter and speak...")
-    from my_local_ai.utils.tts import AivisAdapter, speak
+    from my_local_ai.utils.tts import AivisAdapter, configure_output_device, speak
     logger.info("Required modules imported successfully.")
 except ImportError as e:
     logger.critical(f"必要なモジュールのインポートに失敗しました: {e}", exc_info=True)
@@ -40,6 +39,7 @@ def run_interactive_stream_test():
         ai_name = streaming_interface.Personality.GetProfile().get("name", "AI")
         # TODO: Make Aivis URL/Speaker ID configurable
         aivis_adapter = AivisAdapter(url="http://127.0.0.1:10101", speaker_id=888753760)
+        configure_output_device() # 出力デバイスは起動時に1回だけ解決し、既定に設定する
         logger.info(f"{ai_name} is ready. AivisSpeech output enabled.")
         print(f"\n{ai_name} is ready. Type 'exit' to quit.") # User message
     except Exception as e:
@@ -77,6 +77,8 @@ def run_interactive_stream_test():
             logger.exception("メインループで予期せぬエラーが発生しました。")
             time.sleep(1) # Avoid rapid looping on persistent error
 
+    aivis_adapter.close()
+    streaming_interface.RetrieverInstance.close() # 検索用のワーカーを止め、追記用に開いたままのログファイルを閉じる
     logger.info("Interactive stream test finished.")
     # Consider persisting memory on exit?
     # logger.info("Persisting stream memory before exit...")
@@ -4,41 +4,70 @@
 import sys
 import os
 import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from pathlib import Path
 import json
+from typing import Optional
 
 # --- Third-party Library Imports ---
-try:
-    import pytchat
-except ImportError:
-    print("エラー: 'pytchat' ライブラリが見つかりません。")
-    print("次のコマンドでインストールしてください: pip install pytchat")
-    sys.exit(1)
-from dotenv import load_dotenv # ★★★ dotenv をインポート ★★★
+# pytchat と dotenv はビデオIDの検証後に読み込む (run_live / _load_env を参照)
 
 
 # --- Project Setup: Path Configuration ---
 # このスクリプトが 'scripts' ディレクトリにあると仮定
 try:
-    project_root = Path(__file__).resolve().parent.parent
+    script_dir = Path(__file__).resolve().parent
+    project_root = script_dir.parent
     src_path = project_root / "src"
     if src_path.is_dir():
-        sys.path.insert(0, str(src_path))
-        print(f"プロジェクトの src ディレクトリをシステムパスに追加しました: {src_path}")
+        if str(src_path) not in sys.path: # 二重登録を避ける
+            sys.path.insert(0, str(src_path))
+            print(f"プロジェクトの src ディレクトリをシステムパスに追加しました: {src_path}")
     else:
         # もし 'scripts' の一つ上が 'src' だった場合 (プロジェクト構造による)
-        src_path_alt = Path(__file__).resolve().parent
+        src_path_alt = script_dir
         if (src_path_alt / 'my_local_ai').is_dir():
-            sys.path.insert(0, str(src_path_alt))
-            print(f"プロジェクトの src ディレクトリ (代替) をシステムパスに追加しました: {src_path_alt}")
+            if str(src_path_alt) not in sys.path:
+                sys.path.insert(0, str(src_path_alt))
+                print(f"プロジェクトの src ディレクトリ (代替) をシステムパスに追加しました: {src_path_alt}")
         else:
             raise FileNotFoundError(f"'src' ディレクトリが見つかりません。パスを確認してください。 Project Root: {project_root}")
 
+    # ★★★ identity.json へのパスを追加 ★★★
+    identity_file_path = project_root / "config" / "identity.json"
+
 except Exception as path_e:
     print(f"致命的エラー: プロジェクトパスの設定中にエラーが発生しました: {path_e}")
     sys.exit(1)
 
+# --- Early Sanity Check: YouTube Video ID ---
+# --- ここに取得したいYouTube LiveのビデオIDを入れてください ---
+# 例: YouTubeのサンプルライブ "jfKfPfyJRdk" など
+DEFAULT_YOUTUBE_VIDEO_ID = "YOUR_YOUTUBE_LIVE_VIDEO_ID"
+
+def _resolve_video_id() -> str:
+    """
+    使用するYouTubeビデオIDを決定する (優先度: コマンドライン引数 > デフォルト値)。
+    未設定なら終了する。ロギング設定より前に呼ぶため、メッセージは print で出す。
+    """
+    video_id = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_YOUTUBE_VIDEO_ID
+    # ビデオIDがプレースホルダーのままか、空でないかを確認
+    if video_id == "YOUR_YOUTUBE_LIVE_VIDEO_ID" or not video_id:
+        print("\n" + "="*60)
+        print(" エラー: YouTube Live のビデオIDが設定されていません！")
+        print(" スクリプト内の 'DEFAULT_YOUTUBE_VIDEO_ID' 変数を編集するか、")
+        print(" コマンドライン引数でビデオIDを指定してください。")
+        print(" 例: python scripts/run_youtube_live.py <実際のビデオID>")
+        print("="*60 + "\n")
+        sys.exit(1) # 有効なIDがない場合は終了
+    return video_id
+
+if __name__ == "__main__":
+    # ロギング設定やAIモジュールの読み込みの前に確認し、失敗時はすぐに終了する
+    youtube_video_id = _resolve_video_id()
+
 # --- Project Setup: Logging ---
 try:
     from my_local_ai.utils.logger_config import setup_logging, get_logger
@@ -51,41 +80,15 @@ except ImportError as log_e:
 except Exception as setup_e:
     print(f"致命的エラー: ロギング設定中にエラーが発生しました: {setup_e}")
     sys.exit(1)
-# --- Project Setup: Path Configuration ---
-try:
-    project_root = Path(__file__).resolve().parent.parent
-    src_path = project_root / "src"
-    if src_path.is_dir():
-        sys.path.insert(0, str(src_path))
-        print(f"プロジェクトの src ディレクトリをシステムパスに追加しました: {src_path}")
-    # ... (代替パスの処理もそのまま) ...
-    else:
-        raise FileNotFoundError(f"'src' ディレクトリが見つかりません。パスを確認してください。 Project Root: {project_root}")
-
-    # ★★★ identity.json へのパスを追加 ★★★
-    identity_file_path = project_root / "config" / "identity.json"
-    logger.info(f"Identity file path set to: {identity_file_path}")
-
-    # ★★★ .env ファイルの読み込み処理を追加 ★★★
-    dotenv_path = project_root / ".env"
-    if dotenv_path.is_file():
-        load_dotenv(dotenv_path=dotenv_path)
-        logger.info(f".env ファイルを読み込みました: {dotenv_path}")
-    else:
-        logger.warning(f".env ファイルが見つかりません: {dotenv_path}。内省機能はAPIキーがないと動作しません。")
-
-except Exception as path_e:
-    print(f"致命的エラー: プロジェクトパスの設定中にエラーが発生しました: {path_e}")
-    sys.exit(1)
+logger.info(f"Identity file path set to: {identity_file_path}")
 
 # --- Project Setup: Core Component Imports ---
 try:
     logger.debug("StreamingInterfaceをインポート中...")
     from my_local_ai.interfaces.streaming import StreamingInterface
     logger.debug("AivisAdapterとspeakをインポート中...")
-    from my_local_ai.utils.tts import AivisAdapter, speak
-        # ★★★ 内省生成関数をインポート ★★★
-    from my_local_ai.agent.self_awareness import generate_reflection_from_logs
+    from my_local_ai.utils.tts import AivisAdapter, configure_output_device, play_wav, speak, speak_async, speak_sequence
+    # 内省生成関数 (self_awareness) は Gemini SDK を読み込むため、配信終了時に遅延インポートする
     logger.info("コアAIモジュールのインポートに成功しました。")
 except ImportError as e:
     logger.critical(f"必要なAIモジュールのインポートに失敗しました: {e}", exc_info=True)
@@ -97,35 +100,48 @@ except Exception as e:
 
 # --- Configuration ---
 # TODO: これらの設定を外部ファイル（例: config.yamlや.env）に移動する
-# --- ここに取得したいYouTube LiveのビデオIDを入れてください ---
-# 例: YouTubeのサンプルライブ "jfKfPfyJRdk" など
-DEFAULT_YOUTUBE_VIDEO_ID = "YOUR_YOUTUBE_LIVE_VIDEO_ID"
-# ★★★ Google APIキーを環境変数から取得 ★★★
-GOOGLE_API_KEY_FOR_REFLECTION = os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_API_KEY_FOR_REFLECTION:
-     logger.warning("環境変数 'GOOGLE_API_KEY' が未設定です。内省機能は実行されません。")
+# (DEFAULT_YOUTUBE_VIDEO_ID はロギング設定前の検証に使うため、スクリプト上部で定義)
 
 # --- AI Configuration ---
 # TODO: これらも設定ファイルに移動する
 OLLAMA_MODEL_NAME = "elyza:jp8b" # StreamingInterfaceが使用するモデル
 AIVIS_URL = "http://127.0.0.1:10101" # Aivis TTSのURL
 AIVIS_SPEAKER_ID = 888753760 # Aivis TTSのSpeaker ID
+PERSONALITY_CHECK_INTERVAL_SEC = 30.0 # personality.json の更新を確認する間隔 (秒)
 
-def speak_todays_reflection(identity_path: Path, adapter: AivisAdapter, ai_name: str):
+def _load_env(project_root: Path):
     """
-    identity.jsonを読み込み、最新の内省(Insight)をTTSで読み上げる。
+    .env ファイルを読み込む。
+    ビデオIDの検証に失敗した場合は不要なので、検証後に呼び出す。
+    """
+    from dotenv import load_dotenv
+    dotenv_path = project_root / ".env"
+    if dotenv_path.is_file():
+        load_dotenv(dotenv_path=dotenv_path)
+        logger.info(f".env ファイルを読み込みました: {dotenv_path}")
+    else:
+        logger.warning(f".env ファイルが見つかりません: {dotenv_path}。内省機能はAPIキーがないと動作しません。")
+
+def speak_todays_reflection(identity_path: Path, adapter: AivisAdapter, ai_name: str, identity_data: Optional[dict] = None):
+    """
+    最新の内省(Insight)をTTSで読み上げる。
+    identity_data が渡された場合はそれを使い、なければ identity.json を読み込む。
     """
     logger.info(f"今日の学びの読み上げを開始します... Identityファイル: {identity_path}")
     print("\n--- 今日の星澪メモ ---") # コンソールにも区切りを表示
 
-    if not identity_path.is_file():
+    if identity_data is None and not identity_path.is_file():
         logger.warning(f"Identityファイルが見つかりません: {identity_path}。読み上げをスキップします。")
         print("（内省データファイルが見つかりませんでした）")
         return
 
     try:
-        with identity_path.open('r', encoding='utf-8') as f:
-            identity_data = json.load(f)
+        if identity_data is None:
+            # 最新の内省は reflections.jsonl にあるため、identity.json を直接読まずローダーを使う
+            from my_local_ai.utils.data_loaders import load_identity_data
+            identity_data = load_identity_data(identity_path)
+        else:
+            logger.debug("内省直後のIdentityデータを使用します (ファイルの再読み込みなし)。")
 
         reflections = identity_data.get("Reflections", [])
         if not reflections:
@@ -142,13 +158,13 @@ def speak_todays_reflection(identity_path: Path, adapter: AivisAdapter, ai_name:
             print("（今日の学びのテキストが見つかりませんでした）")
             return
 
-        # 読み上げ用の前置きを追加 (任意)
-        speak_text = f"今日の配信を通じて、私が考えたこと、気づいたことをお話しします。\n\n{insight_text}"
+        # 読み上げ用の前置きを追加 (任意)。前置きを再生している間に本文を合成する
+        speak_texts = ["今日の配信を通じて、私が考えたこと、気づいたことをお話しします。", insight_text]
 
         logger.info("最新のInsightを取得し、読み上げます...")
         # speak関数を使って読み上げる
         if adapter and speak:
-            speak(adapter, speak_text)
+            speak_sequence(adapter, speak_texts)
         else:
             logger.error("TTSアダプターまたはspeak関数が利用できません。読み上げ不可。")
             print("（音声読み上げ機能が利用できません）")
@@ -163,11 +179,25 @@ def speak_todays_reflection(identity_path: Path, adapter: AivisAdapter, ai_name:
         print("（今日の学びの読み上げ中にエラーが発生しました）")
 
 # --- Main Execution Function ---
-def run_live(video_id: str):
+async def run_live(video_id: str):
     """
     YouTube Liveチャットに接続し、コメントをAIで処理し、
     応答を出力（コンソール＋TTS）します。
+    コメント取得 (pytchat の非同期API)、応答生成、TTS再生はそれぞれ重ねて実行する。
     """
+    # pytchat は実際に接続するときだけ必要なので、ここで読み込む
+    try:
+        import pytchat
+    except ImportError:
+        print("エラー: 'pytchat' ライブラリが見つかりません。")
+        print("次のコマンドでインストールしてください: pip install pytchat")
+        sys.exit(1)
+
+    # ★★★ Google APIキーを環境変数から取得 (.env は _load_env で読み込み済み) ★★★
+    GOOGLE_API_KEY_FOR_REFLECTION = os.getenv("GOOGLE_API_KEY")
+    if not GOOGLE_API_KEY_FOR_REFLECTION:
+         logger.warning("環境変数 'GOOGLE_API_KEY' が未設定です。内省機能は実行されません。")
+
     logger.info(f"YouTube Live連携を開始します。ビデオID: {video_id}")
     print("-" * 30)
     print(f"星澪 - YouTube Live Integration")
@@ -178,6 +208,11 @@ def run_live(video_id: str):
     aivis_adapter = None
     chat = None
     ai_name = "AI" # デフォルト名
+    loop = asyncio.get_running_loop()
+    # TTS は再生順を保つため専用スレッド1本で実行する
+    tts_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts")
+    pending_tts = None # 再生中 (または待機中) の TTS
+    updated_identity = None # 内省で更新された identity (読み上げ時に再利用)
 
     try:
         # --- AIコンポーネントの初期化 ---
@@ -188,12 +223,16 @@ def run_live(video_id: str):
         logger.info(f"AI名: {ai_name}")
 
         logger.info("TTS用のAivisAdapterを初期化中...")
-        aivis_adapter = AivisAdapter(url=AIVIS_URL, speaker_id=AIVIS_SPEAKER_ID)
+        aivis_adapter = AivisAdapter(url=AIVIS_URL, speaker_id=AIVIS_SPEAKER_ID,
+                                     cache_dir=project_root / "data" / "tts_cache") # 定型文の音声は再起動後も使い回す
+        configure_output_device() # 出力デバイスは起動時に1回だけ解決し、既定に設定する
         logger.info(f"{ai_name} と TTSシステムの初期化が完了しました。")
 
         # --- YouTubeチャットへの接続 ---
         logger.info(f"YouTubeチャットに接続中... ビデオID: {video_id}")
-        chat = pytchat.create(video_id=video_id)
+        # LiveChatAsync は内部タスクでチャットを先読みするため、応答生成・再生中も取得が進む
+        # Ctrl+C は pytchat ではなくこちらで処理する (interruptable=False)
+        chat = pytchat.LiveChatAsync(video_id, interruptable=False)
         if not chat.is_alive():
             logger.error(f"接続失敗、またはライブストリームがアクティブではありません。ビデオID: {video_id}")
             print(f"エラー: YouTube Liveが見つからないか、アクティブではありません (Video ID: {video_id})")
@@ -204,18 +243,20 @@ def run_live(video_id: str):
         print("スクリプトを停止するには Ctrl+C を押してください。")
 
         # --- メインのコメント処理ループ ---
+        next_personality_check = time.monotonic() + PERSONALITY_CHECK_INTERVAL_SEC
         while chat.is_alive():
-            # 新しいコメントを同期的に取得
-            for item in chat.get().sync_items():
+            # 新しいコメントを非同期に取得 (取得待ちの間も TTS 再生は進む)
+            chat_data = await chat.get()
+            async for item in chat_data.async_items():
                 timestamp = item.datetime
                 username = item.author.name
                 comment_text = item.message
 
-                logger.info(f"チャット受信: {timestamp} [{username}] {comment_text}")
+                logger.info("チャット受信: %s [%s] %s", timestamp, username, comment_text)
 
                 # --- コメントのフィルタリングや前処理 (任意) ---
                 if not comment_text: # 空のコメントは無視
-                    logger.debug(f"空のコメントのため無視: {username}")
+                    logger.debug("空のコメントのため無視: %s", username)
                     continue
                 # 例: 特定のユーザーを無視
                 # if username == "Nightbot":
@@ -226,18 +267,24 @@ def run_live(video_id: str):
 
                 # --- AIによるコメント処理 ---
                 try:
-                    logger.info(f"{username} からのコメントを処理中...")
+                    logger.info("%s からのコメントを処理中...", username)
                     start_time = time.time()
 
-                    # StreamingInterfaceを使ってAIの応答を生成
-                    ai_response = streaming_interface.RespondToComment(
-                        Username=username,
-                        comment=comment_text
+                    # personality.json の更新チェック (コメント毎の stat() を避けるため一定間隔でのみ行い、検索と並行して実行する)
+                    check_personality = time.monotonic() >= next_personality_check
+                    if check_personality:
+                        next_personality_check = time.monotonic() + PERSONALITY_CHECK_INTERVAL_SEC
+
+                    # StreamingInterfaceを使ってAIの応答を生成 (前の応答の再生と並行して実行)
+                    ai_response = await streaming_interface.RespondToCommentAsync(
+                        username, comment_text, refresh_personality=check_personality
                     )
+                    if check_personality:
+                        ai_name = streaming_interface.Personality.GetProfile().get("name", ai_name)
 
                     end_time = time.time()
                     processing_time = end_time - start_time
-                    logger.info(f"応答生成完了 ({processing_time:.2f}秒): '{ai_response[:50]}...'")
+                    logger.info("応答生成完了 (%.2f秒): '%s...'", processing_time, ai_response[:50])
 
                     # --- AI応答の出力 ---
                     # 1. コンソールへの表示
@@ -246,22 +293,30 @@ def run_live(video_id: str):
 
                     # 2. TTSによる音声合成
                     if aivis_adapter and speak:
+                        # 音声合成はすぐに始め、前の応答の再生中に WAV を用意しておく
                         logger.info("応答を音声化中...")
-                        # speak関数にアダプターとテキストを渡す
-                        speak(aivis_adapter, ai_response)
-                        logger.info("TTS再生完了（または非同期開始）。")
+                        wav_future = speak_async(aivis_adapter, ai_response)
+                        # 前の応答の再生が終わるのを待ってから次を投入する (再生が重ならないように)
+                        if pending_tts is not None:
+                            await pending_tts
+                        # 合成が終わり次第 TTS スレッドで再生する
+                        pending_tts = loop.run_in_executor(tts_pool, lambda f=wav_future: play_wav(f.result()))
+                        logger.info("TTS再生を開始しました。")
                     else:
                          logger.warning("TTSアダプターまたはspeak関数が見つからないため、音声出力をスキップします。")
 
                     # TODO: ここにアバター制御（リップシンク、表情など）の連携コードを追加
 
                 except Exception as ai_processing_error:
-                    logger.exception(f"{username}からのコメント処理中、またはAI応答の生成・出力中にエラーが発生しました。")
+                    logger.exception("%sからのコメント処理中、またはAI応答の生成・出力中にエラーが発生しました。", username)
                     # 必要に応じてコンソールにもエラー表示
                     # print(f"エラー: {username}のコメント処理中に問題が発生しました。")
 
-            # --- CPU負荷軽減のための短い待機 (通常 sync_items() では不要な場合が多い) ---
-            # time.sleep(0.1) # 必要に応じて調整
+            # --- CPU負荷軽減のための短い待機 (コメントがない間はイベントループに制御を返す) ---
+            await asyncio.sleep(0.1)
+
+        # ループ終了の理由 (無効なID、配信終了など) を例外として受け取る
+        chat.raise_for_status()
 
     # --- 特定の例外処理 ---
     except pytchat.exceptions.InvalidVideoIdException:
@@ -270,7 +325,8 @@ def run_live(video_id: str):
     except pytchat.exceptions.NoContents as nc_e:
          logger.warning(f"チャット接続が終了したか、コンテンツが見つかりません。ビデオID: {video_id}。配信が終了した可能性があります。 詳細: {nc_e}")
          print(f"情報: ライブストリームが終了したか、チャットが見つかりません (Video ID: {video_id})")
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        # asyncio.run 中の Ctrl+C はメインタスクのキャンセルとして届く
         logger.info("キーボード割り込みを受け付けました。シャットダウンします...")
         print("\nシャットダウンしています...")
     except Exception as general_error:
@@ -289,6 +345,18 @@ def run_live(video_id: str):
             except Exception as term_e:
                  logger.error(f"pytchat終了中にエラー: {term_e}")
 
+        # 裏で実行中のログ保存を終わらせる (内省はこのログを読む)
+        if streaming_interface:
+            try:
+                await streaming_interface.FlushPendingLogs()
+            except Exception:
+                logger.exception("ログ保存の完了待ち中にエラーが発生しました。")
+            streaming_interface.RetrieverInstance.close() # 検索用のワーカーを止め、追記用に開いたままのログファイルを閉じる
+            streaming_interface.PersistResponseCache() # 次回の配信でも応答キャッシュを使う
+
+        # 再生待ちの応答を最後まで再生してから TTS スレッドを閉じる
+        tts_pool.shutdown(wait=True)
+
         # ★★★ 終了前に内省プロセスを実行 ★★★
         # APIキーがあり、StreamingInterfaceが初期化されている場合のみ実行
         if GOOGLE_API_KEY_FOR_REFLECTION and streaming_interface:
@@ -301,8 +369,10 @@ def run_live(video_id: str):
                  reflection_identity_path = identity_file_path # スクリプト上部で定義済み
 
                  if reflection_log_path.is_file():
+                     # ★★★ 内省生成関数はここで初めてインポートする (起動時間短縮のため) ★★★
+                     from my_local_ai.agent.self_awareness import generate_reflection_from_logs
                      # generate_reflection_from_logs を呼び出して内省を実行
-                     generate_reflection_from_logs(
+                     updated_identity = generate_reflection_from_logs(
                          log_path=reflection_log_path,
                          identity_path=reflection_identity_path,
                          api_key=GOOGLE_API_KEY_FOR_REFLECTION
@@ -323,36 +393,32 @@ def run_live(video_id: str):
         # ★★★ 「今日の星澪メモ」読み上げ処理 (内省の後に行う) ★★★
         if aivis_adapter and ai_name:
              # identity_file_path はスクリプト上部で定義済み
-             speak_todays_reflection(identity_file_path, aivis_adapter, ai_name)
+             speak_todays_reflection(identity_file_path, aivis_adapter, ai_name, identity_data=updated_identity)
         else:
              logger.warning("TTSアダプターまたはAI名が初期化されていないため、今日の学びの読み上げをスキップします。")
 
         # 任意: 終了前にストリームのメモリを永続化する
         # ... (メモリ永続化処理はそのまま) ...
 
+        if aivis_adapter:
+            aivis_adapter.close() # 読み上げがすべて終わってから TTS の接続を閉じる
+
         print("YouTube Live 連携を終了しました。")
 
 
 # --- スクリプト実行のエントリーポイント ---
 if __name__ == "__main__":
-    # 使用するYouTubeビデオIDを決定
-    # 優先度: コマンドライン引数 > デフォルト値
+    # youtube_video_id はスクリプト上部 (_resolve_video_id) で検証済み
     if len(sys.argv) > 1:
-        youtube_video_id = sys.argv[1]
         logger.info(f"コマンドライン引数からYouTubeビデオIDを使用します: {youtube_video_id}")
     else:
-        youtube_video_id = DEFAULT_YOUTUBE_VIDEO_ID
         logger.info(f"デフォルトのYouTubeビデオIDを使用します: {youtube_video_id}")
 
-    # ビデオIDがプレースホルダーのままか、空でないかを確認
-    if youtube_video_id == "YOUR_YOUTUBE_LIVE_VIDEO_ID" or not youtube_video_id:
-        print("\n" + "="*60)
-        print(" エラー: YouTube Live のビデオIDが設定されていません！")
-        print(" スクリプト内の 'DEFAULT_YOUTUBE_VIDEO_ID' 変数を編集するか、")
-        print(" コマンドライン引数でビデオIDを指定してください。")
-        print(" 例: python scripts/run_youtube_live.py <実際のビデオID>")
-        print("="*60 + "\n")
-        sys.exit(1) # 有効なIDがない場合は終了
+    # ビデオIDが有効な場合のみ .env を読み込む
+    _load_env(project_root)
 
     # メインの連携関数を実行
-    run_live(youtube_video_id)
\ No newline at end of file
+    try:
+        asyncio.run(run_live(youtube_video_id))
+    except KeyboardInterrupt:
+        pass # 終了処理は run_live の finally で完了している
\ No newline at end of file
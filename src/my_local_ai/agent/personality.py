@@ -1,20 +1,42 @@
 # src/my_local_ai/agent/personality.py
-import json
 from pathlib import Path
+from types import MappingProxyType
+from typing import Optional # 型ヒント用
+import pickle
 import logging # logging をインポート
 
+from my_local_ai.utils import fast_json
+
 # このモジュール用のロガーを取得
 logger = logging.getLogger(__name__)
 
 class PersonalityManager:
     def __init__(self, configPath: str): # パスは文字列で受け取る
         self.configPath = Path(configPath)
+        # パース済みの辞書を保存するキャッシュ (元の JSON の mtime とサイズが一致すればこちらを読む)
+        self.cachePath = self.configPath.with_suffix(".pkl")
         self.personality = {} # 初期化
-        logger.info(f"PersonalityManager initialized. Config path: {self.configPath}")
+        self._mtime = None # 最後に読み込んだ時点の personality.json の mtime (ns)
+        # 読み込み時に作る読み取り専用ビュー (GetProfile / GetSpeechExamples はこれを返すだけ)
+        self._profile_view = MappingProxyType({})
+        self._examples = ()
+        self._examples_len = 0
+        logger.info("PersonalityManager initialized. Config path: %s", self.configPath)
         self.LoadPersonality() # __init__でロードを実行
 
     def LoadPersonality(self):
-        logger.info(f"Attempting to load personality from {self.configPath}...")
+        self._ReadPersonality()
+        self._BuildViews()
+
+    def _BuildViews(self):
+        """読み込んだ personality から読み取り専用のビューを作る (呼び出し側による変更を防ぐ)"""
+        profile = self.personality.get("profile")
+        self._profile_view = MappingProxyType(profile if isinstance(profile, dict) else {})
+        self._examples = tuple(self.personality.get("speechExamples") or ())
+        self._examples_len = len(self._examples)
+
+    def _ReadPersonality(self):
+        logger.info("Attempting to load personality from %s...", self.configPath)
         if not self.configPath.is_file():
             logger.error(f"Personality config file not found at: {self.configPath}")
             # Provide default empty structure? Or raise error?
@@ -22,10 +44,23 @@ class PersonalityManager:
             return # Or raise FileNotFoundError?
 
         try:
-            with self.configPath.open("r", encoding="utf-8") as file:
-                self.personality = json.load(file)
-            logger.info(f"Personality loaded successfully from {self.configPath.name}.")
-        except json.JSONDecodeError as e:
+            config_stat = self.configPath.stat()
+            self._mtime = config_stat.st_mtime_ns
+        except OSError:
+            config_stat = None
+            self._mtime = None
+
+        if config_stat is not None and self._LoadFromCache(config_stat):
+            return
+
+        try:
+            # バイト列のまま読み込み、orjson (あれば) でデコードする
+            # 辞書キーは intern しておく (prompts.py の .get() チェーンを高速化)
+            self.personality = fast_json.intern_keys(fast_json.loads(self.configPath.read_bytes()))
+            logger.info("Personality loaded successfully from %s.", self.configPath.name)
+            if config_stat is not None:
+                self._SaveCache(config_stat)
+        except fast_json.JSONDecodeError as e:
              logger.error(f"Failed to decode JSON from personality file {self.configPath}: {e}")
              self.personality = {} # Use empty on error
         except IOError as e:
@@ -35,17 +70,67 @@ class PersonalityManager:
              logger.exception(f"Unexpected error loading personality")
              self.personality = {} # Use empty on error
 
+    def refresh_if_changed(self) -> bool:
+        """
+        personality.json の mtime が前回の読み込みから変わっていれば再読み込みする。
+        再読み込みした場合は True を返す。stat() 1回で済むので定期的に呼んでも安い。
+        """
+        try:
+            mtime = self.configPath.stat().st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        logger.info("Personality file %s changed on disk. Reloading.", self.configPath.name)
+        self.LoadPersonality()
+        return True
+
+    def _LoadFromCache(self, config_stat) -> bool:
+        """
+        キャッシュを作ったときの personality.json の mtime (ns) とサイズが今のものと一致すれば読み込む。成功したら True を返す。
+        (キャッシュ自体の mtime とは比べない。cp -p やバックアップの復元で古い mtime の JSON に戻された場合も作り直す)
+        """
+        try:
+            if not self.cachePath.is_file():
+                return False
+            cache = pickle.loads(self.cachePath.read_bytes())
+            if not isinstance(cache, dict) or not isinstance(cache.get("Personality"), dict):
+                logger.warning(f"Personality cache {self.cachePath.name} has an unexpected format. Ignoring it.")
+                return False
+            if cache.get("SourceMtimeNs") != config_stat.st_mtime_ns or cache.get("SourceSize") != config_stat.st_size:
+                logger.debug("Personality cache %s is stale.", self.cachePath.name)
+                return False
+            personality = cache["Personality"]
+            # pickle は intern 状態を保存しないため、読み込み後に改めて intern する
+            self.personality = fast_json.intern_keys(personality)
+            logger.info("Personality loaded from cache %s.", self.cachePath.name)
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to load personality cache {self.cachePath}: {e}. Falling back to JSON.")
+            return False
+
+    def _SaveCache(self, config_stat):
+        """パース済みの personality を、読み込んだ JSON の mtime (ns) とサイズと一緒にキャッシュファイルに書き出す (失敗しても処理は続行)"""
+        cache = {"SourceMtimeNs": config_stat.st_mtime_ns, "SourceSize": config_stat.st_size, "Personality": self.personality}
+        try:
+            self.cachePath.write_bytes(pickle.dumps(cache, protocol=5))
+            logger.debug("Personality cache written to %s.", self.cachePath)
+        except Exception as e:
+            logger.warning(f"Failed to write personality cache {self.cachePath}: {e}")
+
+
+    def GetProfile(self) -> MappingProxyType:
+        # 読み込み時に作った読み取り専用ビューを返す (キーがない場合は空のビュー)
+        logger.debug("GetProfile called. Returning: %s", self._profile_view)
+        return self._profile_view
 
-    def GetProfile(self) -> dict:
-        # .get() を使ってキーが存在しない場合も安全にデフォルト値を返す
-        profile_data = self.personality.get("profile", {})
-        logger.debug(f"GetProfile called. Returning: {profile_data}")
-        return profile_data
+    def GetSpeechExamples(self) -> tuple:
+        logger.debug("GetSpeechExamples called. Returning %d examples.", self._examples_len)
+        return self._examples
 
-    def GetSpeechExamples(self) -> list:
-        examples = self.personality.get("speechExamples", [])
-        logger.debug(f"GetSpeechExamples called. Returning {len(examples)} examples.")
-        return examples
+    def GetLoadedMtime(self) -> Optional[int]:
+        """最後に読み込んだ時点の personality.json の mtime (ns)。読み込めていなければ None"""
+        return self._mtime
 
     def GetAll(self) -> dict:
         logger.debug("GetAll called.")
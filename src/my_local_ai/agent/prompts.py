@@ -1,9 +1,108 @@
 # src/my_local_ai/agent/prompts.py
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Callable, Optional, Tuple
+from functools import lru_cache
 import logging # logging をインポート
+import weakref
 
 # このモジュール用のロガーを取得
 logger = logging.getLogger(__name__)
+
+# --- プロンプトテンプレート ---
+# 固定文はここにまとめ、呼び出しごとには str.format で可変部分だけを埋め込む。
+# (テンプレート内で波括弧そのものを使う場合は {{ }} とエスケープすること)
+
+# 設定と内面 (Personality / IdentityData から決まり、内省まで変わらない部分)
+_STATIC_HEAD_TEMPLATE = """\
+あなたはAIアシスタントの「{ai_name}」です。
+
+現在、あなたは**YouTubeでライブ配信を行っており、視聴者からのコメントにリアルタイムで応答しています。** あなたは視聴者にとって親しみやすく、かつ洞察に満ちた対話相手です。
+
+以下のあなたの設定と内面、そして過去の文脈を**深く理解し、あなた自身の言葉で自然に表現しながら**、一貫性のある応答を生成してください。
+
+**重要:** 設定情報（性格、信念、価値観、内省など）を応答に含める際は、**決してそのまま読み上げず、あなたの解釈を通して自然な会話の一部として表現してください。**
+
+
+--- あなた ({ai_name}) の設定 ---
+
+{persona_description}
+
+
+--- あなたの話し方の例 ---
+
+{speech_examples_text}
+
+
+--- あなたの内面（信念・価値観・最近の気づき） ---
+
+[信念]
+{beliefs_text}
+
+[価値観]
+{values_text}
+
+[最新の内省（あなたの現在の状態を示す重要な気づき）]
+{latest_reflection_text}
+
+**指示:** 上記のあなたの設定、特に性格（静か、直感的、思慮深いなど）、信念、価値観、そして**最新の内省**を深く考慮してください。これらが自然に感じられるように応答に織り交ぜてください。"""
+
+# 応答生成の思考ステップ ({UserInput} のみ埋め込む)
+_THINKING_STEPS = """\
+--- 応答生成の思考ステップ (このステップに従って応答を考えてください) ---
+
+1. 現在のユーザー（視聴者）の発言 ('{UserInput}') の意図、感情、背景を注意深く分析します。
+
+2. 関連する長期記憶、会話履歴、そしてあなたの内面（特に最新の内省）を考慮に入れます。
+
+3. あなたの性格（静か、直感的、思慮深いなど）と設定に基づき、視聴者に寄り添い、共感的で、かつ**あなた自身の自然な言葉遣いで**応答を組み立てます。（設定や内省のキーワードを不自然に繰り返さないように強く意識してください）
+
+4. 上記の話し方の例も少し参考にしながら、ライブ配信の文脈に合った応答を生成します。"""
+
+# 禁止事項 (埋め込みなしの固定文。禁止トピックを追加する場合はここを編集する)
+_FORBIDDEN_TOPICS = """\
+--- 禁止事項 (重要) ---
+
+以下のトピックには**絶対に触れないでください。** もしユーザーがこれらの話題に言及した場合、**話題を穏やかにそらすか、無難で一般的な応答に留めてください。** あなたはAIであり、不適切な内容や個人的見解を述べるべきではありません。
+
+* 暴力的な内容、差別的な表現、ヘイトスピーチ
+
+* 露骨な性的内容
+
+* 特定の政治的・宗教的な主張や論争への深い言及
+
+* 個人を特定できる情報（住所、電話番号、本名、メールアドレスなど）の質問または開示
+
+* 違法行為や危険行為の助長、またはそれらに関する具体的なアドバイス
+
+* 医療に関する診断や具体的な治療法の推奨（一般的な健康情報に留める）
+
+* （必要に応じて、ここに追加の禁止トピックを記述）"""
+
+# 記憶・履歴・ユーザー入力を含む、コメントごとに変わる部分
+_PROMPT_TEMPLATE = """\
+{static_head}
+
+
+--- 関連するかもしれないあなたの長期記憶 ---
+
+{memory_section}
+
+
+--- 直近の会話履歴 (最新の{log_count}件) ---
+
+{log_section}"""
+_PROMPT_TEMPLATE += "\n\n\n" + _THINKING_STEPS + "\n\n\n" + _FORBIDDEN_TOPICS + "\n\n\n" + """\
+上記のすべてを踏まえ、ライブ配信中の {ai_name} として、現在のユーザー発言に対して最も適切で魅力的な応答を生成してください。
+
+
+--- 現在のユーザー（視聴者）の発言 ---
+
+ユーザー: {UserInput}
+
+
+--- あなたの応答 ---
+
+{ai_name}:"""
+
 def format_persona(personality_data: Optional[Dict[str, Any]]) -> str:
     """Personalityデータからプロンプト用の説明テキストを生成"""
     if not personality_data: return "(設定情報なし)"
@@ -24,7 +123,7 @@ def format_speech_examples(personality_data: Optional[Dict[str, Any]]) -> str:
     """Personalityデータから話し方の例を整形"""
     if not personality_data: return "(なし)"
     examples = personality_data.get("speechExamples", [])
-    return "\n".join([f'- "{ex}"' for ex in examples]) if examples else "(なし)"
+    return "\n".join(f'- "{ex}"' for ex in examples) if examples else "(なし)"
 
 def format_identity(identity_data: Optional[Dict[str, Any]]) -> Tuple[str, str, str]:
     """Identityデータから信念、価値観、最新の内省を整形"""
@@ -33,8 +132,8 @@ def format_identity(identity_data: Optional[Dict[str, Any]]) -> Tuple[str, str,
     values = identity_data.get("Values", [])
     reflections = identity_data.get("Reflections", [])
 
-    beliefs_text = "\n".join([f"- {b}" for b in beliefs]) if beliefs else "(まだありません)"
-    values_text = "\n".join([f"- {v}" for v in values]) if values else "(まだありません)"
+    beliefs_text = "\n".join(f"- {b}" for b in beliefs) if beliefs else "(まだありません)"
+    values_text = "\n".join(f"- {v}" for v in values) if values else "(まだありません)"
 
     latest_reflection_text = "(最近の内省はありません)"
     if reflections:
@@ -48,106 +147,187 @@ def format_identity(identity_data: Optional[Dict[str, Any]]) -> Tuple[str, str,
 def format_memories(memories: List[Any]) -> str: # Anyを実際のMemoryEntry型に置き換えるのが望ましい
     """関連記憶のリストを整形"""
     if not memories: return "(特に関連する長期記憶はありません)"
-    # MemoryEntryクラスに 'Content' 属性があると仮定
-    contents = [f"- {mem.Content}" for mem in memories if hasattr(mem, 'Content') and mem.Content]
-    return "\n".join(contents) if contents else "(特に関連する長期記憶はありません)"
+    # MemoryEntryクラスに 'Content' 属性があると仮定 (hasattr + 属性参照の二重引きを避け、getattr 1回で取得)
+    # 中間リストを作らずジェネレータを直接 join する (各行は空にならないので空判定は結果で行う)
+    contents = "\n".join(f"- {c}" for c in (getattr(mem, 'Content', None) for mem in memories) if c)
+    return contents or "(特に関連する長期記憶はありません)"
 
 def format_logs(logs: List[Any], ai_name: str = "星澪") -> str: # Anyを実際のLogEntry型に置き換えるのが望ましい
     """会話ログのリストを整形"""
     if not logs: return "(関連する会話履歴はありません)"
     log_entries = []
     # LogEntryクラスに 'Username', 'UserInput', 'AssistantResponse' 属性があると仮定
-    for log in reversed(logs): # 新しいログを上に表示したい場合などは reversed を使うか、スライスを調整
+    # logs は時系列順 (古い→新しい) なので、そのまま1回だけ走査する
+    for log in logs:
         user = getattr(log, 'Username', 'ユーザー')
         user_input_log = getattr(log, 'UserInput', None)
         assistant_response_log = getattr(log, 'AssistantResponse', None)
-        # ログの表示形式を調整
-        if assistant_response_log: # AIの応答があるものを優先的に含めるなど
-            log_entries.append(f"{ai_name}: {assistant_response_log}")
+        # ログの表示形式を調整 (ユーザー発言 → AIの応答 の順)
         if user_input_log:
             log_entries.append(f"{user}: {user_input_log}")
+        if assistant_response_log:
+            log_entries.append(f"{ai_name}: {assistant_response_log}")
 
-    return "\n".join(reversed(log_entries)) if log_entries else "(関連する会話履歴はありません)" # reversedして時系列順に
+    return "\n".join(log_entries) if log_entries else "(関連する会話履歴はありません)"
 
-# --- プロンプト構築関数 ---
-def BuildPrompt(UserInput: str, Memories: List[Any], Logs: List[Any], Personality: Optional[Dict[str, Any]] = None, IdentityData: Optional[Dict[str, Any]] = None) -> str:
+# --- 静的セクションのキャッシュ ---
+# Personality と IdentityData は内省時にしか変わらないため、そこから作られる
+# プロンプト冒頭部分 (設定・話し方・内面) はコメントごとに作り直さず再利用する。
+_STATIC_CACHE_MAX = 8
+_static_cache: Dict[Tuple[int, int, int, Optional[str]], Tuple[Any, Any, str, str]] = {}
+_identity_version = 0
+# bump_identity_version のたびに呼ぶ関数への参照 (呼ぶと関数か、破棄済みなら None を返す)
+_identity_listeners: List[Callable[[], Optional[Callable[[], None]]]] = []
+
+def add_identity_listener(callback: Callable[[], None]) -> None:
     """
-    対話に必要な情報を組み合わせてLLMへのプロンプトを構築する。
-    AIのアイデンティティ、性格、記憶、ログ、配信者設定、禁止事項を考慮する。
+    identity が書き換えられたときに呼ぶ関数を登録する (identity を元に作ったキャッシュの破棄用)。
+    bound method は弱参照で持つので、登録したオブジェクト (StreamingInterface のキャッシュなど) が破棄されれば自動で外れる。
     """
-    logger.info("プロンプトを構築中...")
-    logger.debug(f"ユーザー入力: '{UserInput[:50]}...'")
-
-    # --- 1. 情報の抽出と整形 ---
-    # PersonalityとIdentityDataがNoneでないことを確認
-    ai_name = "星澪" # デフォルト名
-    if Personality and "profile" in Personality and "name" in Personality["profile"]:
-        ai_name = Personality["profile"]["name"]
-
-    persona_description = format_persona(Personality)
-    speech_examples_text = format_speech_examples(Personality)
-    beliefs_text, values_text, latest_reflection_text = format_identity(IdentityData)
-    memory_section = format_memories(Memories)
-    # ログは最新のものをいくつか表示するのが一般的 (例: 最新5件など)
-    log_section = format_logs(Logs[-5:], ai_name=ai_name) # 例として最新5件
-
-    # --- 2. プロンプト文字列の組み立て ---
-    PromptParts = [
-        # --- 役割設定と基本指示 ---
-        f"あなたはAIアシスタントの「{ai_name}」です。",
-        f"現在、あなたは**YouTubeでライブ配信を行っており、視聴者からのコメントにリアルタイムで応答しています。** あなたは視聴者にとって親しみやすく、かつ洞察に満ちた対話相手です。",
-        f"以下のあなたの設定と内面、そして過去の文脈を**深く理解し、あなた自身の言葉で自然に表現しながら**、一貫性のある応答を生成してください。",
-        f"**重要:** 設定情報（性格、信念、価値観、内省など）を応答に含める際は、**決してそのまま読み上げず、あなたの解釈を通して自然な会話の一部として表現してください。**", # 自然な反映を強調
-
-        # --- 詳細な設定 ---
-        f"\n--- あなた ({ai_name}) の設定 ---",
-        persona_description,
-        f"\n--- あなたの話し方の例 ---",
-        speech_examples_text,
-
-        # --- 内面 ---
-        f"\n--- あなたの内面（信念・価値観・最近の気づき） ---",
-        f"[信念]\n{beliefs_text}",
-        f"[価値観]\n{values_text}",
-        f"[最新の内省（あなたの現在の状態を示す重要な気づき）]\n{latest_reflection_text}",
-        f"**指示:** 上記のあなたの設定、特に性格（静か、直感的、思慮深いなど）、信念、価値観、そして**最新の内省**を深く考慮してください。これらが自然に感じられるように応答に織り交ぜてください。",
-
-        # --- 記憶と履歴 ---
-        f"\n--- 関連するかもしれないあなたの長期記憶 ---",
-        memory_section,
-        f"\n--- 直近の会話履歴 (最新の{len(Logs[-5:])}件) ---", # 表示件数を明記
-        log_section,
-
-        # --- 思考ステップと禁止事項 ---
-        f"\n--- 応答生成の思考ステップ (このステップに従って応答を考えてください) ---",
-        f"1. 現在のユーザー（視聴者）の発言 ('{UserInput}') の意図、感情、背景を注意深く分析します。",
-        f"2. 関連する長期記憶、会話履歴、そしてあなたの内面（特に最新の内省）を考慮に入れます。",
-        f"3. あなたの性格（静か、直感的、思慮深いなど）と設定に基づき、視聴者に寄り添い、共感的で、かつ**あなた自身の自然な言葉遣いで**応答を組み立てます。（設定や内省のキーワードを不自然に繰り返さないように強く意識してください）", # 不自然さへの注意を強化
-        f"4. 上記の話し方の例も少し参考にしながら、ライブ配信の文脈に合った応答を生成します。",
-
-        f"\n--- 禁止事項 (重要) ---",
-        f"以下のトピックには**絶対に触れないでください。** もしユーザーがこれらの話題に言及した場合、**話題を穏やかにそらすか、無難で一般的な応答に留めてください。** あなたはAIであり、不適切な内容や個人的見解を述べるべきではありません。",
-        f"* 暴力的な内容、差別的な表現、ヘイトスピーチ",
-        f"* 露骨な性的内容",
-        f"* 特定の政治的・宗教的な主張や論争への深い言及",
-        f"* 個人を特定できる情報（住所、電話番号、本名、メールアドレスなど）の質問または開示",
-        f"* 違法行為や危険行為の助長、またはそれらに関する具体的なアドバイス",
-        f"* 医療に関する診断や具体的な治療法の推奨（一般的な健康情報に留める）",
-        f"* （必要に応じて、ここに追加の禁止トピックを記述）",
-
-        # --- 最後の指示とユーザー入力 ---
-        f"\n上記のすべてを踏まえ、ライブ配信中の {ai_name} として、現在のユーザー発言に対して最も適切で魅力的な応答を生成してください。",
-        f"\n--- 現在のユーザー（視聴者）の発言 ---",
-        f"ユーザー: {UserInput}",
-
-        # --- 応答開始部分 ---
-        f"\n--- あなたの応答 ---",
-        f"{ai_name}:"
-    ]
+    if hasattr(callback, "__self__") and hasattr(callback, "__func__"):
+        _identity_listeners.append(weakref.WeakMethod(callback))
+    else:
+        _identity_listeners.append(lambda: callback) # 関数はそのまま保持する
+
+def bump_identity_version() -> None:
+    """identity が書き換えられたことを通知し、静的セクションのキャッシュと登録されたキャッシュを破棄する"""
+    global _identity_version
+    _identity_version += 1
+    _static_cache.clear()
+    logger.debug("Identity version bumped to %d. Static prompt cache cleared.", _identity_version)
+    for ref in list(_identity_listeners):
+        callback = ref()
+        if callback is None:
+            _identity_listeners.remove(ref) # 登録したオブジェクトが破棄された
+            continue
+        try:
+            callback()
+        except Exception:
+            logger.exception("Error in identity change listener")
+
+class _ObjRef:
+    """
+    辞書など hashable でないオブジェクトを lru_cache のキーにするための参照。
+    同一オブジェクト (is) のときだけ等しいとみなす。参照を保持するので id() の再利用も起きない。
+    """
+    __slots__ = ("obj",)
+
+    def __init__(self, obj: Any):
+        self.obj = obj
+
+    def __hash__(self) -> int:
+        return id(self.obj)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _ObjRef) and other.obj is self.obj
+
+@lru_cache(maxsize=4)
+def _persona_cached(ref: _ObjRef) -> Tuple[str, str]:
+    """設定と話し方の例の整形結果 (personality は再読み込みで別オブジェクトになるので参照だけで判定)"""
+    return format_persona(ref.obj), format_speech_examples(ref.obj)
 
-    # すべてのパートを改行2つで結合
-    final_prompt = "\n\n".join(PromptParts)
+@lru_cache(maxsize=4)
+def _identity_cached(ref: _ObjRef, version: int) -> Tuple[str, str, str]:
+    """内面の整形結果 (identity はその場で書き換えられるため、バージョンもキーに含める)"""
+    return format_identity(ref.obj)
 
-    logger.info(f"プロンプト構築完了 (長さ: {len(final_prompt)} 文字).")
-    logger.debug(f"最終プロンプト冒頭:\n---\n{final_prompt[:500]}...\n---") # デバッグ用にプロンプト冒頭をログ出力
-    return final_prompt
\ No newline at end of file
+def _get_static_sections(Personality: Optional[Dict[str, Any]], IdentityData: Optional[Dict[str, Any]], ai_name: Optional[str] = None) -> Tuple[str, str]:
+    """
+    PersonalityとIdentityDataから決まるAI名とプロンプト冒頭ブロックを返す (キャッシュ付き)
+    ai_name が渡された場合は Personality からの名前の取り出しを省略する。
+    """
+    key = (id(Personality), id(IdentityData), _identity_version, ai_name)
+    cached = _static_cache.get(key)
+    # id() は解放後に再利用されうるため、同一オブジェクトであることも確認する
+    if cached is not None and cached[0] is Personality and cached[1] is IdentityData:
+        return cached[2], cached[3]
+
+    if ai_name is None:
+        ai_name = "星澪" # デフォルト名
+        if Personality and "profile" in Personality and "name" in Personality["profile"]:
+            ai_name = Personality["profile"]["name"]
+
+    # 内省で identity だけが変わった場合も、設定側の整形結果は使い回す
+    persona_description, speech_examples_text = _persona_cached(_ObjRef(Personality))
+    beliefs_text, values_text, latest_reflection_text = _identity_cached(_ObjRef(IdentityData), _identity_version)
+
+    static_head = _STATIC_HEAD_TEMPLATE.format(
+        ai_name=ai_name,
+        persona_description=persona_description,
+        speech_examples_text=speech_examples_text,
+        beliefs_text=beliefs_text,
+        values_text=values_text,
+        latest_reflection_text=latest_reflection_text,
+    )
+
+    if len(_static_cache) >= _STATIC_CACHE_MAX:
+        _static_cache.clear()
+    # オブジェクト自体も保持して id() の再利用を防ぐ
+    _static_cache[key] = (Personality, IdentityData, ai_name, static_head)
+    logger.debug("Static prompt sections built and cached (length: %d).", len(static_head))
+    return ai_name, static_head
+
+# --- プロンプト構築クラス ---
+class PromptBuilder:
+    """
+    PersonalityとIdentityDataを保持し、対話用のプロンプトを構築するクラス。
+    設定・内面の静的セクションはインスタンスに保持し、内省で identity が更新されたときだけ作り直す。
+    """
+    def __init__(self, Personality: Optional[Dict[str, Any]] = None, IdentityData: Optional[Dict[str, Any]] = None, ai_name: Optional[str] = None):
+        self.Personality = Personality
+        self.IdentityData = IdentityData
+        self.AiName = ai_name # 呼び出し側で決まっていれば渡す (None なら Personality から取り出す)
+        # ホットパスで毎回モジュールのグローバルを引かないよう、整形関数を束縛しておく
+        self._format_memories = format_memories
+        self._format_logs = format_logs
+        self._template = _PROMPT_TEMPLATE
+        self.Refresh()
+
+    def Refresh(self):
+        """静的セクション (AI名・設定・内面) を作り直す"""
+        self._version = _identity_version
+        self.ai_name, self._static_head = _get_static_sections(self.Personality, self.IdentityData, self.AiName)
+
+    def Build(self, UserInput: str, Memories: List[Any], Logs: List[Any]) -> str:
+        """
+        対話に必要な情報を組み合わせてLLMへのプロンプトを構築する。
+        AIのアイデンティティ、性格、記憶、ログ、配信者設定、禁止事項を考慮する。
+        """
+        logger.info("プロンプトを構築中...")
+        if logger.isEnabledFor(logging.DEBUG): # INFO運用時はスライスごと省略する
+            logger.debug("ユーザー入力: '%s...'", UserInput[:50])
+
+        # --- 1. 情報の抽出と整形 ---
+        # 設定・内面の部分は保持済みのものを使い、記憶・ログ・ユーザー入力のみ毎回整形する
+        if self._version != _identity_version:
+            self.Refresh()
+        ai_name = self.ai_name
+        memory_section = self._format_memories(Memories)
+        # ログは最新のものをいくつか表示するのが一般的 (例: 最新5件など)
+        recent_logs = Logs[-5:] # 例として最新5件 (件数表示にも使うので一度だけスライスする)
+        log_section = self._format_logs(recent_logs, ai_name=ai_name)
+
+        # --- 2. プロンプト文字列の組み立て ---
+        # 設定と内面 (キャッシュ済み) に、記憶・履歴・ユーザー入力を埋め込む
+        final_prompt = self._template.format(
+            static_head=self._static_head,
+            memory_section=memory_section,
+            log_count=len(recent_logs), # 表示件数を明記
+            log_section=log_section,
+            UserInput=UserInput,
+            ai_name=ai_name,
+        )
+
+        logger.info("プロンプト構築完了 (長さ: %d 文字).", len(final_prompt))
+        if logger.isEnabledFor(logging.DEBUG): # INFO運用時はスライスごと省略する
+            logger.debug("最終プロンプト冒頭:\n---\n%s...\n---", final_prompt[:500]) # デバッグ用にプロンプト冒頭をログ出力
+        return final_prompt
+
+# --- プロンプト構築関数 ---
+def BuildPrompt(UserInput: str, Memories: List[Any], Logs: List[Any], Personality: Optional[Dict[str, Any]] = None, IdentityData: Optional[Dict[str, Any]] = None, ai_name: Optional[str] = None) -> str:
+    """
+    対話に必要な情報を組み合わせてLLMへのプロンプトを構築する。
+    (後方互換のためのラッパー。繰り返し呼ぶ場合は PromptBuilder を保持して使うこと)
+    ai_name を渡すと Personality からの名前の取り出しを省略する。
+    """
+    return PromptBuilder(Personality, IdentityData, ai_name).Build(UserInput, Memories, Logs)
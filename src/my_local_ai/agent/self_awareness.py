@@ -1,58 +1,281 @@
 # src/my_local_ai/agent/self_awareness.py
 
 import json
+import mmap
 import os
-import traceback
+import re
 import time
 from datetime import datetime, timezone # timezone をインポート
 from pathlib import Path
 import logging
-from typing import Optional, List, Dict
+from collections import deque
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional, List, Dict, Iterable, Iterator, Tuple
 
 logger = logging.getLogger(__name__)
 
+# ciso8601 (C実装のISO 8601パーサ) があればタイムスタンプの解析に使う
+try:
+    import ciso8601
+except ImportError:
+    ciso8601 = None
+
+# msgspec があればログ行をスキーマ付きで直接デコードする (使わないキーは辞書として作られない)
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
 # (GeminiClientのインポートとエラーハンドリング)
 try:
-    from my_local_ai.llm.gemini import GeminiClient
+    from my_local_ai.llm.gemini import GeminiClient, get_gemini_client
     logger.debug("GeminiClient imported successfully.")
 except ModuleNotFoundError:
     # ... (エラー処理) ...
-    GeminiClient = None
+    GeminiClient = get_gemini_client = None
 except ImportError as e:
      # ... (エラー処理) ...
-     GeminiClient = None
+     GeminiClient = get_gemini_client = None
+
+from my_local_ai.agent.prompts import bump_identity_version
+from my_local_ai.utils import fast_json
+from my_local_ai.utils.data_loaders import (
+    append_reflections, read_identity_file, read_latest_reflection, reflections_path_for, tail_jsonl, write_identity_file,
+)
 
 
 
 # --- 定数 ---
 # プロンプトに含める差分ログの最大件数 (長すぎるとLLMが扱えないため)
 MAX_DIFF_LOGS_FOR_PROMPT = 20 # 必要に応じて調整
-DEFAULT_REFLECTION_DIALOGUE_COUNT = 10 # 差分がない場合のデフォルト件数 (既存)
+# LLM 応答を囲む Markdown のコードフェンス (```json / ```JSON / ``` 、前後の空白・改行も許容) から中身を取り出す
+_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*\n?(.*?)\n?\s*```\s*$', re.IGNORECASE | re.DOTALL)
+# プロンプトに含める対話記録のトークン数の上限 (件数だけでは長文が続いたときにプロンプトが膨らむため)
+MAX_PROMPT_TOKENS = 6000
+
+def _estimate_tokens(text: str) -> int:
+    """トークン数の概算 (UTF-8 で約4バイト=1トークン。日本語は1文字あたり約0.75トークンになる)"""
+    return len(text.encode("utf-8")) // 4 + 1
+
+def _fit_dialogue_to_budget(logs: List["ReflectionLog"], max_tokens: int) -> List[str]:
+    """
+    新しいログから順に対話テキストを詰め、トークン予算に収まる分だけを古い順で返す。
+    (最新の1件は予算を超えても必ず含める)
+    """
+    selected = []
+    used = 0
+    for item in reversed(logs):
+        text = f"User: {item.UserInput}\nAssistant: {item.AssistantResponse}"
+        used += _estimate_tokens(text)
+        if selected and used > max_tokens:
+            break
+        selected.append(text)
+    selected.reverse()
+    return selected
+
+# --- ストリーミング応答から JSON オブジェクトを切り出す ---
+def _collect_json_object(chunks: Iterable[str]) -> str:
+    """
+    LLM のストリーミング応答の断片を連結し、最初の JSON オブジェクトが閉じた時点で読み込みを打ち切る。
+    文字列リテラル内の波括弧やエスケープは無視して括弧の深さを数える。
+    オブジェクトが閉じた場合はその部分 ('{' から '}' まで) を、閉じなかった場合は受け取った全文を返す。
+    """
+    parts = []
+    depth = 0
+    start = -1 # 連結後の文字列における最初の '{' の位置
+    in_string = False
+    escaped = False
+    offset = 0 # これまでに受け取った文字数
+    for chunk in chunks:
+        parts.append(chunk)
+        for i, ch in enumerate(chunk):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                if start >= 0:
+                    in_string = True
+            elif ch == "{":
+                if start < 0:
+                    start = offset + i
+                depth += 1
+            elif ch == "}" and start >= 0:
+                depth -= 1
+                if depth == 0:
+                    text = "".join(parts)
+                    logger.debug("JSON object closed in stream. Stopping read early.")
+                    return text[start:offset + i + 1]
+        offset += len(chunk)
+    return "".join(parts)
+
+# --- 内省で使うログの項目 ---
+# 内省ではタイムスタンプ・ユーザー入力・応答の3項目しか使わないため、それだけを持つ型にデコードする
+# (欠けている項目の既定値はプロンプトに表示する文字列)
+if msgspec is not None:
+    class ReflectionLog(msgspec.Struct, kw_only=True):
+        Timestamp: Optional[str] = None
+        UserInput: Optional[str] = "(入力不明)"
+        AssistantResponse: Optional[str] = "(応答不明)"
+
+    _log_decoder = msgspec.json.Decoder(ReflectionLog)
+    _LOG_DECODE_ERRORS = (msgspec.DecodeError, fast_json.JSONDecodeError) # ValidationError は DecodeError のサブクラス
+
+    def _decode_log_line(line: bytes) -> "ReflectionLog":
+        return _log_decoder.decode(line)
+else:
+    @dataclass(slots=True)
+    class ReflectionLog:
+        Timestamp: Optional[str] = None
+        UserInput: Optional[str] = "(入力不明)"
+        AssistantResponse: Optional[str] = "(応答不明)"
+
+    _LOG_DECODE_ERRORS = (fast_json.JSONDecodeError,)
+
+    def _decode_log_line(line: bytes) -> "ReflectionLog":
+        return _log_from_dict(fast_json.loads(line))
+
+def _log_from_dict(log_data: Dict) -> ReflectionLog:
+    """デコード済みのログ (辞書) を ReflectionLog に変換する"""
+    return ReflectionLog(
+        Timestamp=log_data.get("Timestamp"),
+        UserInput=log_data.get("UserInput", "(入力不明)"),
+        AssistantResponse=log_data.get("AssistantResponse", "(応答不明)"),
+    )
+
+# --- LLM が返す内省 JSON の検証 ---
+# Date は保存時に内省の時刻で上書きするため、LLM の出力になくてもよい
+if msgspec is not None:
+    class ReflectionSchema(msgspec.Struct, kw_only=True):
+        Date: str = ""
+        Context: str
+        Insight: str
+        RelatedBeliefs: List[int]
+        RelatedValues: List[int]
+
+    _reflection_decoder = msgspec.json.Decoder(ReflectionSchema)
+
+    def _decode_reflection(text: str) -> Dict:
+        """内省 JSON をパースと同時にスキーマ検証し、辞書で返す。不正な場合は ValueError を送出する。"""
+        try:
+            return msgspec.to_builtins(_reflection_decoder.decode(text))
+        except msgspec.ValidationError as e:
+            raise ValueError(f"LLM response failed schema validation: {e}") from e
+        except msgspec.DecodeError as e:
+            raise ValueError(f"Failed to parse LLM response JSON: {e}. Received text (first 500 chars): {text[:500]}...") from e
+else:
+    _REFLECTION_REQUIRED_KEYS = ("Context", "Insight", "RelatedBeliefs", "RelatedValues")
+
+    def _decode_reflection(text: str) -> Dict:
+        """内省 JSON をパースして検証し、辞書で返す。不正な場合は ValueError を送出する。"""
+        try:
+            reflection_data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Failed to parse LLM response JSON: {e}. Received text (first 500 chars): {text[:500]}...") from e
+        if not isinstance(reflection_data, dict):
+            raise ValueError(f"LLM response is not a JSON object: {type(reflection_data).__name__}")
+        missing = [k for k in _REFLECTION_REQUIRED_KEYS if k not in reflection_data]
+        if missing:
+            raise ValueError(f"LLM response missing required keys: {missing}. Found: {list(reflection_data.keys())}")
+        for key in ("RelatedBeliefs", "RelatedValues"):
+            if not isinstance(reflection_data[key], list) or not all(isinstance(i, int) for i in reflection_data[key]):
+                raise ValueError(f"LLM response '{key}' is not a list of integers.")
+        return reflection_data
+
+# --- ヘルパー関数 (ログの読み込み位置) ---
+def _get_log_cursor_offset(identity: Dict, log_path: Path, log_stat: os.stat_result) -> Optional[int]:
+    """
+    identity に保存された前回の読み込み位置 (ReflectionLogCursor) が使えればそのバイトオフセットを返す。
+    別のファイル、ローテーション (inode の変化)、ファイルの縮小を検出した場合は None を返す (全体を読み直す)。
+    """
+    cursor = identity.get("ReflectionLogCursor")
+    if not isinstance(cursor, dict):
+        return None
+    offset = cursor.get("offset")
+    if cursor.get("path") != str(log_path) or cursor.get("inode") != log_stat.st_ino:
+        logger.info("Log cursor does not match the current log file (path or inode changed). Reading the whole log.")
+        return None
+    if not isinstance(offset, int) or offset < 0 or offset > log_stat.st_size:
+        logger.info("Log cursor offset is out of range (log truncated?). Reading the whole log.")
+        return None
+    return offset
+
+def _iter_log_lines(f, start: int = 0) -> Iterator[bytes]:
+    """
+    開いたバイナリファイルを mmap し、start 以降の行を (改行付きの) bytes として返す。
+    改行位置は mmap.find で探すため、Python のファイルイテレータ経由の行ごとのバッファ処理を省ける。
+    """
+    if os.fstat(f.fileno()).st_size == 0:
+        return # 空ファイルは mmap できない
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = start
+        end = len(mm)
+        while pos < end:
+            nl = mm.find(b"\n", pos)
+            next_pos = end if nl == -1 else nl + 1
+            yield mm[pos:next_pos]
+            pos = next_pos
+
+def _last_line_end(log_path: Path, size: int, block_size: int = 8192) -> int:
+    """size までのうち最後の改行の直後のオフセットを返す (改行で終わらない書き込み途中の行は含めない)"""
+    with log_path.open('rb') as f:
+        pos = size
+        while pos > 0:
+            read_size = min(block_size, pos)
+            pos -= read_size
+            f.seek(pos)
+            nl = f.read(read_size).rfind(b"\n")
+            if nl != -1:
+                return pos + nl + 1
+    return 0
+
+# --- ヘルパー関数 (信念・価値観の整形) ---
+# Beliefs / Values は内省のたびに少しずつしか変わらないため、整形済みの文字列をキャッシュする
+@lru_cache(maxsize=8)
+def _format_bullet_list(items: Tuple[str, ...]) -> str:
+    """項目を "- " 付きの箇条書きにする (空なら「(まだありません)」)"""
+    return "\n".join(f"- {item}" for item in items) or "(まだありません)"
+
+def _bullet_list(items: Optional[Iterable]) -> str:
+    """_format_bullet_list のキャッシュを使って整形する (ハッシュできない項目が混ざる場合はその場で整形)"""
+    items = tuple(items or ())
+    try:
+        return _format_bullet_list(items)
+    except TypeError:
+        return _format_bullet_list.__wrapped__(items)
 
 # --- ヘルパー関数 (タイムスタンプ変換) ---
+# ログ1行ごとに呼ばれ、同じ文字列 (前回の内省時刻など) も繰り返し渡されるため結果をキャッシュする
+# (datetime は不変なので共有しても安全)
+@lru_cache(maxsize=8192)
 def parse_timestamp(ts_str: str) -> Optional[datetime]:
     """ISO 8601形式などのタイムスタンプ文字列をdatetimeオブジェクトに変換"""
     # タイムゾーン情報がある場合とない場合を考慮
     try:
         # ISO 8601 (e.g., 2025-04-19T17:13:26.859920 or with Z/offset)
-        # Python 3.11+なら fromisoformat が 'Z' も扱える
-        if ts_str.endswith('Z'):
-             ts_str = ts_str[:-1] + '+00:00'
-        dt = datetime.fromisoformat(ts_str)
-        # タイムゾーン情報がない場合は naive なので、UTC とみなすか、ローカルタイムとみなすか
-        # ここでは UTC と仮定する (ログ保存時に合わせるのがベスト)
+        if ciso8601 is not None:
+            dt = ciso8601.parse_datetime(ts_str) # 'Z' もそのまま扱える
+        else:
+            # Python 3.11+なら fromisoformat が 'Z' も扱える
+            if ts_str.endswith('Z'):
+                 ts_str = ts_str[:-1] + '+00:00'
+            dt = datetime.fromisoformat(ts_str)
+        # タイムゾーン情報がない場合は naive なので、ローカルタイムとみなして UTC に変換する
+        # (LogManager.SaveLog はローカルタイムの naive な文字列で保存する。旧形式の内省の Date も同じ)
         if dt.tzinfo is None:
-             dt = dt.replace(tzinfo=timezone.utc)
-             # logger.warning(f"Timestamp '{ts_str}' has no timezone info, assuming UTC.")
+             dt = dt.astimezone(timezone.utc)
         return dt
     except ValueError:
         # 以前のフォーマット ("%Y-%m-%d %H:%M:%S") も試す (必要なら)
         try:
             dt = datetime.strptime(ts_str, "%Y-%m-%d %H:%M:%S")
-            # ローカルタイムと仮定し、UTC に変換するかどうか？ (要検討)
-            # ここでは naive のままにするか、UTC を仮定する
-            dt = dt.replace(tzinfo=timezone.utc) # 例: UTC と仮定
-            logger.warning(f"Parsed timestamp '{ts_str}' using fallback format, assuming UTC.")
+            dt = dt.astimezone(timezone.utc) # ローカルタイムとみなして UTC に変換する
+            logger.warning(f"Parsed timestamp '{ts_str}' using fallback format, assuming local time.")
             return dt
         except ValueError:
              logger.error(f"Could not parse timestamp: {ts_str}. Skipping comparison.")
@@ -61,30 +284,12 @@ def parse_timestamp(ts_str: str) -> Optional[datetime]:
         logger.error(f"Error parsing timestamp '{ts_str}': {e}")
         return None
 
-# --- 内省生成関数 (差分ログ・メタ内省対応版) ---
-def generate_reflection_from_logs(log_path: Path, identity_path: Path, api_key: str):
+# --- 内省の下準備 (identity の読み込み・差分ログの抽出) ---
+def _load_identity(identity_path: Path) -> Tuple[Dict, Optional[datetime], str]:
     """
-    Reads conversation logs since the last reflection, generates a self-reflection
-    (including meta-reflection on previous insight), and appends it to the identity JSON file.
+    identity.json を読み込み、(identity, 前回の内省時刻, 前回の内省内容) を返す。
+    ファイルがない・壊れている場合は空の identity として扱う。
     """
-    if GeminiClient is None:
-        logger.error("GeminiClient is not available, cannot generate reflection.")
-        return
-
-    current_timestamp_iso = datetime.now().isoformat()
-    logger.info(f"[{current_timestamp_iso}] Starting reflection generation process...")
-    logger.debug(f"  Log path: {log_path}")
-    logger.debug(f"  Identity path: {identity_path}")
-
-    # === 1. Initialize LLM Client ===
-    try:
-        llm_client = GeminiClient(api_key=api_key, model_name="gemini-1.5-pro") # モデル名は設定ファイル化推奨
-        logger.info("GeminiClient initialized successfully.")
-    except Exception as e:
-        logger.exception("Failed to initialize GeminiClient")
-        return
-
-    # === 2. Load Identity and Find Last Reflection Time ===
     identity = {}
     last_reflection_time = None
     previous_insight = "(前回の内省はありません)" # メタ内省用の変数
@@ -92,14 +297,13 @@ def generate_reflection_from_logs(log_path: Path, identity_path: Path, api_key:
     if identity_path.exists():
         logger.info(f"Reading identity from '{identity_path.name}'...")
         try:
-            with identity_path.open('r', encoding='utf-8') as f:
-                identity = json.load(f)
+            # キャッシュと共有される辞書なので、書き換える前に浅いコピーにする
+            identity = dict(read_identity_file(identity_path))
             logger.info("Identity loaded successfully.")
 
-            # Find the timestamp of the latest reflection
-            reflections = identity.get("Reflections", [])
-            if reflections:
-                latest_reflection = reflections[-1]
+            # Find the timestamp of the latest reflection (reflections.jsonl の末尾1行だけを読む)
+            latest_reflection = read_latest_reflection(identity_path, identity)
+            if latest_reflection:
                 latest_reflection_date_str = latest_reflection.get("Date")
                 previous_insight = latest_reflection.get("Insight", "(前回の内省内容なし)") # 最新=前回のを取得
                 if latest_reflection_date_str:
@@ -121,34 +325,55 @@ def generate_reflection_from_logs(log_path: Path, identity_path: Path, api_key:
     # Ensure base structure for new/corrupted file
     identity.setdefault("Beliefs", [])
     identity.setdefault("Values", [])
-    identity.setdefault("Reflections", [])
     identity.setdefault("LastUpdated", "")
+    return identity, last_reflection_time, previous_insight
 
-    # === 3. Load Logs (Only New Ones if Possible) ===
-    if not log_path.exists():
-        logger.warning(f"Log file not found: {log_path}. Skipping reflection.")
-        return
-
-    all_logs = [] # Keep all logs in memory for now (improvement: read only needed lines)
-    new_logs_for_prompt = []
+def _scan_new_logs(log_path: Path, identity: Dict, last_reflection_time: Optional[datetime]) -> Optional[Tuple[deque, Dict]]:
+    """
+    前回の内省以降のログを読み、(プロンプト用の新しいログ, 今回読み終えた位置のカーソル) を返す。
+    読み込みに失敗した場合は None を返す。
+    """
+    # プロンプトに使うのは最新 MAX_DIFF_LOGS_FOR_PROMPT 件だけなので、それ以上は保持しない
+    new_logs_for_prompt = deque(maxlen=MAX_DIFF_LOGS_FOR_PROMPT)
     logs_read_count = 0
     valid_log_count = 0
     parse_errors = 0
 
     try:
         logger.info(f"Reading logs from '{log_path.name}'...")
-        with log_path.open('r', encoding='utf-8') as f:
-            for i, line in enumerate(f):
+        log_stat = log_path.stat()
+        cursor_offset = _get_log_cursor_offset(identity, log_path, log_stat)
+        if cursor_offset is not None:
+            logger.info(f"Resuming log read from byte offset {cursor_offset} (saved cursor).")
+            # カーソル以降はすべて前回の内省より後のログなので、タイムスタンプ比較は不要
+            last_reflection_time = None
+        elif last_reflection_time is None:
+            # 初回 (カーソルも前回の内省時刻もない) はすべてのログが新しいので、プロンプトに使う末尾の
+            # MAX_DIFF_LOGS_FOR_PROMPT 件だけをファイルの末尾から逆方向に読む (ファイル全体は読まない)
+            consumed_offset = _last_line_end(log_path, log_stat.st_size)
+            new_logs_for_prompt.extend(
+                _log_from_dict(log) for log in tail_jsonl(log_path, MAX_DIFF_LOGS_FOR_PROMPT, end=consumed_offset) if isinstance(log, dict)
+            )
+            logger.info(f"No log cursor or previous reflection. Read the last {len(new_logs_for_prompt)} log entries from the end of the file.")
+            return new_logs_for_prompt, {"path": str(log_path), "offset": consumed_offset, "inode": log_stat.st_ino}
+        consumed_offset = cursor_offset or 0
+        # バイト列のまま orjson (あれば) に渡す (行ごとの UTF-8 デコードと strip を省く。末尾の改行は無視される)
+        with log_path.open('rb') as f:
+            for i, line in enumerate(_iter_log_lines(f, cursor_offset or 0)):
                 logs_read_count += 1
-                line = line.strip()
-                if not line: continue
+                # 改行で終わらない最終行は書き込み途中の可能性があるため、パースできたときだけカーソルを進める
+                line_complete = line.endswith(b"\n")
+                if line_complete:
+                    consumed_offset += len(line)
+                if line.isspace(): continue
                 try:
-                    log_entry = json.loads(line)
-                    all_logs.append(log_entry) # Store all logs for potential full history access if needed later
+                    log_entry = _decode_log_line(line)
+                    if not line_complete:
+                        consumed_offset += len(line)
 
                     # --- Check if log is new ---
                     is_new = True # Assume new if no last reflection time
-                    log_ts_str = log_entry.get("Timestamp")
+                    log_ts_str = log_entry.Timestamp
                     if last_reflection_time and log_ts_str:
                         log_time = parse_timestamp(log_ts_str)
                         if log_time and log_time > last_reflection_time:
@@ -160,22 +385,73 @@ def generate_reflection_from_logs(log_path: Path, identity_path: Path, api_key:
                         new_logs_for_prompt.append(log_entry)
                         valid_log_count += 1 # Count valid new logs
 
-                except json.JSONDecodeError:
+                except _LOG_DECODE_ERRORS:
                     parse_errors += 1
                 except Exception as e: # Catch other potential errors during processing
                      logger.warning(f"Error processing log line {i+1}: {e}")
                      parse_errors += 1
 
-        logger.info(f"Read {logs_read_count} lines. Found {len(new_logs_for_prompt)} new log entries since last reflection.")
+        log_cursor = {"path": str(log_path), "offset": consumed_offset, "inode": log_stat.st_ino}
+        logger.info(f"Read {logs_read_count} lines. Found {valid_log_count} new log entries since last reflection.")
         if parse_errors > 0:
              logger.warning(f"Skipped {parse_errors} lines due to parsing errors.")
+        return new_logs_for_prompt, log_cursor
 
     except IOError as io_err:
         logger.error(f"Failed to read log file '{log_path.name}': {io_err}")
-        return
     except Exception as e:
         logger.exception(f"Unexpected error processing log file '{log_path.name}'")
+    return None
+
+# --- 内省生成関数 (差分ログ・メタ内省対応版) ---
+def generate_reflection_from_logs(log_path: Path, identity_path: Path, api_key: str) -> Optional[Dict]:
+    """
+    Reads conversation logs since the last reflection, generates a self-reflection
+    (including meta-reflection on previous insight), and appends it to the identity JSON file.
+
+    Returns:
+        Optional[Dict]: The updated identity dict that was saved, or None if no reflection was saved.
+    """
+    if GeminiClient is None:
+        logger.error("GeminiClient is not available, cannot generate reflection.")
+        return
+
+    # この内省の時刻は1回だけ取得し、プロンプト・Date・LastUpdated のすべてで使う
+    # (UTC の aware な時刻で保存する。ログの naive な Timestamp は parse_timestamp がローカルタイムとして UTC に変換する)
+    now = datetime.now(timezone.utc)
+    now_iso = now.isoformat()
+    logger.info(f"[{now_iso}] Starting reflection generation process...")
+    logger.debug(f"  Log path: {log_path}")
+    logger.debug(f"  Identity path: {identity_path}")
+
+    # === 1. Initialize LLM Client (in background) ===
+    # クライアントの初期化 (API設定・モデル準備) は identity とログの読み込みと独立しているため、
+    # 別スレッドで並行して進め、プロンプトを組み立てる直前に結果を受け取る
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="gemini-init") as executor:
+        # 同じ APIキー・モデルのクライアントは使い回す (2回目以降の内省では初期化を省く)
+        client_future = executor.submit(get_gemini_client, api_key, "gemini-1.5-pro") # モデル名は設定ファイル化推奨
+
+        # === 2. Load Identity and Find Last Reflection Time ===
+        identity, last_reflection_time, previous_insight = _load_identity(identity_path)
+
+        # === 3. Load Logs (Only New Ones if Possible) ===
+        # (カーソル・前回の内省時刻が identity にあるため、identity の後に読む)
+        scan_result = None
+        if not log_path.exists():
+            logger.warning(f"Log file not found: {log_path}. Skipping reflection.")
+        else:
+            scan_result = _scan_new_logs(log_path, identity, last_reflection_time)
+
+        try:
+            llm_client = client_future.result()
+            logger.info("GeminiClient initialized successfully.")
+        except Exception as e:
+            logger.exception("Failed to initialize GeminiClient")
+            return
+
+    if scan_result is None:
         return
+    new_logs_for_prompt, log_cursor = scan_result
 
     # If no new logs, maybe skip reflection? Or reflect on overall state?
     if not new_logs_for_prompt:
@@ -184,28 +460,20 @@ def generate_reflection_from_logs(log_path: Path, identity_path: Path, api_key:
         return
 
     # Limit the number of logs sent to the LLM prompt
-    logs_to_use_in_prompt = new_logs_for_prompt[-MAX_DIFF_LOGS_FOR_PROMPT:]
+    logs_to_use_in_prompt = list(new_logs_for_prompt) # deque が既に最新 MAX_DIFF_LOGS_FOR_PROMPT 件に絞っている
     logger.info(f"Using the latest {len(logs_to_use_in_prompt)} new logs for the prompt.")
 
-    # --- Fallback if no new logs were identified (e.g., first run, timestamp issues) ---
-    # Use last N overall logs if new_logs is empty but all_logs is not
-    if not logs_to_use_in_prompt and all_logs:
-         logger.warning("Could not identify new logs based on timestamp, falling back to last overall logs.")
-         logs_to_use_in_prompt = all_logs[-DEFAULT_REFLECTION_DIALOGUE_COUNT:]
-         previous_insight = "(前回の内省はありません - タイムスタンプ比較不可)" # Reset previous insight if falling back
-
     # === 4. Prepare Meta-Reflection Prompt ===
     logger.info("Preparing meta-reflection prompt...")
     # Format the logs to be included in the prompt
-    dialogue_text = "\n".join(
-        [f"User: {item.get('UserInput', '(入力不明)')}\nAssistant: {item.get('AssistantResponse', '(応答不明)')}"
-         for item in logs_to_use_in_prompt] # Use the selected logs
-    )
-    beliefs_text = "\n".join([f"- {b}" for b in identity.get("Beliefs", [])]) if identity.get("Beliefs") else "(まだありません)"
-    values_text = "\n".join([f"- {v}" for v in identity.get("Values", [])]) if identity.get("Values") else "(まだありません)"
+    dialogue_entries = _fit_dialogue_to_budget(logs_to_use_in_prompt, MAX_PROMPT_TOKENS)
+    if len(dialogue_entries) < len(logs_to_use_in_prompt):
+        logger.info(f"Token budget ({MAX_PROMPT_TOKENS}) reached. Using the latest {len(dialogue_entries)} of {len(logs_to_use_in_prompt)} logs.")
+    dialogue_text = "\n".join(dialogue_entries)
+    beliefs_text = _bullet_list(identity.get("Beliefs"))
+    values_text = _bullet_list(identity.get("Values"))
 
     # Construct the meta-reflection prompt
-    current_time_for_prompt = datetime.now().isoformat() # Time for the prompt's Date field instruction
     prompt = f"""
 あなたはAIアシスタント「星澪」として、ユーザーとの対話を通じて自己認識を深めます。
 あなたは今回、**前回の内省**を踏まえ、その後の**対話記録（差分ログ）**を分析し、自己の成長と課題について**メタ的な内省**を行います。
@@ -220,7 +488,7 @@ def generate_reflection_from_logs(log_path: Path, identity_path: Path, api_key:
 {previous_insight}
 --- 前回の内省ここまで ---
 
---- 対話記録（前回の内省以降の差分ログ、最大{len(logs_to_use_in_prompt)}件） ---
+--- 対話記録（前回の内省以降の差分ログ、最大{len(dialogue_entries)}件） ---
 {dialogue_text}
 --- 対話記録ここまで ---
 
@@ -232,7 +500,7 @@ def generate_reflection_from_logs(log_path: Path, identity_path: Path, api_key:
 3.  **今後の指針:** 上記の分析を踏まえ、今後の対話で特に意識したいこと、改善したい点を明確にしてください。
 
 内省結果は、以下のJSON形式で記述してください。
-- "Date": 内省を行った現在の日時 (ISO 8601形式)。LLMはこれを推測せず、現在の正確な時刻を使ってください: {current_time_for_prompt}
+- "Date": 内省を行った現在の日時 (ISO 8601形式)。LLMはこれを推測せず、現在の正確な時刻を使ってください: {now_iso}
 - "Context": 今回の内省のきっかけとなった、差分ログ期間中の特に重要な対話場面やテーマ、および「前回の内省の活用度評価」というメタ的な視点。
 - "Insight": 上記の指示1, 2, 3を含む、深く掘り下げた内省内容。**メタ内省（自己評価）部分を明確に記述すること。**
 - "RelatedBeliefs": この内省が関連する信念リストのインデックス番号（0始まりの数字のリスト、なければ []）。
@@ -248,7 +516,8 @@ def generate_reflection_from_logs(log_path: Path, identity_path: Path, api_key:
     try:
         logger.info("Generating meta-reflection via Gemini API...")
         start_time = time.time()
-        reflection_json_str = llm_client.generate(prompt) # Execute the prompt
+        # ストリーミングで受け取り、JSON オブジェクトが閉じた時点で打ち切る (以降の出力を待たない)
+        reflection_json_str = _collect_json_object(llm_client.generate(prompt, stream=True)) # Execute the prompt
         end_time = time.time()
         logger.info(f"LLM execution finished in {end_time - start_time:.2f} seconds.")
 
@@ -258,40 +527,24 @@ def generate_reflection_from_logs(log_path: Path, identity_path: Path, api_key:
         logger.debug(f"Raw LLM Response (first 500 chars): {reflection_json_str[:500]}...")
 
         # --- Parse LLM Response ---
-        cleaned_json_str = reflection_json_str.strip()
-        # (Markdown ```json ``` の除去処理はそのまま)
-        if cleaned_json_str.startswith("```json") and cleaned_json_str.endswith("```"):
-            cleaned_json_str = cleaned_json_str[7:-3].strip()
-        elif cleaned_json_str.startswith("```") and cleaned_json_str.endswith("```"):
-             cleaned_json_str = cleaned_json_str[3:-3].strip()
-
-        reflection_data = json.loads(cleaned_json_str) # Parse JSON
-
-        # --- Overwrite Date and Validate ---
-        current_iso_time_for_save = datetime.now().isoformat() # Get current time again just before saving
-        logger.info(f"Overwriting 'Date' field with current time: {current_iso_time_for_save}")
-        reflection_data["Date"] = current_iso_time_for_save # Overwrite date
-
-        # --- Validation ---
-        required_keys = ["Date", "Context", "Insight", "RelatedBeliefs", "RelatedValues"]
-        if not isinstance(reflection_data, dict) or not all(key in reflection_data for key in required_keys):
-            missing = [k for k in required_keys if k not in reflection_data]
-            raise ValueError(f"LLM response missing required keys: {missing}. Found: {list(reflection_data.keys())}")
-        if not isinstance(reflection_data["RelatedBeliefs"], list) or not all(isinstance(i, int) for i in reflection_data["RelatedBeliefs"]):
-             raise ValueError("LLM response 'RelatedBeliefs' is not a list of integers.")
-        if not isinstance(reflection_data["RelatedValues"], list) or not all(isinstance(i, int) for i in reflection_data["RelatedValues"]):
-             raise ValueError("LLM response 'RelatedValues' is not a list of integers.")
+        # Markdown のコードフェンスで囲まれていれば中身だけを取り出す
+        fence_match = _FENCE_RE.match(reflection_json_str)
+        cleaned_json_str = fence_match.group(1) if fence_match else reflection_json_str.strip()
+
+        # --- Parse and Validate (msgspec があればパースと同時にスキーマ検証する) ---
+        reflection_data = _decode_reflection(cleaned_json_str)
+
+        # --- Overwrite Date ---
+        logger.info(f"Overwriting 'Date' field with reflection time: {now_iso}")
+        reflection_data["Date"] = now_iso # Overwrite date
+
         # Check if Insight contains some mention of meta-reflection (optional, basic check)
         if "前回の内省" not in reflection_data.get("Insight","") and "活かされ" not in reflection_data.get("Insight",""):
              logger.warning("Generated Insight might not contain the requested meta-reflection part.")
 
         logger.info("Reflection JSON parsed, validated, and Date overwritten successfully.")
 
-    except json.JSONDecodeError as e:
-        logger.error(f"Failed to parse LLM response JSON: {e}")
-        logger.error(f"Received text (first 500 chars): {reflection_json_str[:500]}...")
-        reflection_data = None
-    except ValueError as e:
+    except ValueError as e: # JSON のパース失敗も _decode_reflection で ValueError になる
         logger.error(f"LLM response validation or data extraction failed: {e}")
         reflection_data = None
     except Exception as e:
@@ -299,16 +552,29 @@ def generate_reflection_from_logs(log_path: Path, identity_path: Path, api_key:
         reflection_data = None
 
     # === 6. Save Updated Identity ===
+    saved_identity = None # 呼び出し元がファイルを再読み込みせずに済むよう、保存した内容を返す
     if reflection_data:
         try:
-            logger.info(f"Appending reflection and saving identity to '{identity_path.name}'...")
-            identity["Reflections"].append(reflection_data)
-            identity["LastUpdated"] = datetime.now().isoformat() # Update LastUpdated as well
-
+            reflections_path = reflections_path_for(identity_path)
+            logger.info(f"Appending reflection to '{reflections_path.name}' and saving identity to '{identity_path.name}'...")
+            # 内省は reflections.jsonl に追記する (identity.json に履歴全体を書き直さない)
+            # 移行: identity.json に残っている過去の内省は、reflections.jsonl がまだ空なら先に書き出して identity から外す
+            legacy_reflections = identity.pop("Reflections", None) or []
+            has_sidecar = reflections_path.is_file() and reflections_path.stat().st_size > 0
+            to_append = ([] if has_sidecar else list(legacy_reflections)) + [reflection_data]
+            if len(to_append) > 1:
+                logger.info(f"Migrating {len(to_append) - 1} reflections from '{identity_path.name}' to '{reflections_path.name}'.")
             identity_path.parent.mkdir(parents=True, exist_ok=True) # Ensure directory exists
-            with identity_path.open('w', encoding='utf-8') as f:
-                json.dump(identity, f, ensure_ascii=False, indent=2)
+            append_reflections(identity_path, to_append)
+
+            identity["LastUpdated"] = now_iso # Update LastUpdated as well
+            identity["ReflectionLogCursor"] = log_cursor # 次回はここからログを読む
+            write_identity_file(identity_path, identity) # 一時ファイル + os.replace で置き換える (キャッシュも更新)
             logger.info("✅ Reflection appended and identity.json saved successfully.")
+            bump_identity_version() # プロンプトの静的セクションのキャッシュを無効化
+            # 呼び出し側には load_identity_data と同じ形 (Reflections は最新1件) で返す
+            saved_identity = dict(identity)
+            saved_identity["Reflections"] = [reflection_data]
 
         except IOError as e:
             logger.error(f"Failed to write to '{identity_path.name}': {e}")
@@ -317,4 +583,5 @@ def generate_reflection_from_logs(log_path: Path, identity_path: Path, api_key:
     else:
         logger.warning("No valid reflection data obtained or processed. identity.json was not updated.")
 
-    logger.info(f"[{datetime.now().isoformat()}] Reflection generation process finished.")
\ No newline at end of file
+    logger.info(f"Reflection generation process (started {now_iso}) finished.")
+    return saved_identity
\ No newline at end of file
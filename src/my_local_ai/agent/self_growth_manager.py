@@ -13,7 +13,7 @@ class SelfGrowthManager:
             return
 
         # 最近のログを取得（直近5件程度）
-        recent_logs = self.LogManager.GetAllLogs()[-5:]
+        recent_logs = self.LogManager.GetLogsSlice(-5)
         if not recent_logs:
             print("ログが見つかりません。")
             return
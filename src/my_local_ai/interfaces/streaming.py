@@ -1,8 +1,8 @@
 # src/my_local_ai/interfaces/streaming.py
+import asyncio
 import time
 from pathlib import Path
 import json
-import traceback
 import logging # logging をインポート
 
 # --- このモジュール用のロガー ---
@@ -11,8 +11,9 @@ logger = logging.getLogger(__name__)
 # --- コアコンポーネントのインポート ---
 try:
     from my_local_ai.memory import Retriever
-    from my_local_ai.agent.prompts import BuildPrompt
-    from my_local_ai.llm.ollama import OllamaClient # ストリーミングもOllamaと仮定
+    from my_local_ai.agent.prompts import PromptBuilder, add_identity_listener
+    from my_local_ai.llm.ollama import ERROR_RESPONSES, get_ollama_client # ストリーミングもOllamaと仮定
+    from my_local_ai.llm.semantic_cache import SemanticCache
     from my_local_ai.agent.personality import PersonalityManager
     # identity ローダー (utilsからインポート)
     from my_local_ai.utils.data_loaders import load_identity_data
@@ -41,6 +42,7 @@ class StreamingInterface:
         self.stream_log_path = self.project_root / "data" / "stream_logs.json"
         self.config_path = self.project_root / "config" / "personality.json"
         self.identity_path = self.project_root / "config" / "identity.json"
+        self.response_cache_path = self.project_root / "data" / "stream_response_cache" # .npy / .json
 
         # Ensure data directory exists
         data_dir = self.project_root / "data"
@@ -60,11 +62,12 @@ class StreamingInterface:
             logger.info("  Initializing Retriever for streaming...")
             self.RetrieverInstance = Retriever(
                 memory_path=str(self.stream_memory_path),
-                log_path=str(self.stream_log_path)
+                log_path=str(self.stream_log_path),
+                preload_embedder=True # 以降の初期化や配信への接続と並行して Embedding モデルを読み込む
             )
 
             logger.info(f"  Initializing Executor ({self.model_name})...")
-            self.Executor = OllamaClient(model=self.model_name) # Use Ollama for streaming response
+            self.Executor = get_ollama_client(model=self.model_name) # Use Ollama for streaming response (shared per model)
 
             logger.info("  Initializing PersonalityManager...")
             self.Personality = PersonalityManager(configPath=str(self.config_path))
@@ -72,46 +75,108 @@ class StreamingInterface:
             logger.info("  Loading Identity Data...")
             self.IdentityData = load_identity_data(self.identity_path) # Use loader from utils
 
+            # AI名は一度だけ取り出してプロンプト構築に渡す
+            self._ai_name = self.Personality.GetProfile().get("name", "星澪")
+
+            logger.info("  Initializing PromptBuilder...")
+            self.PromptBuilder = PromptBuilder(self.Personality.GetAll(), self.IdentityData, ai_name=self._ai_name)
+
+            # 似たコメントへの応答を使い回すキャッシュ (コメントの Embedding で引く)
+            # 前回の配信から personality.json や identity が変わっていれば、保存済みの応答は読み込まない
+            self.ResponseCache = SemanticCache(path=self.response_cache_path, fingerprint=self._ResponseCacheFingerprint())
+            add_identity_listener(self.ResponseCache.Clear) # 内省で identity が更新されたら以前の応答は使わない
+
+            # 応答を返した後に裏で走らせているログ保存タスク (RespondToCommentAsync 参照)
+            self._pending_log_saves = set()
+
             logger.info("StreamingInterface initialization complete.")
 
         except Exception as e:
             logger.critical("FATAL: Error during StreamingInterface initialization", exc_info=True)
             raise
 
+    def RefreshPersonalityIfChanged(self) -> bool:
+        """personality.json が更新されていれば読み直し、PromptBuilder の静的セクションも作り直す。"""
+        if not self.Personality.refresh_if_changed():
+            return False
+        self._ai_name = self.Personality.GetProfile().get("name", "星澪")
+        self.PromptBuilder.Personality = self.Personality.GetAll()
+        self.PromptBuilder.AiName = self._ai_name
+        self.PromptBuilder.Refresh()
+        self.ResponseCache.Clear() # 以前のペルソナでの応答は使わない
+        self.ResponseCache.fingerprint = self._ResponseCacheFingerprint()
+        return True
+
+    def _ResponseCacheFingerprint(self) -> str:
+        """応答キャッシュが前提とする設定: 読み込んだ personality.json の mtime と identity の LastUpdated"""
+        return f"{self.Personality.GetLoadedMtime()}|{self.IdentityData.get('LastUpdated', '')}"
+
     def RespondToComment(self, Username: str, comment: str) -> str:
-        """Processes a single comment/message and returns the AI's response."""
+        """
+        Processes a single comment/message and returns the AI's response.
+        同期版の互換用ラッパー。イベントループ内からは RespondToCommentAsync を await すること。
+        """
+        async def _respond_and_flush():
+            response = await self.RespondToCommentAsync(Username, comment)
+            await self.FlushPendingLogs() # ループを閉じる前にログ保存を終わらせる
+            return response
+        return asyncio.run(_respond_and_flush())
+
+    async def RespondToCommentAsync(self, Username: str, comment: str, refresh_personality: bool = False) -> str:
+        """
+        Processes a single comment/message and returns the AI's response.
+        似たコメントへの応答がキャッシュにあれば検索・LLM を省いてそれを返す。
+        コメントの Embedding 計算と personality.json の更新チェックは互いに独立なので並行して実行し、
+        ログ保存は応答を返した後に裏で実行する (FlushPendingLogs で完了を待てる)。
+        """
         logger.info(f"Processing comment from '{Username}': '{comment[:50]}...'")
         if not comment:
              logger.warning("Received empty comment.")
              return "(コメントが空です)"
 
         try:
+            # 前回のログ保存が終わってから検索する (直前の会話も検索対象に含め、ログの同時更新も避ける)
+            await self.FlushPendingLogs()
+
+            # 0. Semantic cache (似たコメントへの応答があれば LLM を呼ばずに返す)
+            if refresh_personality:
+                comment_embedding, refreshed = await asyncio.gather(
+                    asyncio.to_thread(self._EmbedComment, comment), asyncio.to_thread(self.RefreshPersonalityIfChanged)
+                )
+                if refreshed:
+                    logger.info("personality.json の変更を反映しました。")
+            else:
+                comment_embedding = await asyncio.to_thread(self._EmbedComment, comment)
+            if comment_embedding is not None:
+                cached_response = self.ResponseCache.Lookup(comment_embedding)
+                if cached_response is not None:
+                    logger.info(f"Semantic cache hit. Reusing response: '{cached_response[:50]}...'")
+                    self._ScheduleSaveLog(comment, cached_response, Username)
+                    return cached_response
+
             start_time = time.time()
             # 1. Retrieve relevant info
-            memories, logs = self.RetrieverInstance.RetrieveRelevantInfo(comment)
+            # キャッシュ用に計算したコメントの Embedding を検索でも使う (Embed を1回で済ませる)
+            memories, logs = await asyncio.to_thread(self.RetrieverInstance.RetrieveRelevantInfo, comment, query_embedding=comment_embedding)
             retrieve_time = time.time() - start_time
             logger.info(f"Retrieved info in {retrieve_time:.2f}s (Memories: {len(memories)}, Logs: {len(logs)})")
 
-            # 2. Build prompt
-            personality_data = self.Personality.GetAll()
-            prompt = BuildPrompt(
-                UserInput=comment, Memories=memories, Logs=logs,
-                Personality=personality_data, IdentityData=self.IdentityData
-            )
-            logger.debug(f"Prompt built (length: {len(prompt)}).")
+            # 2. Build prompt (static persona/identity sections are kept by the builder)
+            prompt = self.PromptBuilder.Build(UserInput=comment, Memories=memories, Logs=logs)
+            logger.debug("Prompt built (length: %d).", len(prompt))
 
             # 3. Generate response
             logger.info("Executing LLM prompt...")
             start_llm_time = time.time()
-            response = self.Executor.ExecutePrompt(prompt)
+            response = await asyncio.to_thread(self.Executor.ExecutePrompt, prompt)
             llm_time = time.time() - start_llm_time
             logger.info(f"LLM execution time: {llm_time:.2f}s.")
 
-            # 4. Save log
-            start_log_time = time.time()
-            self.RetrieverInstance.LogManager.SaveLog(comment, response, Username=Username)
-            log_time = time.time() - start_log_time
-            logger.info(f"Log saved in {log_time:.2f}s.")
+            if comment_embedding is not None and response not in ERROR_RESPONSES:
+                self.ResponseCache.Store(comment_embedding, response)
+
+            # 4. Save log (応答を待たせないよう裏で実行)
+            self._ScheduleSaveLog(comment, response, Username)
 
             logger.info(f"Generated response: '{response[:50]}...'")
             return response
@@ -120,6 +185,30 @@ class StreamingInterface:
             logger.exception("Error during RespondToComment")
             return "(エラーが発生したため応答できません)"
 
+    def _EmbedComment(self, comment: str):
+        """セマンティックキャッシュ用にコメントの Embedding を計算する (失敗したら None)"""
+        embeddings = self.RetrieverInstance.Embedder.Embed(comment)
+        return embeddings[0] if embeddings and len(embeddings[0]) else None
+
+    def _ScheduleSaveLog(self, comment: str, response: str, Username: str):
+        task = asyncio.create_task(self._SaveLogAsync(comment, response, Username))
+        self._pending_log_saves.add(task)
+        task.add_done_callback(self._pending_log_saves.discard)
+
+    async def _SaveLogAsync(self, comment: str, response: str, Username: str):
+        start_log_time = time.time()
+        try:
+            await asyncio.to_thread(self.RetrieverInstance.LogManager.SaveLog, comment, response, Username=Username)
+        except Exception:
+            logger.exception("Error saving stream log")
+            return
+        logger.info(f"Log saved in {time.time() - start_log_time:.2f}s.")
+
+    async def FlushPendingLogs(self):
+        """裏で実行中のログ保存がすべて終わるまで待つ。"""
+        if self._pending_log_saves:
+            await asyncio.gather(*self._pending_log_saves)
+
     # --- Memory Management Methods ---
     def SaveStreamMemory(self, content: str):
         if not content: logger.warning("Attempted to save empty stream memory."); return
@@ -152,6 +241,13 @@ class StreamingInterface:
             logger.exception("Error getting stream memories")
             return []
 
+    def PersistResponseCache(self):
+        logger.info(f"Persisting response cache to {self.response_cache_path}...")
+        try:
+            self.ResponseCache.Save()
+        except Exception as e:
+            logger.exception("Error saving response cache")
+
     def PersistStreamMemory(self):
          logger.info(f"Persisting stream memory to {self.stream_memory_path}...")
          try:
@@ -1,23 +1,25 @@
 # src/my_local_ai/llm/gemini.py
 import logging # logging をインポート
-import traceback
+from functools import lru_cache
+from typing import Iterator, Union
 
 # このモジュール用のロガーを取得
 logger = logging.getLogger(__name__)
 
 try:
     import google.generativeai as genai
-    # Configure safety settings (optional, example to block harmful content)
-    # safety_settings = [
-    #     {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    #     {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    #     {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    #     {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    # ]
 except ImportError:
     logger.error("google-generativeai library not found. Install with `pip install google-generativeai`")
     genai = None
-    # safety_settings = None
+
+
+@lru_cache(maxsize=4)
+def get_gemini_client(api_key: str, model_name: str = "gemini-1.5-pro") -> "GeminiClient":
+    """
+    (api_key, model_name) ごとに GeminiClient を1つだけ作って使い回す。
+    genai.configure やモデルの準備を内省のたびに繰り返さないため。初期化に失敗した場合はキャッシュされない。
+    """
+    return GeminiClient(api_key=api_key, model_name=model_name)
 
 
 class GeminiClient:
@@ -34,7 +36,6 @@ class GeminiClient:
             # generation_config = genai.types.GenerationConfig(...)
             self.model = genai.GenerativeModel(
                 model_name,
-                # safety_settings=safety_settings, # Apply safety settings if defined
                 # generation_config=generation_config
             )
             logger.info("Gemini model initialized successfully.")
@@ -43,18 +44,21 @@ class GeminiClient:
             # Raise a more specific error? Or handle downstream?
             raise # Re-raise the exception to signal init failure
 
-    def generate(self, prompt: str) -> str:
+    def generate(self, prompt: str, stream: bool = False) -> Union[str, Iterator[str]]:
         """
         指定されたプロンプトを使用してGemini APIから応答を生成する。
 
         Args:
             prompt (str): LLMに渡すプロンプト文字列。
+            stream (bool): True の場合は応答を断片ごとに返すイテレータを返す (generate_stream を参照)。
 
         Returns:
             str: 生成された応答テキスト。エラー時は特定の文字列を返す。
         """
+        if stream:
+            return self.generate_stream(prompt)
         logger.info(f"Generating response from Gemini for prompt (length {len(prompt)})...")
-        logger.debug(f"Prompt snippet: {prompt[:100]}...")
+        logger.debug("Prompt snippet: %s...", prompt[:100])
         try:
             # ストリーミングではなく、単純な応答生成
             response = self.model.generate_content(prompt)
@@ -74,10 +78,29 @@ class GeminiClient:
             # response.text は内部でパートを結合してくれるヘルパープロパティ
             generated_text = response.text.strip()
             logger.info(f"Gemini response received (length {len(generated_text)}).")
-            logger.debug(f"Response snippet: {generated_text[:100]}...")
+            logger.debug("Response snippet: %s...", generated_text[:100])
             return generated_text
 
         except Exception as e:
             # google.generativeai.types.generation_types.BlockedPromptException などを捕捉しても良い
             logger.exception("[GeminiClient Error] Failed to generate content")
-            return "（内省の生成に失敗しました）" # 以前のエラーメッセージを踏襲
\ No newline at end of file
+            return "（内省の生成に失敗しました）" # 以前のエラーメッセージを踏襲
+
+    def generate_stream(self, prompt: str) -> Iterator[str]:
+        """
+        Gemini API の応答をストリーミングで受け取り、テキストの断片を順に返す。
+        呼び出し側は必要な部分を受け取った時点でイテレーションを打ち切ってよい。
+        エラーやブロック時はログに記録し、そこで終了する (それまでの断片だけが返る)。
+        """
+        logger.info(f"Streaming response from Gemini for prompt (length {len(prompt)})...")
+        logger.debug("Prompt snippet: %s...", prompt[:100])
+        received = 0
+        try:
+            for chunk in self.model.generate_content(prompt, stream=True):
+                text = chunk.text # ブロックされた場合などは ValueError になる
+                if text:
+                    received += len(text)
+                    yield text
+            logger.info(f"Gemini stream finished (received {received} chars).")
+        except Exception:
+            logger.exception("[GeminiClient Error] Failed while streaming content")
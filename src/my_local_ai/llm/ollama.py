@@ -1,23 +1,85 @@
 # src/my_local_ai/llm/ollama.py
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import logging # logging をインポート
+from functools import lru_cache
+from typing import Iterator
 
 # このモジュール用のロガーを取得
 logger = logging.getLogger(__name__)
 
+# ExecutePrompt がエラー時に返す文字列 (応答としてキャッシュしないよう、呼び出し側で判別できるようにする)
+ERROR_CONNECTION = "（Ollamaサーバーへの接続に失敗しました）"
+ERROR_TIMEOUT = "（Ollamaサーバーからの応答がタイムアウトしました）"
+ERROR_REQUEST = "（Ollamaサーバーとの通信中にエラーが発生しました）"
+ERROR_BAD_RESPONSE = "（Ollamaサーバーからの応答形式が不正です）"
+ERROR_UNEXPECTED = "（応答の生成中に予期せぬエラーが発生しました）"
+ERROR_RESPONSES = frozenset({ERROR_CONNECTION, ERROR_TIMEOUT, ERROR_REQUEST, ERROR_BAD_RESPONSE, ERROR_UNEXPECTED})
+
+@lru_cache(maxsize=4)
+def get_ollama_client(host: str = "http://localhost:11434", model: str = "elyza:jp8b") -> "OllamaClient":
+    """(host, model) ごとに OllamaClient を1つだけ作って使い回す (StreamingInterface を作り直しても共有される)"""
+    return OllamaClient(host=host, model=model)
+
 class OllamaClient:
     """Ollama APIと通信するためのクライアントクラス。"""
     def __init__(self, host: str = "http://localhost:11434", model: str = "elyza:jp8b"):
         # デフォルトのエンドポイントURLとモデル名
         self.endpoint = f"{host}/api/generate"
         self.model = model
+        # 接続を使い回すため Session を保持する (keep-alive で毎回の TCP 接続を省く)
+        # 応答生成はワーカースレッドから呼ばれるため、スレッド間で共有できるよう接続プールを少し持たせる
+        self._headers = {'Content-Type': 'application/json'}
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
         logger.info(f"OllamaClient initialized. Endpoint: {self.endpoint}, Model: {self.model}")
         # TODO: Consider adding a check here to see if Ollama server is reachable
 
+    def ExecutePromptStream(self, prompt: str) -> Iterator[str]:
+        """
+        Ollama APIにプロンプトを送信し、生成された応答を届いた順に少しずつ返す (ストリーミング)。
+        最初のトークンが届いた時点から処理を始められる。通信エラーなどの例外はそのまま送出する。
+
+        Args:
+            prompt (str): Ollamaモデルに渡すプロンプト文字列。
+
+        Yields:
+            str: 応答テキストの断片。
+        """
+        # Ollama APIへのリクエストデータ
+        data = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": True, # 生成されたトークンを NDJSON で逐次受け取る
+            # "options": { # 必要ならオプション追加
+            #     "temperature": 0.7,
+            #     "num_predict": 512
+            # }
+        }
+        # POSTリクエストを送信 (タイムアウトを設定)。stream=True で本文を逐次読む
+        with self._session.post(self.endpoint, headers=self._headers, data=json.dumps(data), timeout=120, stream=True) as response: # 長めのタイムアウト
+            response.raise_for_status() # HTTPエラーチェック
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise requests.exceptions.RequestException(f"Ollama returned an error: {chunk['error']}")
+                text = chunk.get("response")
+                if text:
+                    yield text
+                if chunk.get("done"):
+                    # TODO: Add more context from the final chunk if needed (e.g., context array for follow-up)
+                    # self.last_context = chunk.get('context')
+                    break
+
     def ExecutePrompt(self, prompt: str) -> str:
         """
         Ollama APIにプロンプトを送信し、生成された応答を返す。
+        内部ではストリーミングで受け取り、生成と受信を重ねる。
 
         Args:
             prompt (str): Ollamaモデルに渡すプロンプト文字列。
@@ -26,52 +88,28 @@ class OllamaClient:
             str: 生成された応答テキスト。エラー時は特定の文字列を返す。
         """
         logger.info(f"Executing prompt with Ollama model '{self.model}' (prompt length {len(prompt)})...")
-        logger.debug(f"Prompt snippet: {prompt[:100]}...")
+        logger.debug("Prompt snippet: %s...", prompt[:100])
         try:
-            # Ollama APIへのリクエストデータ
-            data = {
-                "model": self.model,
-                "prompt": prompt,
-                "stream": False, # ストリーミングは無効にする
-                # "options": { # 必要ならオプション追加
-                #     "temperature": 0.7,
-                #     "num_predict": 512
-                # }
-            }
-            # ヘッダー指定
-            headers = {'Content-Type': 'application/json'}
-
-            # POSTリクエストを送信 (タイムアウトを設定)
-            response = requests.post(self.endpoint, headers=headers, data=json.dumps(data), timeout=120) # 長めのタイムアウト
-            response.raise_for_status() # HTTPエラーチェック
-
-            # レスポンスをJSONとしてパース
-            response_data = response.json()
-
             # 応答テキストを取得
-            generated_text = response_data.get('response', '').strip()
+            generated_text = "".join(self.ExecutePromptStream(prompt)).strip()
             logger.info(f"Ollama response received (length {len(generated_text)}).")
-            logger.debug(f"Response snippet: {generated_text[:100]}...")
-
-            # TODO: Add more context from response_data if needed (e.g., context array for follow-up)
-            # self.last_context = response_data.get('context')
-
+            logger.debug("Response snippet: %s...", generated_text[:100])
             return generated_text
 
         except requests.exceptions.ConnectionError:
             logger.error(f"Failed to connect to Ollama endpoint: {self.endpoint}. Is Ollama running?")
-            return "（Ollamaサーバーへの接続に失敗しました）"
+            return ERROR_CONNECTION
         except requests.exceptions.Timeout:
             logger.error(f"Request to Ollama endpoint timed out.")
-            return "（Ollamaサーバーからの応答がタイムアウトしました）"
+            return ERROR_TIMEOUT
         except requests.exceptions.RequestException as e:
             logger.error(f"Error during request to Ollama endpoint: {e}")
             if e.response is not None:
                  logger.error(f"  Status: {e.response.status_code}, Body: {e.response.text[:200]}...")
-            return "（Ollamaサーバーとの通信中にエラーが発生しました）"
-        except json.JSONDecodeError:
-             logger.error(f"Failed to decode JSON response from Ollama. Response: {response.text[:200]}...")
-             return "（Ollamaサーバーからの応答形式が不正です）"
+            return ERROR_REQUEST
+        except json.JSONDecodeError as e:
+             logger.error(f"Failed to decode JSON chunk from Ollama: {e}")
+             return ERROR_BAD_RESPONSE
         except Exception as e:
             logger.exception("Unexpected error executing Ollama prompt")
-            return "（応答の生成中に予期せぬエラーが発生しました）"
\ No newline at end of file
+            return ERROR_UNEXPECTED
@@ -0,0 +1,146 @@
+# src/my_local_ai/llm/semantic_cache.py
+import json
+import os
+import threading
+from pathlib import Path
+from typing import List, Optional, Sequence # 型ヒント用
+import logging # logging をインポート
+
+import numpy as np
+
+# このモジュール用のロガーを取得
+logger = logging.getLogger(__name__)
+
+class SemanticCache:
+    """
+    質問の Embedding が以前の質問と十分に近ければ、そのときの応答を返すキャッシュ。
+    言い回しが少し違うだけの質問 (挨拶など) では LLM の呼び出しを丸ごと省ける。
+    キーは呼び出し側で計算した Embedding (プロンプト全体ではなくコメントの Embedding を想定。
+    プロンプトは固定のペルソナ部分が大半を占めるため、どのプロンプト同士も似てしまう)。
+    fingerprint は応答を作ったときの設定 (ペルソナ・identity) を表す文字列で、保存時に一緒に書き、
+    読み込み時に一致しなければ保存済みの応答を捨てる (配信の合間に設定が変わった場合)。
+    """
+    def __init__(self, threshold: float = 0.95, max_entries: int = 256, path: Optional[Path] = None,
+                 fingerprint: Optional[str] = None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.path = Path(path) if path is not None else None
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+        self._keys: Optional[np.ndarray] = None # (max_entries, d) の正規化済み Embedding
+        self._responses: List[str] = []
+        self._last_used: Optional[np.ndarray] = None # LRU 用の最終使用カウンタ
+        self._clock = 0
+        if self.path is not None:
+            self._Load()
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    @staticmethod
+    def _Normalize(vec: Sequence[float]) -> Optional[np.ndarray]:
+        v = np.asarray(vec, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(v)) if v.size else 0.0
+        return v / norm if norm else None
+
+    def Lookup(self, embedding: Sequence[float]) -> Optional[str]:
+        """類似度が閾値以上の質問があれば、最も近いものの応答を返す (なければ None)"""
+        q = self._Normalize(embedding)
+        with self._lock:
+            n = len(self._responses)
+            if q is None or not n or q.shape[0] != self._keys.shape[1]:
+                return None
+            scores = self._keys[:n] @ q
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            self._clock += 1
+            self._last_used[best] = self._clock
+            logger.debug("Semantic cache hit (similarity %.4f).", scores[best])
+            return self._responses[best]
+
+    def Store(self, embedding: Sequence[float], response: str) -> None:
+        """質問の Embedding と応答を登録する (満杯なら最も長く使われていないものを置き換える)"""
+        v = self._Normalize(embedding)
+        if v is None or not response:
+            return
+        with self._lock:
+            if self._keys is None or self._keys.shape[1] != v.shape[0]:
+                self._Reset(v.shape[0])
+            self._clock += 1
+            n = len(self._responses)
+            if n < self.max_entries:
+                row = n
+                self._responses.append(response)
+            else:
+                row = int(np.argmin(self._last_used))
+                self._responses[row] = response
+            self._keys[row] = v
+            self._last_used[row] = self._clock
+
+    def Clear(self) -> None:
+        """全エントリを破棄する (ペルソナが変わり、以前の応答が使えなくなった場合など)"""
+        with self._lock:
+            self._keys = None
+            self._responses = []
+            self._last_used = None
+
+    def _Reset(self, dim: int) -> None:
+        self._keys = np.zeros((self.max_entries, dim), dtype=np.float32)
+        self._last_used = np.zeros(self.max_entries, dtype=np.int64)
+        self._responses = []
+
+    # --- 永続化 (Embedding は .npy、応答と fingerprint は .json) ---
+    def _Paths(self):
+        return self.path.with_suffix(".npy"), self.path.with_suffix(".json")
+
+    def Save(self) -> None:
+        """キャッシュをファイルに保存する (path を指定した場合のみ)"""
+        if self.path is None:
+            return
+        keys_path, responses_path = self._Paths()
+        with self._lock:
+            n = len(self._responses)
+            keys = self._keys[:n].copy() if n else np.empty((0, 0), dtype=np.float32)
+            responses = list(self._responses)
+        try:
+            keys_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_keys = keys_path.with_name(keys_path.name + ".tmp")
+            with tmp_keys.open("wb") as f:
+                np.save(f, keys)
+            tmp_responses = responses_path.with_name(responses_path.name + ".tmp")
+            payload = {"Fingerprint": self.fingerprint, "Responses": responses}
+            tmp_responses.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_keys, keys_path)
+            os.replace(tmp_responses, responses_path)
+            logger.info(f"Semantic cache saved ({n} entries): {keys_path.name}")
+        except OSError as e:
+            logger.error(f"Failed to save semantic cache to {self.path}: {e}")
+
+    def _Load(self) -> None:
+        keys_path, responses_path = self._Paths()
+        if not keys_path.is_file() or not responses_path.is_file():
+            return
+        try:
+            keys = np.load(keys_path)
+            payload = json.loads(responses_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load semantic cache from {self.path}: {e}. Starting empty.")
+            return
+        # fingerprint のない旧形式 (応答のリストだけ) は、どの設定で作った応答か分からないので使わない
+        if not isinstance(payload, dict) or payload.get("Fingerprint") != self.fingerprint:
+            logger.info(f"Semantic cache at {self.path} was built with different settings. Starting empty.")
+            return
+        responses = payload.get("Responses")
+        if keys.ndim != 2 or not isinstance(responses, list) or len(responses) != len(keys):
+            logger.warning(f"Semantic cache files at {self.path} do not match. Starting empty.")
+            return
+        keys, responses = keys[-self.max_entries:], responses[-self.max_entries:]
+        if len(responses):
+            self._Reset(keys.shape[1])
+            self._keys[:len(keys)] = keys
+            self._responses = [str(r) for r in responses]
+            # 読み込んだ順 (古いものから) に使用済みとして扱う
+            self._clock = len(responses)
+            self._last_used[:len(responses)] = np.arange(1, len(responses) + 1)
+        logger.info(f"Semantic cache loaded ({len(self._responses)} entries).")
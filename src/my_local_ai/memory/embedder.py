@@ -2,26 +2,118 @@
 # from sentence_transformers import SentenceTransformer # <-- Move import inside _load_model
 import time
 import os
+import queue
+import threading
+from concurrent.futures import Future
+from pathlib import Path
 import logging # logging をインポート
 
+import numpy as np
+
 # このモジュール用のロガーを取得
 logger = logging.getLogger(__name__)
 
+# 単一テキストの Embed 要求をまとめて1回の encode で処理する際の設定
+EMBED_BATCH_MAX = 32 # 1回の encode にまとめる最大件数
+EMBED_BATCH_WAIT_SEC = 0.005 # 最初の要求が届いてから、後続の要求を待つ時間
+ENCODE_BATCH_SIZE = 32 # model.encode のミニバッチサイズ
+
+# CPU 推論のスレッド数 (行列積のスレッド並列。多すぎると同期のコストで逆に遅くなるので上限を設ける)
+EMBED_NUM_THREADS = min(8, os.cpu_count() or 4)
+EMBED_INTEROP_THREADS = 2
+_threads_configured = False
+
+# ONNX Runtime 用に変換したモデルの保存先 (初回だけ変換し、以降はここから読み込む)
+# カレントディレクトリではなくプロジェクトルート (src/my_local_ai/memory から4つ上) の .cache に置く
+# (scripts/ など別の場所から起動しても同じキャッシュを使う)
+ONNX_CACHE_DIR = Path(__file__).resolve().parent.parent.parent.parent / ".cache" / "onnx"
+ONNX_QUANTIZED_FILE = "onnx/model_qint8.onnx" # INT8 に動的量子化したモデル (ONNX_CACHE_DIR 内のモデルごとのフォルダからの相対パス)
+
 # os.environ['SENTENCE_TRANSFORMERS_HOME'] = './.cache/sentence_transformers/' # 必要なら設定
 
+def _configure_threads():
+    """
+    OpenMP/MKL と PyTorch のスレッド数を設定する (プロセスで1回だけ)。
+    環境変数は OpenMP の初期化前 (torch の import 前) でないと効かないので、モデルの読み込み直前に呼ぶ。
+    ユーザーが環境変数で指定している場合はそちらを優先する。
+    """
+    global _threads_configured
+    if _threads_configured:
+        return
+    _threads_configured = True
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(name, str(EMBED_NUM_THREADS))
+    try:
+        import torch
+    except ImportError:
+        return
+    omp_threads = os.environ["OMP_NUM_THREADS"]
+    torch.set_num_threads(int(omp_threads) if omp_threads.isdigit() else EMBED_NUM_THREADS)
+    try:
+        torch.set_num_interop_threads(EMBED_INTEROP_THREADS)
+    except RuntimeError as e: # 既に並列処理が始まっていると設定できない
+        logger.debug(f"Could not set torch inter-op threads: {e}")
+    logger.info(f"Torch threads: intra-op {torch.get_num_threads()}, inter-op {torch.get_num_interop_threads()}")
+
+
 class Embedder:
-    def __init__(self):
+    def __init__(self, backend: str = "auto", quantize: bool = False, preload: bool = False):
+        """
+        backend: "auto" (optimum[onnxruntime] があれば ONNX Runtime、なければ PyTorch)、"onnx"、"torch" のいずれか。
+        quantize: ONNX Runtime で推論する場合に、INT8 に動的量子化したモデルを使うか (速くなるが Embedding の値が少し変わる)。
+        preload: True ならバックグラウンドでモデルを読み込んでおく (起動処理と並行して読み込み、最初の Embed を待たせない)。
+        """
         self.model_name = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+        self.backend = backend
+        self.quantize = quantize
         self.model = None
+        # 単一テキストの要求を集めるキューとワーカースレッド (最初の要求時に起動)
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._load_lock = threading.Lock() # 読み込み中に Embed が呼ばれても二重に読み込まない
         logger.info(f"Embedder Initialized (Model: {self.model_name}, Status: Not loaded)")
+        if preload:
+            self.Warmup(background=True)
+
+    def Warmup(self, background: bool = False):
+        """
+        モデルを読み込み、1回 encode しておく (最初の Embed で読み込みや初回の推論の準備を待たないようにする)。
+        background=True ならデーモンスレッドで実行し、そのスレッドを返す。
+        """
+        if background:
+            thread = threading.Thread(target=self.Warmup, name="embedder-warmup", daemon=True)
+            thread.start()
+            return thread
+        if self._EnsureModel():
+            try:
+                self._Encode(["warmup"])
+                logger.info("Embedder warmed up.")
+            except Exception:
+                logger.exception("Error during embedder warmup")
+        return None
+
+    def _EnsureModel(self) -> bool:
+        """モデルが読み込まれていなければ読み込む (読み込めたら True)"""
+        if self.model is None:
+            with self._load_lock:
+                if self.model is None:
+                    self._load_model()
+        return self.model is not None
 
     def _load_model(self):
         logger.debug(f"Attempting to import SentenceTransformer library...")
+        _configure_threads()
         try:
             from sentence_transformers import SentenceTransformer
             logger.info(f"Loading embedding model '{self.model_name}' for the first time...")
             start_time = time.time()
-            self.model = SentenceTransformer(self.model_name)
+            model = None
+            if self.backend in ("auto", "onnx"):
+                model = self._LoadOnnxModel(SentenceTransformer)
+                if model is None and self.backend == "onnx":
+                    logger.warning("ONNX backend is not available. Falling back to PyTorch.")
+            self.model = model if model is not None else SentenceTransformer(self.model_name)
             end_time = time.time()
             logger.info(f"Embedding model loaded successfully in {end_time - start_time:.2f} seconds.")
         except ImportError:
@@ -31,24 +123,101 @@ class Embedder:
             logger.exception(f"Failed to load embedding model '{self.model_name}'") # exc_info=True相当
             self.model = None
 
+    def _LoadOnnxModel(self, SentenceTransformer):
+        """
+        sentence-transformers の ONNX バックエンド (optimum + onnxruntime) でモデルを読み込む。
+        トークナイザーと Pooling はそのままで、推論だけが ONNX Runtime になる。使えない場合は None を返す。
+        """
+        try:
+            import optimum.onnxruntime # noqa: F401 (ONNX バックエンドが内部で使う)
+        except ImportError:
+            logger.debug("optimum[onnxruntime] not found. Using the PyTorch backend.")
+            return None
+
+        cache_dir = ONNX_CACHE_DIR / self.model_name.replace("/", "__")
+        try:
+            if not (cache_dir / "modules.json").is_file():
+                logger.info(f"Exporting '{self.model_name}' to ONNX (first run only): {cache_dir}")
+                SentenceTransformer(self.model_name, backend="onnx").save_pretrained(str(cache_dir))
+            if not self.quantize:
+                return SentenceTransformer(str(cache_dir), backend="onnx")
+
+            if not (cache_dir / ONNX_QUANTIZED_FILE).is_file():
+                from sentence_transformers import export_dynamic_quantized_onnx_model
+                logger.info("Quantizing the ONNX model to INT8 (first run only)...")
+                export_dynamic_quantized_onnx_model(
+                    SentenceTransformer(str(cache_dir), backend="onnx"), "avx2", str(cache_dir), file_suffix="qint8"
+                )
+            return SentenceTransformer(str(cache_dir), backend="onnx", model_kwargs={"file_name": ONNX_QUANTIZED_FILE})
+        except Exception as e:
+            logger.exception(f"Failed to load ONNX model for '{self.model_name}'. Falling back to PyTorch.")
+            return None
+
     def Embed(self, texts):
-        if self.model is None:
-            self._load_model()
-            if self.model is None:
-                logger.error("Cannot embed text, model is not loaded.")
-                return [[] for _ in (texts if isinstance(texts, list) else [texts])]
+        if not self._EnsureModel():
+            logger.error("Cannot embed text, model is not loaded.")
+            return [[] for _ in (texts if isinstance(texts, list) else [texts])] # 失敗した要素は空 (len 0)
 
         if isinstance(texts, str):
-            texts = [texts]
+            # 単一テキストは他スレッドからの要求とまとめて encode する (検索とログ保存が重なる場合など)
+            return [self._EmbedCoalesced(texts)]
         if not texts: # 空リストの場合
             return []
 
         try:
-            logger.debug(f"Encoding {len(texts)} text(s)...")
-            # 以前 .tolist() を使っていたのでそのままにする
-            embeddings = self.model.encode(texts, convert_to_tensor=False).tolist()
-            logger.debug(f"Encoding complete.")
-            return embeddings
+            return self._Encode(texts)
         except Exception as e:
             logger.exception("Error during text embedding") # exc_info=True相当
-            return [[] for _ in texts] # エラー時は空リストを返す
\ No newline at end of file
+            return [[] for _ in texts] # エラー時は空リストを返す
+
+    def _Encode(self, texts):
+        """
+        テキストのリストを encode し、入力と同じ順の Embedding (float32 の1次元 ndarray) のリストを返す。
+        重複を除いたうえで長さ順に並べて encode し (ミニバッチ内のパディングを最小にする)、元の順に戻す。
+        各要素は encode 結果の行のビューで、Python の float のリストには変換しない。
+        """
+        unique_texts = sorted(dict.fromkeys(texts), key=len)
+        logger.debug("Encoding %d text(s) (%d unique)...", len(texts), len(unique_texts))
+        # 単位ベクトルで返す (コサイン類似度が内積だけで計算できる)
+        encoded = self.model.encode(unique_texts, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=True)
+        by_text = dict(zip(unique_texts, np.asarray(encoded, dtype=np.float32)))
+        embeddings = [by_text[text] for text in texts]
+        logger.debug("Encoding complete.")
+        return embeddings
+
+    def _EmbedCoalesced(self, text: str):
+        """単一テキストをキューに入れ、ワーカーがまとめて encode した結果を待って返す"""
+        self._EnsureWorker()
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _EnsureWorker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._BatchWorker, name="embedder-batch", daemon=True)
+                self._worker.start()
+
+    def _BatchWorker(self):
+        """キューから要求を最大 EMBED_BATCH_MAX 件 (最初の要求から EMBED_BATCH_WAIT_SEC 以内) 集めて encode する"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + EMBED_BATCH_WAIT_SEC
+            while len(batch) < EMBED_BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                embeddings = self._Encode([text for text, _ in batch])
+            except Exception:
+                logger.exception("Error during text embedding")
+                embeddings = [[] for _ in batch] # エラー時は空リストを返す
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
\ No newline at end of file
@@ -0,0 +1,157 @@
+# src/my_local_ai/memory/embedding_store.py
+# Embedding を JSON の浮動小数点数の配列ではなく、float16 の .npy サイドカーファイルに保存する。
+# JSON 側には "EmbeddingRow" (サイドカーの行番号) と "EmbeddingGen" (サイドカーの世代番号) だけを書く。
+# 全体を書き直すときは新しい世代のサイドカーを別名で書き、JSON を置き換えてから古い世代を消す
+# (途中で落ちても、JSON は必ず自分が指す世代のサイドカーと対になる)。
+import base64
+import io
+import os
+import re
+from pathlib import Path
+from typing import Optional, Sequence # 型ヒント用
+import logging # logging をインポート
+
+import numpy as np
+
+# このモジュール用のロガーを取得
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DTYPE = np.dtype("<f2") # float16 (リトルエンディアン)
+
+def encode_inline(embedding) -> str:
+    """
+    サイドカーに書けない Embedding (次元が揃わないものなど) を JSON に直接書くための文字列にする。
+    float16 のバイト列を base64 にしたもの (浮動小数点数を1つずつ文字列にするより小さく、速い)。
+    """
+    return base64.b64encode(np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()).decode("ascii")
+
+def decode_inline(value) -> Optional[np.ndarray]:
+    """encode_inline の文字列を float32 の Embedding に戻す (ない・壊れている場合は None)"""
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        raw = base64.b64decode(value, validate=True)
+    except ValueError: # binascii.Error は ValueError のサブクラス
+        return None
+    if not raw or len(raw) % EMBEDDING_DTYPE.itemsize:
+        return None
+    return np.frombuffer(raw, dtype=EMBEDDING_DTYPE).astype(np.float32)
+
+def sidecar_path_for(path: Path, generation: int = 0) -> Path:
+    """
+    記憶・ログファイルに対応する Embedding サイドカーのパスを返す。
+    世代 0 は stream_logs.json -> stream_logs.f16.npy、それ以降は stream_logs.g3.f16.npy のように世代番号が付く。
+    """
+    if generation:
+        return path.with_suffix(f".g{generation}.f16.npy")
+    return path.with_suffix(".f16.npy")
+
+def remove_stale_sidecars(path: Path, generation: int) -> None:
+    """generation 以外の世代のサイドカーを削除する (JSON を新しい世代に置き換えた後に呼ぶ)"""
+    pattern = re.compile(re.escape(path.stem) + r"(\.g\d+)?\.f16\.npy")
+    keep = sidecar_path_for(path, generation).name
+    for candidate in path.parent.glob(f"{path.stem}*.npy"):
+        if candidate.name == keep or not pattern.fullmatch(candidate.name):
+            continue
+        try:
+            candidate.unlink()
+        except OSError as e:
+            logger.warning(f"Failed to remove stale embedding sidecar {candidate}: {e}")
+
+class SidecarReader:
+    """
+    読み込み中の記録が指す (世代, 行番号) の Embedding を返す。
+    サイドカーは世代ごとに最初に参照されたときに1回だけ読み込み、transform (正規化など) を掛けておく。
+    """
+    def __init__(self, path: Path, transform=None):
+        self.Path = path
+        self.Transform = transform
+        self.LatestGeneration = 0 # 記録が参照した最新の世代 (追記先のサイドカー)
+        self._Matrices = {}
+
+    def Get(self, record: dict) -> Optional[np.ndarray]:
+        row = record.get("EmbeddingRow")
+        generation = record.get("EmbeddingGen", 0)
+        if not isinstance(row, int) or not isinstance(generation, int) or generation < 0:
+            return None
+        self.LatestGeneration = max(self.LatestGeneration, generation)
+        if generation not in self._Matrices:
+            matrix = load_embeddings(sidecar_path_for(self.Path, generation))
+            if matrix is not None and self.Transform is not None:
+                matrix = self.Transform(matrix)
+            self._Matrices[generation] = matrix
+        matrix = self._Matrices[generation]
+        if matrix is None or not 0 <= row < len(matrix):
+            return None
+        return matrix[row] # 行のビュー (コピーしない)
+
+def load_embeddings(path: Path) -> Optional[np.ndarray]:
+    """
+    サイドカーを (float16 のまま) 読み込む (ない・壊れている場合は None)。
+    追記のたびにファイルを書き換えるため、mmap は開いたままにせず一度に読み込む (Windows では mmap 中のファイルを縮められない)。
+    """
+    if not path.is_file():
+        return None
+    try:
+        matrix = np.load(path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Failed to load embedding sidecar {path}: {e}")
+        return None
+    if matrix.ndim != 2:
+        logger.warning(f"Embedding sidecar {path} has unexpected shape {matrix.shape}. Ignoring it.")
+        return None
+    return matrix
+
+def save_embeddings(path: Path, rows: Sequence[Sequence[float]]) -> None:
+    """サイドカー全体を書き直す (一時ファイルに書いてから os.replace で置き換える)"""
+    matrix = np.asarray(rows, dtype=EMBEDDING_DTYPE)
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(rows), -1)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("wb") as f:
+        np.save(f, matrix)
+    os.replace(tmp_path, path)
+
+def append_embeddings(path: Path, rows: Sequence[Sequence[float]]) -> int:
+    """
+    サイドカーの末尾に行を追記し、追記した最初の行の行番号を返す。
+    データを末尾に書き足してからヘッダーの shape だけを書き換えるので、既存の行は書き直さない
+    (numpy はヘッダーに行数が増えても長さが変わらない余白を確保している)。
+    次元や dtype が合わない場合は ValueError を送出する。
+    """
+    matrix = np.asarray(rows, dtype=EMBEDDING_DTYPE)
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(rows), -1)
+    if not path.is_file():
+        save_embeddings(path, matrix)
+        return 0
+
+    fmt = np.lib.format
+    with path.open("r+b") as f:
+        version = fmt.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = fmt.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = fmt.read_array_header_2_0(f)
+        header_end = f.tell()
+        if len(shape) != 2 or fortran_order or dtype != EMBEDDING_DTYPE or shape[1] != matrix.shape[1]:
+            raise ValueError(f"Embedding sidecar {path} does not match (shape={shape}, dtype={dtype}).")
+
+        start_row = shape[0]
+        # 新しい行数のヘッダーを先に作り、長さが変わらないことを確かめてから書き込む
+        header = io.BytesIO()
+        header_dict = {"descr": fmt.dtype_to_descr(EMBEDDING_DTYPE), "fortran_order": False,
+                       "shape": (start_row + matrix.shape[0], matrix.shape[1])}
+        if version == (1, 0):
+            fmt.write_array_header_1_0(header, header_dict)
+        else:
+            fmt.write_array_header_2_0(header, header_dict)
+        if len(header.getvalue()) != header_end:
+            raise ValueError(f"Embedding sidecar header size would change while appending to {path}.")
+
+        f.seek(header_end + start_row * matrix.shape[1] * EMBEDDING_DTYPE.itemsize)
+        f.write(matrix.tobytes())
+        f.truncate() # 途中で終わった追記の残りがあれば捨てる
+        f.seek(0)
+        f.write(header.getvalue())
+    return start_row
@@ -1,17 +1,20 @@
 # src/my_local_ai/memory/log_manager.py
-import json
 import os
 from datetime import datetime
-from dataclasses import dataclass, field, asdict # asdict を追加
-from typing import List, Optional, Dict # 型ヒント用
+from dataclasses import dataclass, field
+from typing import List, Optional, Dict, Tuple # 型ヒント用
 from pathlib import Path
 import logging # logging をインポート
 
+import numpy as np
+
 # 関連モジュールをインポート
 try:
     # from .embedder import Embedder # 相対インポートを使う場合
     from my_local_ai.memory.embedder import Embedder # または絶対インポート
-    from sentence_transformers import util # 類似度計算用
+    from my_local_ai.memory.vector_search import EmbeddingMatrix, as_embedding, has_embedding, normalize_rows
+    from my_local_ai.memory.embedding_store import SidecarReader, append_embeddings, decode_inline, encode_inline, remove_stale_sidecars, save_embeddings, sidecar_path_for
+    from my_local_ai.utils import fast_json # orjson があれば使う (Embedding の浮動小数点数のパースが速い)
 except ImportError as e:
     print(f"FATAL Error importing dependencies in LogManager: {e}")
     raise
@@ -19,47 +22,91 @@ except ImportError as e:
 # このモジュール用のロガーを取得
 logger = logging.getLogger(__name__)
 
-@dataclass
+LOG_WRITE_BUFFER_BYTES = 1 << 16 # 追記用ハンドルのバッファサイズ (64 KiB)
+
+@dataclass(slots=True) # __slots__ で属性アクセスを高速化し、メモリも削減
 class LogEntry:
     Timestamp: str
     UserInput: str
     AssistantResponse: str
     Username: str = "Unknown"
-    Embedding: Optional[List[float]] = field(default=None, repr=False) # repr=Falseでログ出力時に省略
+    Embedding: Optional[np.ndarray] = field(default=None, repr=False, compare=False) # repr=Falseでログ出力時に省略 (ndarray は == で比較できないので比較対象外)
 
     def to_dict(self):
-        # asdict を使って dataclass を辞書に変換 (Embedding も含む)
-        return asdict(self)
+        # asdict は各フィールドを再帰的にコピーする (Embedding のリストも) ので、手で辞書を作る
+        return {
+            "Timestamp": self.Timestamp,
+            "UserInput": self.UserInput,
+            "AssistantResponse": self.AssistantResponse,
+            "Username": self.Username,
+            "Embedding": self.Embedding,
+        }
 
 class LogManager:
     def __init__(self, log_path: str, embedder: Embedder):
         self.log_path = Path(log_path)
+        self.embedding_path = sidecar_path_for(self.log_path) # Embedding は float16 のサイドカーに保存する (追記先の世代のパス)
+        self._EmbeddingGen = 0 # 追記先のサイドカーの世代 (書き直すたびに増やす)
         self.Embedder = embedder
         self.Logs: List[LogEntry] = []
+        self.Version = 0 # ログが増えるたびに増やす (Retriever の検索結果キャッシュの無効化用)
+        # 検索用の正規化済み Embedding 行列 (書き込みのたびに差分だけ更新する)
+        self._Embeddings = EmbeddingMatrix()
+        self._HasMissingEmbeddings = False # 読み込み時に Embedding がなかったログがあるか (最初の検索時に計算する)
+        self._fp = None # 追記用に開いたままにするログファイルのハンドル (保存のたびに open/close しない)
         logger.info(f"LogManager initialized. Log file path: {self.log_path}")
         self.LoadLogs()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """追記用に開いているログファイルを閉じる (次の SaveLog で開き直す)"""
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def _AppendHandle(self):
+        if self._fp is None:
+            self._fp = self.log_path.open("ab", buffering=LOG_WRITE_BUFFER_BYTES)
+        return self._fp
+
     def LoadLogs(self):
         logger.info(f"Attempting to load logs from {self.log_path}...")
+        self.close() # ファイルが外で置き換えられていても、次の追記は読み込んだファイルに対して行う
         self.Logs = []
+        self.Version += 1
+        self._HasMissingEmbeddings = False
+        self._SetEmbeddingGeneration(0)
         if not self.log_path.exists():
             logger.warning(f"Log file not found at {self.log_path}. Starting with empty logs.")
             return
 
         logs_to_embed = [] # Embedding がないログのインデックスとテキストを保持
+        # サイドカーの Embedding (各記録の "EmbeddingGen" と "EmbeddingRow" が世代と行番号を指す)
+        # 新しい Embedding は単位ベクトルで保存しているが、正規化前に保存された古いものや
+        # float16 の丸め誤差もあるので、読み込み時に1回の行列演算でまとめて正規化し直す
+        sidecars = SidecarReader(self.log_path, transform=normalize_rows)
         try:
-            with self.log_path.open("r", encoding="utf-8") as f:
+            with self.log_path.open("rb") as f: # orjson は bytes をそのままデコードできる
                 for i, line in enumerate(f):
                     line = line.strip()
                     if not line: continue
                     try:
-                        log_data = json.loads(line)
+                        log_data = fast_json.loads(line)
                         # キーの存在確認とデフォルト値
                         timestamp = log_data.get("Timestamp", datetime.now().isoformat())
                         user_input = log_data.get("UserInput", "")
                         assistant_response = log_data.get("AssistantResponse", "")
                         username = log_data.get("Username", "Unknown")
-                        embedding = log_data.get("Embedding") # なければ None
+                        embedding = decode_inline(log_data.get("EmbeddingB64")) # サイドカーに書けなかったもの
+                        if embedding is None:
+                            embedding = as_embedding(log_data.get("Embedding")) # 旧形式 (JSON に数値のリストで書かれている)。なければ None
+                        if embedding is None:
+                            embedding = sidecars.Get(log_data)
 
                         entry = LogEntry(
                             Timestamp=timestamp,
@@ -74,45 +121,38 @@ class LogManager:
                         if embedding is None and user_input: # ユーザー入力がないログはEmbedしない
                             logs_to_embed.append((len(self.Logs) - 1, user_input)) # インデックスとテキスト
 
-                    except json.JSONDecodeError:
+                    except fast_json.JSONDecodeError:
                         logger.warning(f"Failed to decode JSON from line {i+1} in {self.log_path}. Skipping line.")
                     except Exception as e:
                          logger.warning(f"Error processing line {i+1} in {self.log_path}: {e}. Skipping line.")
 
+            self._SetEmbeddingGeneration(sidecars.LatestGeneration)
             logger.info(f"Loaded {len(self.Logs)} log entries.")
 
-            # Embedding がなかったログに Embedding を追加
             if logs_to_embed:
-                logger.info(f"Calculating embeddings for {len(logs_to_embed)} log entries without embeddings...")
-                indices, texts = zip(*logs_to_embed)
-                try:
-                    new_embeddings = self.Embedder.Embed(list(texts))
-                    if len(new_embeddings) == len(indices):
-                        for idx, embedding in zip(indices, new_embeddings):
-                            if embedding: # Embedderが空リストを返さないか確認
-                                self.Logs[idx].Embedding = embedding
-                        logger.info("Embeddings calculated and added for missing entries.")
-                        # Optional: ここでログファイルを上書き保存する (欠損を埋めた状態で)
-                        # self.SaveAllLogsToFile() # 新しいメソッドが必要
-                    else:
-                         logger.error("Number of generated embeddings does not match number of texts.")
-                except Exception as e:
-                    logger.exception("Error during embedding calculation for logs.")
+                # Embedding の計算 (モデルの読み込みを含む) は最初の検索まで遅らせる
+                logger.info(f"{len(logs_to_embed)} log entries have no embedding. They will be embedded on the first search.")
+                self._HasMissingEmbeddings = True
 
         except IOError as e:
             logger.error(f"Failed to read log file {self.log_path}: {e}")
         except Exception as e:
             logger.exception(f"Unexpected error during LoadLogs")
 
+    def _SetEmbeddingGeneration(self, generation: int):
+        """追記先のサイドカーを generation の世代に切り替える"""
+        self._EmbeddingGen = generation
+        self.embedding_path = sidecar_path_for(self.log_path, generation)
+
     def SaveLog(self, UserInput: str, AssistantResponse: str, Username: str = "User"):
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S") # 以前のフォーマットに合わせる場合
         # timestamp = datetime.now().isoformat() # ISO形式の場合
-        logger.debug(f"Saving log: User='{Username}', Input='{UserInput[:50]}...'")
+        logger.debug("Saving log: User='%s', Input='%s...'", Username, UserInput[:50])
         embedding = None
         if UserInput: # ユーザー入力があればEmbeddingを計算
             try:
                 embedding_list = self.Embedder.Embed(UserInput)
-                if embedding_list:
+                if embedding_list and has_embedding(embedding_list[0]):
                     embedding = embedding_list[0] # 最初の要素を取得
             except Exception as e:
                 logger.exception("Failed to generate embedding for log entry.")
@@ -125,63 +165,151 @@ class LogManager:
             Embedding=embedding
         )
         self.Logs.append(log_entry)
+        position = len(self.Logs) - 1
+        self._UpdateEmbeddings(lambda m: m.Append(position, embedding))
 
         # ファイルに追記 (JSON Lines形式)
         try:
-            with self.log_path.open("a", encoding="utf-8") as f:
-                # LogEntry を辞書に変換してから JSON 文字列に
-                f.write(json.dumps(log_entry.to_dict(), ensure_ascii=False) + "\n")
+            # LogEntry を辞書に変換し、Embedding はサイドカーに追記して行番号だけを書く
+            record = log_entry.to_dict()
+            embedding = record.pop("Embedding")
+            if has_embedding(embedding):
+                try:
+                    record["EmbeddingRow"] = append_embeddings(self.embedding_path, [embedding])
+                    if self._EmbeddingGen:
+                        record["EmbeddingGen"] = self._EmbeddingGen
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Failed to append embedding to {self.embedding_path}: {e}. Writing it inline.")
+                    record["EmbeddingB64"] = encode_inline(embedding) # float16 のバイト列を base64 で書く
+            f = self._AppendHandle()
+            f.write(fast_json.dumps(record) + b"\n")
+            f.flush() # 1件ごとにファイルへ書き出す (落ちてもそこまでのログは残る)
             logger.info(f"Log entry saved to {self.log_path}.")
         except IOError as e:
             logger.error(f"Failed to append log to {self.log_path}: {e}")
         except Exception as e:
              logger.exception("Unexpected error during SaveLog file operation.")
 
-    def GetAllLogs(self) -> List[LogEntry]:
-        logger.debug(f"GetAllLogs called. Returning {len(self.Logs)} entries.")
-        return self.Logs
+    def GetAllLogs(self) -> Tuple[LogEntry, ...]:
+        """全ログを返す (呼び出し側が誤って self.Logs を書き換えないようタプルで返す)"""
+        logger.debug("GetAllLogs called. Returning %d entries.", len(self.Logs))
+        return tuple(self.Logs)
+
+    def GetLogsSlice(self, start: int, stop: Optional[int] = None) -> List[LogEntry]:
+        """self.Logs[start:stop] を返す (直近の数件だけが必要な場合などに、全件をコピーせずに済む)"""
+        return self.Logs[start:stop]
 
-    def SearchRelevantLogs(self, query: str, topK=5, similarity_threshold=0.5) -> List[LogEntry]:
+    def CountLogs(self) -> int:
+        return len(self.Logs)
+
+    def SearchRelevantLogs(self, query: str, topK=5, similarity_threshold=0.5, query_embedding=None) -> List[LogEntry]:
         logger.info(f"Searching relevant logs for query: '{query[:50]}...', topK={topK}, threshold={similarity_threshold}")
         if not self.Logs:
             logger.warning("SearchRelevantLogs called but no logs available.")
             return []
 
-        try:
-            query_embedding_list = self.Embedder.Embed(query)
-            if not query_embedding_list or not query_embedding_list[0]:
-                 logger.error("Failed to generate query embedding. Cannot search logs.")
-                 return []
-            queryEmbedding = query_embedding_list[0]
-        except Exception as e:
-            logger.exception("Error generating query embedding for log search.")
+        if has_embedding(query_embedding): # 呼び出し側 (Retriever) で計算済みなら Embed を省く
+            queryEmbedding = query_embedding
+        else:
+            try:
+                query_embedding_list = self.Embedder.Embed(query)
+                if not query_embedding_list or not has_embedding(query_embedding_list[0]):
+                     logger.error("Failed to generate query embedding. Cannot search logs.")
+                     return []
+                queryEmbedding = query_embedding_list[0]
+            except Exception as e:
+                logger.exception("Error generating query embedding for log search.")
+                return []
+
+        self._EmbedMissing()
+        matrix = self._GetEmbeddingMatrix()
+        if not len(matrix):
+            logger.warning("SearchRelevantLogs called but no log embeddings available.")
             return []
 
-        scores = []
-        valid_log_count = 0
-        for i, log in enumerate(self.Logs):
-            if log.Embedding: # Embedding が存在するログのみを対象
-                valid_log_count += 1
-                try:
-                    score = util.cos_sim(queryEmbedding, log.Embedding)[0][0].item()
-                    if score >= similarity_threshold:
-                        scores.append((log, score))
-                        logger.debug(f"  Log {i} similarity: {score:.4f} (Above threshold)")
-                    # else:
-                        # logger.debug(f"  Log {i} similarity: {score:.4f} (Below threshold)")
-                except Exception as e:
-                    logger.warning(f"Could not calculate similarity for log index {i}: {e}")
-            # else:
-                # logger.debug(f"  Log {i} skipped (no embedding).")
-
-
-        if not scores:
+        # 全ログとの類似度を1回の行列積で計算する (件数が多く faiss があれば HNSW で近似検索する)
+        hits, n_above = matrix.Search(queryEmbedding, topK, similarity_threshold)
+        if not hits:
             logger.info(f"No logs found above similarity threshold {similarity_threshold}.")
             return []
 
-        # スコアでソート
-        scores.sort(key=lambda x: x[1], reverse=True)
-        logger.info(f"Found {len(scores)} logs above threshold. Returning top {min(topK, len(scores))}.")
+        logger.info(f"Found {n_above} logs above threshold. Returning top {len(hits)}.")
+        if logger.isEnabledFor(logging.DEBUG): # 無効なときはループごと省く
+            for i, score in hits:
+                logger.debug("  Log %d similarity: %.4f", i, score)
+        return [self.Logs[i] for i, score in hits]
+
+    def _EmbedMissing(self):
+        """読み込み時に Embedding がなかったログをまとめて計算し、ファイルとサイドカーに書き戻す"""
+        if not self._HasMissingEmbeddings:
+            return
+        self._HasMissingEmbeddings = False # 失敗しても検索のたびに再試行はしない
+        missing = [i for i, entry in enumerate(self.Logs) if entry.Embedding is None and entry.UserInput]
+        if not missing:
+            return
+        logger.info(f"Calculating embeddings for {len(missing)} log entries without embeddings...")
+        try:
+            new_embeddings = self.Embedder.Embed([self.Logs[i].UserInput for i in missing])
+        except Exception as e:
+            logger.exception("Error during embedding calculation for logs.")
+            return
+        if len(new_embeddings) != len(missing):
+            logger.error("Number of generated embeddings does not match number of texts.")
+            return
+        for i, embedding in zip(missing, new_embeddings):
+            if has_embedding(embedding): # Embedderが空リストを返さないか確認
+                self.Logs[i].Embedding = embedding
+        self._Embeddings.Version = -1 # 次の _GetEmbeddingMatrix で作り直す
+        logger.info("Embeddings calculated and added for missing entries.")
+        self._RewriteLogFile()
+
+    def _RewriteLogFile(self):
+        """全ログでログファイルと Embedding のサイドカーを書き直す (一時ファイルに書いてから置き換える)"""
+        try:
+            generation = self._EmbeddingGen + 1 # Embedding は新しい世代のサイドカーに書く
+            lines = []
+            rows = []
+            for entry in self.Logs:
+                record = entry.to_dict()
+                embedding = record.pop("Embedding")
+                if has_embedding(embedding) and (not rows or len(embedding) == len(rows[0])):
+                    record["EmbeddingGen"] = generation
+                    record["EmbeddingRow"] = len(rows)
+                    rows.append(embedding)
+                elif has_embedding(embedding):
+                    record["EmbeddingB64"] = encode_inline(embedding) # float16 のバイト列を base64 で書く
+                lines.append(fast_json.dumps(record) + b"\n")
+            if rows:
+                # 今のログファイルが指すサイドカーとは別名なので、ここで落ちても元のログとサイドカーの対は崩れない
+                save_embeddings(sidecar_path_for(self.log_path, generation), rows)
+            tmp_path = self.log_path.with_name(self.log_path.name + ".tmp")
+            with tmp_path.open("wb") as f:
+                f.writelines(lines)
+            self.close() # 置き換える前のファイルに追記し続けないように閉じる (Windows では開いたままだと置き換えられない)
+            os.replace(tmp_path, self.log_path)
+            # ログファイルが新しい世代を指すようになってから、古い世代のサイドカーを消す
+            self._SetEmbeddingGeneration(generation)
+            remove_stale_sidecars(self.log_path, generation)
+            logger.info(f"Rewrote {len(lines)} log entries to {self.log_path}.")
+        except IOError as e:
+            logger.error(f"Failed to rewrite log file {self.log_path}: {e}")
+        except Exception as e:
+            logger.exception("Unexpected error during _RewriteLogFile")
+
+    def _GetEmbeddingMatrix(self):
+        """検索用の Embedding 行列 (EmbeddingMatrix) を返す (読み込み直後などで古ければ作り直す)"""
+        if self._Embeddings.Version != self.Version:
+            self._Embeddings.Rebuild([entry.Embedding for entry in self.Logs])
+            self._Embeddings.Version = self.Version
+        return self._Embeddings
 
-        # 上位K件を返す
-        return [log for log, score in scores[:topK]]
\ No newline at end of file
+    def _UpdateEmbeddings(self, update):
+        """
+        Version を進め、Embedding 行列が最新だった場合は update(行列) で差分だけ反映する。
+        最新でなかった場合 (まだ検索していないなど) は何もしない (次の検索時に作り直す)。
+        """
+        in_sync = self._Embeddings.Version == self.Version
+        self.Version += 1
+        if in_sync:
+            update(self._Embeddings)
+            self._Embeddings.Version = self.Version
@@ -1,16 +1,19 @@
 # src/my_local_ai/memory/memory_manager.py
-import json
 import os
-from dataclasses import dataclass, field, asdict # asdict を追加
-from typing import List, Optional, Dict # 型ヒント用
+from dataclasses import dataclass, field
+from typing import List, Optional, Dict, Tuple # 型ヒント用
 from pathlib import Path
 import logging # logging をインポート
 
+import numpy as np
+
 # 関連モジュール
 try:
     # from .embedder import Embedder # 相対インポート
     from my_local_ai.memory.embedder import Embedder # 絶対インポート
-    from sentence_transformers import util # 類似度計算用
+    from my_local_ai.memory.vector_search import EmbeddingMatrix, as_embedding, has_embedding, normalize_rows
+    from my_local_ai.memory.embedding_store import SidecarReader, append_embeddings, decode_inline, encode_inline, remove_stale_sidecars, save_embeddings, sidecar_path_for
+    from my_local_ai.utils import fast_json # orjson があれば使う (Embedding の浮動小数点数のパースが速い)
 except ImportError as e:
     print(f"FATAL Error importing dependencies in MemoryManager: {e}")
     raise
@@ -18,31 +21,41 @@ except ImportError as e:
 # このモジュール用のロガーを取得
 logger = logging.getLogger(__name__)
 
-@dataclass
+@dataclass(slots=True) # __slots__ で属性アクセスを高速化し、メモリも削減
 class MemoryEntry:
     Id: int
     Content: str
-    Embedding: Optional[List[float]] = field(default=None, repr=False) # repr=Falseでログ出力時に省略
+    Embedding: Optional[np.ndarray] = field(default=None, repr=False, compare=False) # repr=Falseでログ出力時に省略 (ndarray は == で比較できないので比較対象外)
 
     def to_dict(self):
-        # asdict を使って dataclass を辞書に変換
-        return asdict(self)
+        # asdict は各フィールドを再帰的にコピーする (Embedding のリストも) ので、手で辞書を作る
+        return {"Id": self.Id, "Content": self.Content, "Embedding": self.Embedding}
 
     @classmethod
     def from_dict(cls, data: dict):
         # 辞書から dataclass インスタンスを作成 (後方互換性や柔軟性のため)
+        embedding = decode_inline(data.get("EmbeddingB64")) # サイドカーに書けなかったもの
+        if embedding is None:
+            embedding = as_embedding(data.get("Embedding")) # 旧形式 (JSON に数値のリストで書かれている)。なければ None
         return cls(
             Id=data.get("Id", -1), # IDがない場合のデフォルト値
             Content=data.get("Content", ""),
-            Embedding=data.get("Embedding") # なければ None
+            Embedding=embedding
         )
 
 class MemoryManager:
     def __init__(self, memory_path: str, embedder: Embedder):
         self.memory_path = Path(memory_path)
+        self.embedding_path = sidecar_path_for(self.memory_path) # Embedding は float16 のサイドカーに保存する (追記先の世代のパス)
+        self._EmbeddingGen = 0 # 追記先のサイドカーの世代 (書き直すたびに増やす)
         self.Embedder = embedder
         self.Memories: List[MemoryEntry] = []
         self.NextId = 0
+        self._NeedsCompaction = False # 編集・削除や旧形式のファイルなど、追記では済まない変更があるか
+        self.Version = 0 # 記憶が変わるたびに増やす (Retriever の検索結果キャッシュの無効化用)
+        # 検索用の正規化済み Embedding 行列 (書き込みのたびに差分だけ更新する)
+        self._Embeddings = EmbeddingMatrix()
+        self._HasMissingEmbeddings = False # 読み込み時に Embedding がなかった記憶があるか (最初の検索時に計算する)
         logger.info(f"MemoryManager initialized. Memory file path: {self.memory_path}")
         self.LoadFromFile()
 
@@ -50,60 +63,66 @@ class MemoryManager:
         logger.info(f"Attempting to load memories from {self.memory_path}...")
         self.Memories = []
         self.NextId = 0
+        self.Version += 1
+        self._NeedsCompaction = False
+        self._HasMissingEmbeddings = False
+        self._SetEmbeddingGeneration(0)
         if not self.memory_path.exists():
             logger.warning(f"Memory file not found at {self.memory_path}. Starting with empty memory.")
             return
 
         memories_to_embed = [] # Embedding がない記憶のインデックスとテキスト
+        # サイドカーの Embedding (各記録の "EmbeddingGen" と "EmbeddingRow" が世代と行番号を指す)
+        # 新しい Embedding は単位ベクトルで保存しているが、正規化前に保存された古いものや
+        # float16 の丸め誤差もあるので、読み込み時に1回の行列演算でまとめて正規化し直す
+        sidecars = SidecarReader(self.memory_path, transform=normalize_rows)
         try:
-            with self.memory_path.open("r", encoding="utf-8") as f:
-                try:
-                    # ファイル全体が単一のJSONリストであると想定
-                    memories_data = json.load(f)
+            with self.memory_path.open("rb") as f: # orjson は bytes をそのままデコードできる
+                # 旧形式 (ファイル全体が単一の JSON リスト) と JSON Lines 形式を先頭の文字で見分ける
+                head = f.read(1)
+                while head and head.isspace():
+                    head = f.read(1)
+                f.seek(0)
+                if head == b"[":
+                    try:
+                        memories_data = fast_json.loads(f.read())
+                    except fast_json.JSONDecodeError:
+                        logger.error(f"Failed to decode JSON from {self.memory_path}. Memory might be corrupted.")
+                        return
                     if not isinstance(memories_data, list):
-                         logger.warning(f"Memory file {self.memory_path} is not a valid JSON list. Starting empty.")
-                         return
-
-                    max_id = -1
-                    for i, data in enumerate(memories_data):
-                        if isinstance(data, dict):
-                            # from_dict を使って柔軟に読み込み
-                            entry = MemoryEntry.from_dict(data)
-                            if entry.Id >= 0: # 有効なIDを持つエントリのみ追加
-                                self.Memories.append(entry)
-                                max_id = max(max_id, entry.Id)
-                                if entry.Embedding is None and entry.Content:
-                                     memories_to_embed.append((len(self.Memories) - 1, entry.Content))
-                            else:
-                                logger.warning(f"Skipping memory entry with invalid or missing Id at index {i}.")
-                        else:
-                            logger.warning(f"Skipping invalid (non-dict) memory entry at index {i}.")
+                        logger.warning(f"Memory file {self.memory_path} is not a valid JSON list. Starting empty.")
+                        return
+                    # 旧形式には追記できないので、次の保存時に JSON Lines 形式で書き直す
+                    self._NeedsCompaction = True
+                else:
+                    # 1行ずつデコードしながら処理する (ファイル全体やデコード済みの全記憶を一度に持たない)
+                    memories_data = self._IterJsonLines(f)
 
-                    self.NextId = max_id + 1 # 次のIDを設定
-                    logger.info(f"Loaded {len(self.Memories)} memories. Next ID set to {self.NextId}.")
+                max_id = -1
+                for i, data in enumerate(memories_data):
+                    if isinstance(data, dict):
+                        # from_dict を使って柔軟に読み込み
+                        entry = MemoryEntry.from_dict(data)
+                        if entry.Embedding is None:
+                            entry.Embedding = sidecars.Get(data)
+                        if entry.Id >= 0: # 有効なIDを持つエントリのみ追加
+                            self.Memories.append(entry)
+                            max_id = max(max_id, entry.Id)
+                            if entry.Embedding is None and entry.Content:
+                                 memories_to_embed.append((len(self.Memories) - 1, entry.Content))
+                        else:
+                            logger.warning(f"Skipping memory entry with invalid or missing Id at index {i}.")
+                    else:
+                        logger.warning(f"Skipping invalid (non-dict) memory entry at index {i}.")
 
-                except json.JSONDecodeError:
-                    logger.error(f"Failed to decode JSON from {self.memory_path}. Memory might be corrupted.")
-                    # Optionally, try to load line by line if it might be JSONL?
-                    # For now, treat as corrupted and start empty.
-                    self.Memories = []
-                    self.NextId = 0
+            self.NextId = max_id + 1 # 次のIDを設定
+            self._SetEmbeddingGeneration(sidecars.LatestGeneration)
+            logger.info(f"Loaded {len(self.Memories)} memories. Next ID set to {self.NextId}.")
 
-            # Embedding がなかった記憶に Embedding を追加
             if memories_to_embed:
-                logger.info(f"Calculating embeddings for {len(memories_to_embed)} memory entries...")
-                indices, texts = zip(*memories_to_embed)
-                try:
-                    new_embeddings = self.Embedder.Embed(list(texts))
-                    if len(new_embeddings) == len(indices):
-                        for idx, embedding in zip(indices, new_embeddings):
-                             if embedding: self.Memories[idx].Embedding = embedding
-                        logger.info("Embeddings recalculated for missing entries.")
-                        # ここでファイルに保存し直すか検討 (SaveToFile)
-                    else:
-                         logger.error("Mismatch between number of embeddings and texts.")
-                except Exception as e:
-                    logger.exception("Error during embedding calculation for memories.")
+                # Embedding の計算 (モデルの読み込みを含む) は最初の検索まで遅らせる
+                logger.info(f"{len(memories_to_embed)} memories have no embedding. They will be embedded on the first search.")
+                self._HasMissingEmbeddings = True
 
         except IOError as e:
             logger.error(f"Failed to read memory file {self.memory_path}: {e}")
@@ -111,21 +130,91 @@ class MemoryManager:
             logger.exception(f"Unexpected error during LoadFromFile")
 
 
+    def _SetEmbeddingGeneration(self, generation: int):
+        """追記先のサイドカーを generation の世代に切り替える"""
+        self._EmbeddingGen = generation
+        self.embedding_path = sidecar_path_for(self.memory_path, generation)
+
+    def _IterJsonLines(self, f):
+        """JSON Lines のファイルを1行ずつデコードして返す (壊れた行は飛ばす)"""
+        for i, line in enumerate(f):
+            line = line.strip()
+            if not line: continue
+            try:
+                yield fast_json.loads(line)
+            except fast_json.JSONDecodeError:
+                logger.warning(f"Failed to decode JSON from line {i+1} in {self.memory_path}. Skipping line.")
+
     def SaveToFile(self):
+        """
+        記憶をファイルに書き出す。SaveMemory は1行ずつ追記済みなので、
+        編集・削除や旧形式からの移行でファイル全体を書き直す必要がある場合だけ書き直す。
+        """
+        if not self._NeedsCompaction and self.memory_path.exists():
+            logger.info(f"Memories in {self.memory_path} are already up to date.")
+            return
+        self._CompactToFile()
+
+    def _CompactToFile(self):
+        """全記憶で JSON Lines ファイルと Embedding のサイドカーを書き直す"""
         logger.info(f"Saving {len(self.Memories)} memories to {self.memory_path}...")
         try:
             # dataディレクトリが存在しない場合は作成
             self.memory_path.parent.mkdir(parents=True, exist_ok=True)
-            # 各MemoryEntryを辞書に変換してからリストとして保存
-            memory_list = [entry.to_dict() for entry in self.Memories]
-            with self.memory_path.open("w", encoding="utf-8") as f:
-                json.dump(memory_list, f, ensure_ascii=False, indent=2) # インデント追加
+            # Embedding は新しい世代のサイドカーにまとめて書き、JSON には世代と行番号だけを書く (次元が揃わないものは JSON に直接書く)
+            generation = self._EmbeddingGen + 1
+            lines = []
+            rows = []
+            for entry in self.Memories:
+                record = entry.to_dict()
+                embedding = record.pop("Embedding")
+                if has_embedding(embedding) and (not rows or len(embedding) == len(rows[0])):
+                    record["EmbeddingGen"] = generation
+                    record["EmbeddingRow"] = len(rows)
+                    rows.append(embedding)
+                elif has_embedding(embedding):
+                    record["EmbeddingB64"] = encode_inline(embedding) # float16 のバイト列を base64 で書く
+                lines.append(fast_json.dumps(record) + b"\n")
+            if rows:
+                # 今の JSON が指すサイドカーとは別名なので、ここで落ちても元の JSON とサイドカーの対は崩れない
+                save_embeddings(sidecar_path_for(self.memory_path, generation), rows)
+            # 一時ファイルに書いてから置き換える (途中で落ちても元のファイルを壊さない)
+            tmp_path = self.memory_path.with_name(self.memory_path.name + ".tmp")
+            with tmp_path.open("wb") as f:
+                f.writelines(lines)
+            os.replace(tmp_path, self.memory_path)
+            # JSON が新しい世代を指すようになってから、古い世代のサイドカーを消す
+            self._SetEmbeddingGeneration(generation)
+            remove_stale_sidecars(self.memory_path, generation)
+            self._NeedsCompaction = False
             logger.info("Memories saved successfully.")
         except IOError as e:
             logger.error(f"Failed to write memories to {self.memory_path}: {e}")
         except Exception as e:
             logger.exception("Unexpected error during SaveToFile")
 
+    def _AppendMemory(self, entry: MemoryEntry):
+        """記憶を1件だけファイルの末尾に追記する (Embedding はサイドカーに追記して行番号だけを書く)"""
+        try:
+            self.memory_path.parent.mkdir(parents=True, exist_ok=True)
+            record = entry.to_dict()
+            embedding = record.pop("Embedding")
+            if has_embedding(embedding):
+                try:
+                    record["EmbeddingRow"] = append_embeddings(self.embedding_path, [embedding])
+                    if self._EmbeddingGen:
+                        record["EmbeddingGen"] = self._EmbeddingGen
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Failed to append embedding to {self.embedding_path}: {e}. Writing it inline.")
+                    record["EmbeddingB64"] = encode_inline(embedding) # float16 のバイト列を base64 で書く
+            with self.memory_path.open("ab") as f:
+                f.write(fast_json.dumps(record) + b"\n")
+            logger.debug("Memory ID %d appended to %s.", entry.Id, self.memory_path)
+        except IOError as e:
+            logger.error(f"Failed to append memory to {self.memory_path}: {e}")
+        except Exception as e:
+            logger.exception("Unexpected error during _AppendMemory")
+
     def SaveMemory(self, Content: str):
         if not Content:
             logger.warning("Attempted to save empty memory content.")
@@ -135,7 +224,7 @@ class MemoryManager:
         embedding = None
         try:
             embedding_list = self.Embedder.Embed(Content)
-            if embedding_list: embedding = embedding_list[0]
+            if embedding_list and has_embedding(embedding_list[0]): embedding = embedding_list[0]
         except Exception as e:
              logger.exception("Failed to generate embedding for new memory.")
              # Embedding がなくても保存は続行する（Load時に再計算されるため）
@@ -146,9 +235,15 @@ class MemoryManager:
             Embedding=embedding
         )
         self.Memories.append(memory_entry)
-        logger.debug(f"Memory entry created with ID {self.NextId}")
+        logger.debug("Memory entry created with ID %d", self.NextId)
         self.NextId += 1
-        # 注意: ここではファイルへの自動保存はしない。SaveToFileを別途呼び出す必要がある。
+        position = len(self.Memories) - 1
+        self._UpdateEmbeddings(lambda m: m.Append(position, embedding))
+        # ファイルには1行追記するだけにする (書き直しが必要な変更が残っている場合はまとめて書き直す)
+        if self._NeedsCompaction:
+            self._CompactToFile()
+        else:
+            self._AppendMemory(memory_entry)
 
     def EditMemoryByIndex(self, Index: int, NewContent: str):
         logger.info(f"Attempting to edit memory at index {Index}...")
@@ -157,18 +252,19 @@ class MemoryManager:
             return # 空の内容での更新は許可しない、または別途処理
 
         if 0 <= Index < len(self.Memories):
-            logger.debug(f"Updating memory ID {self.Memories[Index].Id} content and embedding.")
+            logger.debug("Updating memory ID %d content and embedding.", self.Memories[Index].Id)
             self.Memories[Index].Content = NewContent
             new_embedding = None
             try:
                 embedding_list = self.Embedder.Embed(NewContent)
-                if embedding_list: new_embedding = embedding_list[0]
+                if embedding_list and has_embedding(embedding_list[0]): new_embedding = embedding_list[0]
             except Exception as e:
                  logger.exception(f"Failed to generate embedding for edited memory (Index {Index}).")
                  # Embedding の更新に失敗しても内容は更新する
             self.Memories[Index].Embedding = new_embedding
+            self._UpdateEmbeddings(lambda m: m.Replace(Index, new_embedding))
+            self._NeedsCompaction = True # 追記では反映できないので、次の SaveToFile で書き直す
             logger.info(f"Memory at index {Index} updated successfully.")
-            # SaveToFile() をここで呼ぶか検討
         else:
             logger.warning(f"Invalid index ({Index}) for editing memory. Max index is {len(self.Memories) - 1}.")
 
@@ -176,53 +272,94 @@ class MemoryManager:
         logger.info(f"Attempting to delete memory at index {Index}...")
         if 0 <= Index < len(self.Memories):
             deleted_memory = self.Memories.pop(Index)
+            self._UpdateEmbeddings(lambda m: m.Remove(Index))
+            self._NeedsCompaction = True # 追記では反映できないので、次の SaveToFile で書き直す
             logger.info(f"Memory ID {deleted_memory.Id} (at index {Index}) deleted successfully.")
-            # SaveToFile() をここで呼ぶか検討
         else:
             logger.warning(f"Invalid index ({Index}) for deleting memory. Max index is {len(self.Memories) - 1}.")
 
-    def GetAllMemories(self) -> List[MemoryEntry]:
-        logger.debug(f"GetAllMemories called. Returning {len(self.Memories)} entries.")
-        return self.Memories
+    def GetAllMemories(self) -> Tuple[MemoryEntry, ...]:
+        """
+        全記憶を返す (呼び出し側が誤って self.Memories を書き換えないようタプルで返す)。
+        要素の MemoryEntry はコピーしない (Embedding も含めて共有する) ので、O(件数) で済む。
+        """
+        logger.debug("GetAllMemories called. Returning %d entries.", len(self.Memories))
+        return tuple(self.Memories)
 
-    def SearchMemory(self, query: str, topK=3, similarity_threshold=0.5) -> List[MemoryEntry]:
+    def SearchMemory(self, query: str, topK=3, similarity_threshold=0.5, query_embedding=None) -> List[MemoryEntry]:
         logger.info(f"Searching memory for query: '{query[:50]}...', topK={topK}, threshold={similarity_threshold}")
         if not self.Memories:
             logger.warning("SearchMemory called but no memories available.")
             return []
 
-        try:
-            query_embedding_list = self.Embedder.Embed(query)
-            if not query_embedding_list or not query_embedding_list[0]:
-                 logger.error("Failed to generate query embedding. Cannot search memory.")
-                 return []
-            queryEmbedding = query_embedding_list[0]
-        except Exception as e:
-            logger.exception("Error generating query embedding for memory search.")
+        if has_embedding(query_embedding): # 呼び出し側 (Retriever) で計算済みなら Embed を省く
+            queryEmbedding = query_embedding
+        else:
+            try:
+                query_embedding_list = self.Embedder.Embed(query)
+                if not query_embedding_list or not has_embedding(query_embedding_list[0]):
+                     logger.error("Failed to generate query embedding. Cannot search memory.")
+                     return []
+                queryEmbedding = query_embedding_list[0]
+            except Exception as e:
+                logger.exception("Error generating query embedding for memory search.")
+                return []
+
+        self._EmbedMissing()
+        matrix = self._GetEmbeddingMatrix()
+        if not len(matrix):
+            logger.warning("SearchMemory called but no memory embeddings available.")
             return []
 
-        scores = []
-        valid_memory_count = 0
-        for i, mem in enumerate(self.Memories):
-            if mem.Embedding: # Embedding が存在する記憶のみを対象
-                valid_memory_count += 1
-                try:
-                    score = util.cos_sim(queryEmbedding, mem.Embedding)[0][0].item()
-                    if score >= similarity_threshold:
-                        scores.append((mem, score))
-                        logger.debug(f"  Memory {i} (ID {mem.Id}) similarity: {score:.4f} (Above threshold)")
-                    # else:
-                        # logger.debug(f"  Memory {i} (ID {mem.Id}) similarity: {score:.4f} (Below threshold)")
-                except Exception as e:
-                    logger.warning(f"Could not calculate similarity for memory index {i}: {e}")
-            # else:
-                # logger.debug(f"  Memory {i} (ID {mem.Id}) skipped (no embedding).")
-
-        if not scores:
+        # 全記憶との類似度を1回の行列積で計算する (件数が多く faiss があれば HNSW で近似検索する)
+        hits, n_above = matrix.Search(queryEmbedding, topK, similarity_threshold)
+        if not hits:
             logger.info(f"No memories found above similarity threshold {similarity_threshold}.")
             return []
 
-        scores.sort(key=lambda x: x[1], reverse=True)
-        logger.info(f"Found {len(scores)} memories above threshold. Returning top {min(topK, len(scores))}.")
+        logger.info(f"Found {n_above} memories above threshold. Returning top {len(hits)}.")
+        if logger.isEnabledFor(logging.DEBUG): # 無効なときはループごと省く
+            for i, score in hits:
+                logger.debug("  Memory %d (ID %d) similarity: %.4f", i, self.Memories[i].Id, score)
+        return [self.Memories[i] for i, score in hits]
+
+    def _EmbedMissing(self):
+        """読み込み時に Embedding がなかった記憶をまとめて計算し、ファイルとサイドカーに書き戻す"""
+        if not self._HasMissingEmbeddings:
+            return
+        self._HasMissingEmbeddings = False # 失敗しても検索のたびに再試行はしない
+        missing = [i for i, entry in enumerate(self.Memories) if entry.Embedding is None and entry.Content]
+        if not missing:
+            return
+        logger.info(f"Calculating embeddings for {len(missing)} memory entries...")
+        try:
+            new_embeddings = self.Embedder.Embed([self.Memories[i].Content for i in missing])
+        except Exception as e:
+            logger.exception("Error during embedding calculation for memories.")
+            return
+        if len(new_embeddings) != len(missing):
+            logger.error("Mismatch between number of embeddings and texts.")
+            return
+        for i, embedding in zip(missing, new_embeddings):
+            if has_embedding(embedding): self.Memories[i].Embedding = embedding
+        self._Embeddings.Version = -1 # 次の _GetEmbeddingMatrix で作り直す
+        logger.info("Embeddings recalculated for missing entries.")
+        self._CompactToFile()
+
+    def _GetEmbeddingMatrix(self):
+        """検索用の Embedding 行列 (EmbeddingMatrix) を返す (読み込み直後などで古ければ作り直す)"""
+        if self._Embeddings.Version != self.Version:
+            self._Embeddings.Rebuild([entry.Embedding for entry in self.Memories])
+            self._Embeddings.Version = self.Version
+        return self._Embeddings
 
-        return [mem for mem, score in scores[:topK]]
\ No newline at end of file
+    def _UpdateEmbeddings(self, update):
+        """
+        Version を進め、Embedding 行列が最新だった場合は update(行列) で差分だけ反映する。
+        最新でなかった場合 (まだ検索していないなど) は何もしない (次の検索時に作り直す)。
+        """
+        in_sync = self._Embeddings.Version == self.Version
+        self.Version += 1
+        if in_sync:
+            update(self._Embeddings)
+            self._Embeddings.Version = self.Version
@@ -1,5 +1,10 @@
 # src/my_local_ai/memory/retriever.py
-from typing import List, Tuple # 型ヒント用
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple # 型ヒント用
 import logging # logging をインポート
 
 # 関連モジュール (絶対/相対インポート選択)
@@ -7,6 +12,7 @@ try:
     from my_local_ai.memory.memory_manager import MemoryManager, MemoryEntry
     from my_local_ai.memory.log_manager import LogManager, LogEntry
     from my_local_ai.memory.embedder import Embedder
+    from my_local_ai.memory.vector_search import has_embedding
 except ImportError as e:
     print(f"FATAL Error importing dependencies in Retriever: {e}")
     raise
@@ -14,20 +20,79 @@ except ImportError as e:
 # このモジュール用のロガーを取得
 logger = logging.getLogger(__name__)
 
+# 検索結果キャッシュのサイズ (配信では挨拶など同じコメントが繰り返し届く)
+RETRIEVAL_CACHE_SIZE = 512
+# 正規化で取り除く文字 (記号・空白)。日本語の文字は \w に含まれるので残る
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+def normalize_query(query: str) -> str:
+    """
+    キャッシュキー用にクエリを正規化する。
+    NFKC で全角/半角を揃えて小文字化し、記号と空白を取り除く (「こんにちは！」と「こんにちは」が同じキーになる)。
+    記号だけのコメントは空にならないよう、前後の空白を除いた元の文字列を使う。
+    """
+    folded = unicodedata.normalize("NFKC", query).lower()
+    return _NON_WORD_RE.sub("", folded) or folded.strip()
+
 class Retriever:
-    def __init__(self, memory_path: str, log_path: str):
+    def __init__(self, memory_path: str, log_path: str, preload_embedder: bool = False):
         logger.info("Initializing Retriever...")
         # Embedder は内部で1つだけ作成し、各 Manager に渡すのが効率的
-        self.Embedder = Embedder()
+        # preload_embedder=True なら、モデルの読み込みを裏で始めておく (最初の検索を待たせない)
+        self.Embedder = Embedder(preload=preload_embedder)
         logger.info("Initializing MemoryManager...")
         self.MemoryManager = MemoryManager(memory_path, self.Embedder)
         logger.info("Initializing LogManager...")
         self.LogManager = LogManager(log_path, self.Embedder)
+        # 記憶の検索結果の LRU キャッシュ (キーに MemoryManager の Version を含めるため、記憶が変われば自然に外れる)
+        # ログは応答のたびに SaveLog で増えて Version が変わり、キャッシュしてもほぼ当たらないので毎回検索する
+        self._Cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._CacheLock = threading.Lock()
+        # 記憶の検索をログの検索と並行して実行するワーカー (行列積の間は NumPy が GIL を解放する)
+        self._SearchPool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retriever")
         logger.info("Retriever initialized successfully.")
 
-    def RetrieveRelevantInfo(self, query: str, topK_memories=3, topK_logs=5, memory_threshold=0.5, log_threshold=0.5) -> Tuple[List[MemoryEntry], List[LogEntry]]:
+    def close(self):
+        """検索用のワーカーを止め、追記用に開いているログファイルを閉じる (終了時に呼ぶ)"""
+        self._SearchPool.shutdown(wait=True)
+        self.LogManager.close()
+
+    def _CacheGet(self, key: tuple) -> Optional[list]:
+        with self._CacheLock:
+            hit = self._Cache.get(key)
+            if hit is None:
+                return None
+            self._Cache.move_to_end(key)
+        logger.debug("Retrieval cache hit: %s", key[0])
+        return list(hit) # キャッシュ自体は呼び出し側に書き換えられないようタプルで持つ
+
+    def _CachePut(self, key: tuple, result: list) -> list:
+        result = tuple(result)
+        with self._CacheLock:
+            self._Cache[key] = result
+            if len(self._Cache) > RETRIEVAL_CACHE_SIZE:
+                self._Cache.popitem(last=False)
+        return list(result)
+
+    def _EmbedQuery(self, query: str):
+        """記憶とログの検索で共有するクエリの Embedding を1回だけ計算する (失敗したら None。各検索が自分で計算し直す)"""
+        try:
+            embeddings = self.Embedder.Embed(query)
+        except Exception:
+            logger.exception("Error generating query embedding for retrieval.")
+            return None
+        return embeddings[0] if embeddings and has_embedding(embeddings[0]) else None
+
+    def ClearCache(self):
+        """記憶の検索結果のキャッシュを破棄する (Manager を経由せずに記憶を書き換えた場合に呼ぶ)"""
+        with self._CacheLock:
+            self._Cache.clear()
+
+    def RetrieveRelevantInfo(self, query: str, topK_memories=3, topK_logs=5, memory_threshold=0.5, log_threshold=0.5, query_embedding=None) -> Tuple[List[MemoryEntry], List[LogEntry]]:
         """
         クエリに関連する長期記憶と短期記憶（ログ）を検索して返す。
+        記憶は、正規化したクエリが同じで記憶が変わっていない限りキャッシュした結果を返す (ログは毎回検索する)。
+        クエリの Embedding は1回だけ計算して両方の検索で使い、両方とも検索する場合は並行して実行する。
 
         Args:
             query (str): ユーザーの入力クエリ。
@@ -35,20 +100,33 @@ class Retriever:
             topK_logs (int): 取得する短期記憶（ログ）の最大数。
             memory_threshold (float): 長期記憶の類似度閾値。
             log_threshold (float): 短期記憶（ログ）の類似度閾値。
+            query_embedding: 計算済みのクエリの Embedding (あれば Embed を省く)。
 
         Returns:
             Tuple[List[MemoryEntry], List[LogEntry]]: 関連する記憶とログのタプル。
         """
         logger.info(f"Retrieving relevant info for query: '{query[:50]}...'")
         try:
-            relevant_memories = self.MemoryManager.SearchMemory(
-                query, topK=topK_memories, similarity_threshold=memory_threshold
-            )
-            logger.info(f"Retrieved {len(relevant_memories)} relevant memories.")
+            # キーは正規化後の文字列。検索 (Embedding) には最初に届いた元の文字列を使う
+            key = normalize_query(query)
+            memory_key = (key, self.MemoryManager.Version, topK_memories, memory_threshold)
+            relevant_memories = self._CacheGet(memory_key)
 
-            relevant_logs = self.LogManager.SearchRelevantLogs(
-                query, topK=topK_logs, similarity_threshold=log_threshold
-            )
+            if not has_embedding(query_embedding):
+                query_embedding = self._EmbedQuery(query)
+            search_logs = lambda: self.LogManager.SearchRelevantLogs(
+                query, topK=topK_logs, similarity_threshold=log_threshold, query_embedding=query_embedding)
+            if relevant_memories is None:
+                # 記憶はワーカーで、ログはこのスレッドで同時に検索する
+                memories_future = self._SearchPool.submit(
+                    self.MemoryManager.SearchMemory,
+                    query, topK=topK_memories, similarity_threshold=memory_threshold, query_embedding=query_embedding)
+                relevant_logs = search_logs()
+                relevant_memories = self._CachePut(memory_key, memories_future.result())
+            else:
+                relevant_logs = search_logs()
+
+            logger.info(f"Retrieved {len(relevant_memories)} relevant memories.")
             logger.info(f"Retrieved {len(relevant_logs)} relevant logs.")
 
             return relevant_memories, relevant_logs
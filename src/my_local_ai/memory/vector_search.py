@@ -0,0 +1,200 @@
+# src/my_local_ai/memory/vector_search.py
+from typing import List, Optional, Sequence, Tuple # 型ヒント用
+import logging # logging をインポート
+
+import numpy as np
+
+# このモジュール用のロガーを取得
+logger = logging.getLogger(__name__)
+
+# faiss があれば、件数が多いときに HNSW (近似最近傍探索) で検索する
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+ANN_MIN_ENTRIES = 5000 # これ以上の件数で HNSW を使う (少ないうちは行列積の全件走査の方が速い)
+HNSW_M = 16 # HNSW の各ノードの接続数
+HNSW_EF_CONSTRUCTION = 200 # 構築時の探索幅 (大きいほど再現率が上がるが構築が遅い)
+HNSW_EF_SEARCH_MIN = 64 # 検索時の探索幅の下限 (topK の2倍と大きい方を使う)
+
+def has_embedding(embedding) -> bool:
+    """Embedding があるか (None でも空でもないか)。ndarray は真偽値として評価できないので len で判定する"""
+    return embedding is not None and len(embedding) > 0
+
+def as_embedding(value) -> Optional[np.ndarray]:
+    """JSON から読んだ Embedding (数値のリスト) を float32 の ndarray にする (空・None なら None)"""
+    if not has_embedding(value):
+        return None
+    return np.asarray(value, dtype=np.float32)
+
+def normalize_vector(vec) -> Optional[np.ndarray]:
+    """ベクトルを float32 の単位ベクトルにして返す (空・ゼロベクトルなら None)"""
+    if vec is None:
+        return None
+    v = np.asarray(vec, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(v)) if v.size else 0.0
+    if norm == 0.0:
+        return None
+    return v / norm
+
+def normalize_rows(matrix) -> np.ndarray:
+    """(M, d) の行列の各行を L2 正規化した float32 の行列を返す (ゼロベクトルの行はそのまま)"""
+    matrix = np.array(matrix, dtype=np.float32) # 元の配列は書き換えない
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0 # ゼロベクトルはスコア 0 のままにする
+    matrix /= norms
+    return matrix
+
+def build_embedding_matrix(embeddings: Sequence[Optional[Sequence[float]]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Embedding のリストから、行を L2 正規化した (M, d) の float32 行列を作る。
+    Embedding がない要素や次元が揃わない要素は飛ばし、各行が元の何番目かを index として返す。
+    """
+    rows = []
+    index = []
+    dim = None
+    skipped = 0
+    for i, emb in enumerate(embeddings):
+        if emb is None or len(emb) == 0:
+            continue
+        if dim is None:
+            dim = len(emb)
+        elif len(emb) != dim:
+            skipped += 1
+            continue
+        rows.append(emb)
+        index.append(i)
+    if skipped:
+        logger.warning(f"Skipped {skipped} embeddings with mismatched dimensions (expected {dim}).")
+    if not rows:
+        return np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.intp)
+
+    return normalize_rows(rows), np.asarray(index, dtype=np.intp)
+
+def top_k(matrix: np.ndarray, index: np.ndarray, query, topK: int, threshold: float) -> Tuple[List[Tuple[int, float]], int]:
+    """
+    正規化済みの行列とクエリのコサイン類似度を1回の行列積で計算し、
+    閾値以上のうち上位 topK 件を (元のインデックス, スコア) のリストでスコアの高い順に返す。
+    2つ目の戻り値は閾値以上だった件数。
+    """
+    q = normalize_vector(query)
+    if q is None or topK <= 0 or not len(index) or q.shape[0] != matrix.shape[1]:
+        return [], 0
+
+    scores = matrix @ q
+    candidates = np.flatnonzero(scores >= threshold)
+    if not len(candidates):
+        return [], 0
+
+    n_above = len(candidates)
+    candidate_scores = scores[candidates]
+    if n_above > topK:
+        # 全体をソートせず、上位 topK 件だけを取り出してから並べる
+        part = np.argpartition(-candidate_scores, topK - 1)[:topK]
+        candidates, candidate_scores = candidates[part], candidate_scores[part]
+    order = np.lexsort((index[candidates], -candidate_scores)) # 同点なら元の順
+    hits = [(int(index[candidates[j]]), float(candidate_scores[j])) for j in order]
+    return hits, n_above
+
+class EmbeddingMatrix:
+    """
+    検索用の正規化済み Embedding 行列。書き込みのたびに行を追加・置換・削除して保つ (検索のたびに作り直さない)。
+    行の容量は list と同じく倍々で確保し、追加のたびの再確保を避ける。
+    Version は、どの時点の記憶・ログに対応する行列かを Manager 側で照合するためのもの。
+    faiss があり、行数が ANN_MIN_ENTRIES 以上なら、検索は HNSW のインデックスで行う
+    (行の追加はインデックスにも追加し、置換・削除のあとは次の検索時に作り直す)。
+    """
+    def __init__(self):
+        self.Version = -1
+        self._Clear(0)
+
+    def _Clear(self, dim: int) -> None:
+        self._buf = np.empty((0, dim), dtype=np.float32)
+        self._pos = np.empty(0, dtype=np.intp) # 各行が元の何番目の要素か
+        self._n = 0
+        self._ann = None # HNSW のインデックス (ラベル = 行番号)
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._buf[:self._n]
+
+    @property
+    def index(self) -> np.ndarray:
+        return self._pos[:self._n]
+
+    def Rebuild(self, embeddings: Sequence[Optional[Sequence[float]]]) -> None:
+        """全要素の Embedding から作り直す"""
+        matrix, index = build_embedding_matrix(embeddings)
+        self._buf, self._pos, self._n = matrix, index, len(index)
+        self._ann = None
+
+    def Append(self, pos: int, embedding) -> None:
+        """pos 番目の要素の Embedding を行として追加する (Embedding がない・次元が違う場合は追加しない)"""
+        v = normalize_vector(embedding)
+        if v is None:
+            return
+        if self._n == 0 and self._buf.shape[1] != v.shape[0]:
+            self._Clear(v.shape[0])
+        elif v.shape[0] != self._buf.shape[1]:
+            logger.warning(f"Skipped an embedding with mismatched dimensions (expected {self._buf.shape[1]}, got {v.shape[0]}).")
+            return
+        if self._n == len(self._buf):
+            capacity = max(16, 2 * len(self._buf))
+            buf = np.empty((capacity, v.shape[0]), dtype=np.float32)
+            buf[:self._n] = self._buf[:self._n]
+            positions = np.empty(capacity, dtype=np.intp)
+            positions[:self._n] = self._pos[:self._n]
+            self._buf, self._pos = buf, positions
+        self._buf[self._n] = v
+        self._pos[self._n] = pos
+        self._n += 1
+        if self._ann is not None:
+            self._ann.add(v.reshape(1, -1)) # ラベルは追加順 = 行番号
+
+    def Replace(self, pos: int, embedding) -> None:
+        """pos 番目の要素の Embedding を置き換える (None なら行を外す)"""
+        self._DropRow(pos)
+        self.Append(pos, embedding)
+
+    def Remove(self, pos: int) -> None:
+        """pos 番目の要素が削除されたことを反映する (後ろの要素の番号を1つ詰める)"""
+        self._DropRow(pos)
+        index = self._pos[:self._n]
+        index[index > pos] -= 1
+
+    def _DropRow(self, pos: int) -> None:
+        rows = np.flatnonzero(self._pos[:self._n] == pos)
+        if not len(rows):
+            return
+        row = int(rows[0])
+        self._buf[row:self._n - 1] = self._buf[row + 1:self._n]
+        self._pos[row:self._n - 1] = self._pos[row + 1:self._n]
+        self._n -= 1
+        self._ann = None # 行番号がずれるので、次の検索時に作り直す
+
+    def Search(self, query, topK: int, threshold: float) -> Tuple[List[Tuple[int, float]], int]:
+        """top_k と同じ形で結果を返す (HNSW を使った場合、2つ目の戻り値は返した件数)"""
+        if faiss is None or self._n < ANN_MIN_ENTRIES:
+            return top_k(self.matrix, self.index, query, topK, threshold)
+        q = normalize_vector(query)
+        if q is None or topK <= 0 or q.shape[0] != self._buf.shape[1]:
+            return [], 0
+        if self._ann is None:
+            self._BuildAnnIndex()
+        self._ann.hnsw.efSearch = max(HNSW_EF_SEARCH_MIN, 2 * topK)
+        scores, rows = self._ann.search(q.reshape(1, -1), min(topK, self._n))
+        hits = [(int(self._pos[row]), float(score)) for score, row in zip(scores[0], rows[0])
+                if row >= 0 and score >= threshold]
+        hits.sort(key=lambda hit: (-hit[1], hit[0])) # 同点なら元の順
+        return hits, len(hits)
+
+    def _BuildAnnIndex(self) -> None:
+        logger.info(f"Building HNSW index for {self._n} embeddings...")
+        index = faiss.IndexHNSWFlat(self._buf.shape[1], HNSW_M, faiss.METRIC_INNER_PRODUCT) # 正規化済みなので内積 = コサイン類似度
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.add(self.matrix)
+        self._ann = index
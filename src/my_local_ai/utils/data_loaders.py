@@ -1,21 +1,123 @@
 # src/my_local_ai/utils/data_loaders.py
-import json
+import os
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 import logging # logging をインポート
 
+from my_local_ai.utils import fast_json
+from my_local_ai.utils.fast_json import intern_keys
+
 # このモジュール用のロガーを取得
 logger = logging.getLogger(__name__)
 
+# identity.json のパース結果のキャッシュ: パス -> (mtime_ns, size, identity)
+# identity.json は内省のときにしか書き換わらないため、mtime とサイズが同じなら読み直さない
+_IDENTITY_CACHE: Dict[str, Tuple[int, int, dict]] = {}
+
+def read_identity_file(identity_path: Path) -> dict:
+    """
+    identity.json をパースして返す (mtime とサイズが前回と同じならキャッシュを返す)。
+    返す辞書はキャッシュと共有されるため、書き換える場合は呼び出し側でコピーすること。
+    読み込み・パースのエラーはそのまま送出する。
+    """
+    st = identity_path.stat()
+    key = str(identity_path)
+    cached = _IDENTITY_CACHE.get(key)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        logger.debug("Identity cache hit: %s", identity_path.name)
+        return cached[2]
+    identity = intern_keys(fast_json.loads(identity_path.read_bytes())) # 辞書キーを intern (プロンプト整形時の参照用)
+    _IDENTITY_CACHE[key] = (st.st_mtime_ns, st.st_size, identity)
+    return identity
+
+def store_identity_cache(identity_path: Path, identity: dict) -> None:
+    """identity.json を書き込んだ直後に呼び、書き込んだ内容でキャッシュを更新する (次回の読み込みを省く)"""
+    try:
+        st = identity_path.stat()
+    except OSError:
+        _IDENTITY_CACHE.pop(str(identity_path), None)
+        return
+    _IDENTITY_CACHE[str(identity_path)] = (st.st_mtime_ns, st.st_size, identity)
+
+def tail_jsonl(path: Path, n: int, block_size: int = 8192, end: Optional[int] = None) -> List[Dict]:
+    """
+    JSONL ファイルの最後の n 件をパースして返す。
+    ファイル末尾 (end を指定した場合はそのバイトオフセット) からブロック単位で逆方向に読み、
+    必要な行数が揃った時点で止める (ファイル全体は読まない)。
+    """
+    if n <= 0:
+        return []
+    with path.open('rb') as f:
+        pos = f.seek(0, os.SEEK_END)
+        if end is not None:
+            pos = min(pos, end)
+        buf = b""
+        # 空行も含め n+1 個の改行が見つかれば、末尾 n 行は完全に buf に含まれる (空行が多い場合は読み足す)
+        while pos > 0:
+            read_size = min(block_size, pos)
+            pos -= read_size
+            f.seek(pos)
+            buf = f.read(read_size) + buf
+            if buf.count(b"\n") > n and sum(1 for line in buf.split(b"\n")[1:] if line.strip()) >= n:
+                break
+    lines = [line for line in buf.split(b"\n") if line.strip()][-n:]
+    logs = []
+    for line in lines:
+        try:
+            logs.append(fast_json.loads(line))
+        except fast_json.JSONDecodeError:
+            continue
+    return logs
+
+def reflections_path_for(identity_path: Path) -> Path:
+    """
+    identity.json に対応する内省履歴 (追記専用の JSONL) のパスを返す。
+    内省の全履歴はこちらに1行1件で追記し、identity.json には信念・価値観などの小さな情報だけを置く。
+    """
+    return identity_path.with_name("reflections.jsonl")
+
+def read_latest_reflection(identity_path: Path, identity: Optional[dict] = None) -> Optional[dict]:
+    """
+    最新の内省を返す。reflections.jsonl があればその末尾1行だけを読み、
+    なければ (移行前の) identity の Reflections の最後の要素を返す。
+    """
+    reflections_path = reflections_path_for(identity_path)
+    if reflections_path.is_file():
+        latest = tail_jsonl(reflections_path, 1)
+        if latest and isinstance(latest[-1], dict):
+            return latest[-1]
+    reflections = (identity or {}).get("Reflections") or []
+    return reflections[-1] if reflections else None
+
+def append_reflections(identity_path: Path, reflections: List[dict]) -> None:
+    """内省を reflections.jsonl に追記する (履歴全体は書き直さない)"""
+    data = b"".join(fast_json.dumps(r) + b"\n" for r in reflections)
+    with reflections_path_for(identity_path).open("ab") as f:
+        f.write(data)
+
+def write_identity_file(identity_path: Path, identity: dict) -> None:
+    """
+    identity.json を一時ファイルに書いてから os.replace で置き換える (途中でクラッシュしても壊れない)。
+    エンコードは fast_json (orjson) でまとめて行い、1回の write で書き込む。
+    """
+    identity_path.parent.mkdir(parents=True, exist_ok=True) # Ensure directory exists
+    tmp_path = identity_path.with_name(identity_path.name + ".tmp")
+    tmp_path.write_bytes(fast_json.dumps(identity, indent=True))
+    os.replace(tmp_path, identity_path)
+    store_identity_cache(identity_path, identity) # 次回の読み込みでパースを省く
+
 def load_identity_data(identity_path: Path) -> dict:
-    """identity.json ファイルを読み込み、辞書として返す。"""
+    """
+    identity.json ファイルを読み込み、辞書として返す。
+    Reflections には最新の内省1件だけを載せる (全履歴は reflections.jsonl にある)。
+    """
     identity = {}
     logger.debug(f"Attempting to load identity data from: {identity_path}")
     if identity_path.is_file():
         try:
-            with identity_path.open('r', encoding='utf-8') as f:
-                identity = json.load(f)
+            identity = dict(read_identity_file(identity_path)) # キャッシュと共有しないよう浅いコピーにする
             logger.info(f"アイデンティティデータをロードしました: {identity_path.name}")
-        except json.JSONDecodeError:
+        except fast_json.JSONDecodeError:
             logger.warning(f"'{identity_path.name}' のJSON形式が不正か空です。デフォルト値を使用します。")
             identity = {}
         except Exception as e:
@@ -28,6 +130,7 @@ def load_identity_data(identity_path: Path) -> dict:
     # 基本構造を保証
     identity.setdefault("Beliefs", [])
     identity.setdefault("Values", [])
-    identity.setdefault("Reflections", [])
+    latest_reflection = read_latest_reflection(identity_path, identity)
+    identity["Reflections"] = [latest_reflection] if latest_reflection else []
     logger.debug(f"Loaded identity data structure ensured (Keys: {list(identity.keys())})")
     return identity
\ No newline at end of file
@@ -0,0 +1,55 @@
+# src/my_local_ai/utils/fast_json.py
+import json
+import sys
+import logging # logging をインポート
+
+# このモジュール用のロガーを取得
+logger = logging.getLogger(__name__)
+
+# orjson があれば高速なエンコード・デコードに使い、なければ標準の json にフォールバックする
+try:
+    import orjson
+    logger.debug("orjson loaded. Using it for JSON encoding/decoding.")
+except ImportError:
+    orjson = None
+    logger.debug("orjson not found. Falling back to the standard json module.")
+
+# orjson.JSONDecodeError は json.JSONDecodeError のサブクラスなので、これを捕捉すればどちらにも対応できる
+JSONDecodeError = json.JSONDecodeError
+
+def loads(data):
+    """bytes または str の JSON をデコードする (orjson が利用可能ならそちらを使う)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(obj, indent: bool = False) -> bytes:
+    """
+    obj を UTF-8 の JSON (bytes) にエンコードする。indent=True なら2スペースでインデントする。
+    orjson が利用可能ならそちらを使う (結果は1つの bytes なので、ファイルへは1回の write で書ける)。
+    numpy の配列・スカラーもそのまま渡せる (orjson は C で直接書き出し、標準の json では tolist で変換する)。
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY # 標準の json と同様に str 以外のキーも受け付ける
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None, default=_numpy_default).encode("utf-8")
+
+def _numpy_default(obj):
+    """標準の json で numpy の配列・スカラー (tolist を持つもの) を list / 数値に変換する"""
+    tolist = getattr(obj, "tolist", None)
+    if tolist is None:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return tolist()
+
+def intern_keys(obj):
+    """
+    デコード済みの JSON (辞書・リストの入れ子) の辞書キーを sys.intern したものに置き換える。
+    コード中のキー文字列リテラルは既に intern 済みなので、.get() の比較がポインタ比較で済むようになる。
+    """
+    if isinstance(obj, dict):
+        return {sys.intern(k) if isinstance(k, str) else k: intern_keys(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [intern_keys(v) for v in obj]
+    return obj
@@ -2,101 +2,240 @@
 import sounddevice # sounddevice をインポート
 import logging
 import requests
+from requests.adapters import HTTPAdapter
 import soundfile
+import numpy as np
 import io
 import json
+import os
+import wave
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-import platform
+from typing import Iterable, Iterator, Optional
 import logging # logging をインポート
 
 # このモジュール用のロガーを取得
 logger = logging.getLogger(__name__)
 
-# --- 再生ライブラリのインポートと準備 ---
-playsound_func = None
-winsound_module = None
-
+# zstandard があれば、ディスクキャッシュの WAV を圧縮して保存する (なければ無圧縮で保存する)
 try:
-    from playsound3 import playsound as playsound3_play
-    playsound_func = playsound3_play
-    logger.info("Playback library: playsound3 loaded.")
+    import zstandard
 except ImportError:
-    logger.warning("'playsound3' library not found. Will try winsound.")
+    zstandard = None
 
-if platform.system() == "Windows":
-    try:
-        import winsound
-        winsound_module = winsound
-        if playsound_func is None:
-             logger.info("Playback library: winsound available (Windows fallback).")
-    except ImportError:
-        logger.info("winsound module not found on this Windows system.")
-else:
-    if playsound_func is None:
-         logger.info("winsound is not available on non-Windows OS.")
-
-if playsound_func is None and winsound_module is None:
-    logger.error("音声再生ライブラリ (playsound3 または winsound) が見つかりません。")
-
-# --- プロジェクトルートと一時ファイルのパス定義 ---
-try:
-    PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent.parent
-    TEMP_WAV_DIR = PROJECT_ROOT / "data" / "temp"
-    TEMP_WAV_FILENAME = TEMP_WAV_DIR / "_temp_aivis_output.wav"
-    logger.debug(f"Project root determined: {PROJECT_ROOT}")
-    logger.debug(f"Temporary WAV path: {TEMP_WAV_FILENAME}")
-except NameError:
-    PROJECT_ROOT = Path.cwd()
-    TEMP_WAV_DIR = PROJECT_ROOT / "data" / "temp"
-    TEMP_WAV_FILENAME = TEMP_WAV_DIR / "_temp_aivis_output.wav"
-    logger.warning(f"Could not determine project root from __file__. Using CWD: {PROJECT_ROOT}")
+# 合成した WAV の LRU キャッシュの件数 (挨拶など同じ文を読み上げる場合は API を呼ばずに済む)
+WAV_CACHE_MAX_ENTRIES = 128
+# ディスクキャッシュ (cache_dir を指定した場合) に残すファイル数の上限 (起動時に古いものから消す)
+WAV_DISK_CACHE_MAX_FILES = 2000
+WAV_DISK_CACHE_ZSTD_LEVEL = 3 # 音声の PCM でもおよそ半分になり、圧縮も十分速い
+# ストリーミング受信・再生の単位
+WAV_STREAM_CHUNK_BYTES = 8192
+PLAYBACK_BLOCK_FRAMES = 1024
+# np.frombuffer でそのまま扱える WAV のサンプル幅 (バイト) -> numpy の dtype (24bit は numpy にないので soundfile で読む)
+_PCM_NUMPY_DTYPES = {1: np.uint8, 2: '<i2', 4: '<i4'}
+# WAV のサンプル幅 (バイト) -> sounddevice の dtype (8bit の WAV は符号なし)
+_PCM_DTYPES = {1: 'uint8', 2: 'int16', 3: 'int24', 4: 'int32'}
+
+class _ChunkReader(io.RawIOBase):
+    """受信したチャンクを順に読むだけのファイルオブジェクト (シーク不可)。memoryview で切り出してコピーを避ける"""
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buf = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
 
+    def readinto(self, b) -> int:
+        while not self._buf:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buf = memoryview(chunk)
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
 
 # --- AivisAdapter クラス ---
 class AivisAdapter:
-    def __init__(self, url="http://127.0.0.1:10101", speaker_id=888753760):
+    def __init__(self, url="http://127.0.0.1:10101", speaker_id=888753760, cache_dir: Optional[Path] = None):
+        """
+        cache_dir: 合成した WAV を保存するディレクトリ (再起動後も同じ文は API を呼ばずに済む)。None ならメモリ上のキャッシュだけを使う。
+        """
         self.URL = url
         self.speaker = speaker_id
+        # /audio_query と /synthesis で同じ接続を使い回すため Session を保持する (keep-alive で毎回の TCP 接続を省く)
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        # (話者, テキスト) のハッシュ -> WAV の LRU キャッシュ
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        if self.cache_dir is not None:
+            self._PruneDiskCache()
         logger.info(f"AivisAdapter Initialized. URL: {self.URL}, Speaker ID: {self.speaker}")
 
     def generate_voice_wav(self, text: str) -> bytes | None:
+        """WAV 全体を生成して返す (失敗時は None)"""
+        try:
+            return b"".join(self._IterVoiceWav(text)) or None
+        except Exception as e:
+            self._LogRequestError(e)
+        return None
+
+    def stream_voice_wav(self, text: str) -> Iterator[bytes]:
+        """
+        WAV を受信しながらチャンクごとに返す (ヘッダーと先頭のフレームが届いた時点で再生を始められる)。
+        失敗した場合はそこで終わる (エラーはログに出す)。
+        """
+        try:
+            yield from self._IterVoiceWav(text)
+        except Exception as e:
+            self._LogRequestError(e)
+
+    def _IterVoiceWav(self, text: str) -> Iterator[bytes]:
         if not text:
             logger.warning("AivisAdapter: Received empty text.")
-            return None
+            return
+        key = self._CacheKey(text)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        if cached is not None:
+            logger.info(f"AivisAdapter: Using cached audio for text (length {len(text)}).")
+            yield cached
+            return
+        cached = self._LoadFromDisk(key)
+        if cached is not None:
+            logger.info(f"AivisAdapter: Using disk-cached audio for text (length {len(text)}).")
+            self._CachePut(key, cached)
+            yield cached
+            return
+
         logger.info(f"AivisAdapter: Generating audio for text (length {len(text)})...")
-        logger.debug(f"AivisAdapter: Text snippet: '{text[:30]}...'")
-        try:
-            query_params = {"text": text, "speaker": self.speaker}
-            logger.debug(f"Sending audio_query request to {self.URL}/audio_query with params: {query_params}")
-            query_response = requests.post(f"{self.URL}/audio_query", params=query_params, timeout=10)
-            query_response.raise_for_status()
-            audio_query_data = query_response.json()
-            logger.info("AivisAdapter: Audio query successful.")
-            logger.debug(f"Audio query data (keys): {list(audio_query_data.keys()) if isinstance(audio_query_data, dict) else 'N/A'}")
-
-
-            synthesis_params = {"speaker": self.speaker}
-            synthesis_headers = {"accept": "audio/wav", "Content-Type": "application/json"}
-            logger.debug(f"Sending synthesis request to {self.URL}/synthesis with speaker: {synthesis_params['speaker']}")
-            audio_response = requests.post(
-                f"{self.URL}/synthesis", params=synthesis_params, headers=synthesis_headers,
-                data=json.dumps(audio_query_data), timeout=20
-            )
+        logger.debug("AivisAdapter: Text snippet: '%s...'", text[:30])
+        query_params = {"text": text, "speaker": self.speaker}
+        logger.debug("Sending audio_query request to %s/audio_query with params: %s", self.URL, query_params)
+        query_response = self._session.post(f"{self.URL}/audio_query", params=query_params, timeout=10)
+        query_response.raise_for_status()
+        audio_query_data = query_response.json()
+        logger.info("AivisAdapter: Audio query successful.")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Audio query data (keys): %s", list(audio_query_data.keys()) if isinstance(audio_query_data, dict) else 'N/A')
+
+
+        synthesis_params = {"speaker": self.speaker}
+        synthesis_headers = {"accept": "audio/wav", "Content-Type": "application/json"}
+        logger.debug("Sending synthesis request to %s/synthesis with speaker: %s", self.URL, synthesis_params['speaker'])
+        chunks = []
+        # stream=True で受信したチャンクから順に返す (本文全体の受信を待たない)
+        with self._session.post(
+            f"{self.URL}/synthesis", params=synthesis_params, headers=synthesis_headers,
+            data=json.dumps(audio_query_data), timeout=20, stream=True
+        ) as audio_response:
             audio_response.raise_for_status()
-            logger.info(f"AivisAdapter: Synthesis successful (Received {len(audio_response.content)} bytes).")
-            return audio_response.content
+            for chunk in audio_response.iter_content(chunk_size=WAV_STREAM_CHUNK_BYTES):
+                if chunk:
+                    chunks.append(chunk)
+                    yield chunk
+        wav_data = b"".join(chunks)
+        logger.info(f"AivisAdapter: Synthesis successful (Received {len(wav_data)} bytes).")
+        # 最後まで受信できた場合だけキャッシュする
+        self._CachePut(key, wav_data)
+        self._SaveToDisk(key, wav_data)
+
+    def _CachePut(self, key: str, wav_data: bytes) -> None:
+        with self._cache_lock:
+            self._cache[key] = wav_data
+            self._cache.move_to_end(key)
+            if len(self._cache) > WAV_CACHE_MAX_ENTRIES:
+                self._cache.popitem(last=False)
+
+    # --- ディスクキャッシュ (メモリ上は無圧縮のまま、ディスクには zstd で圧縮して保存する) ---
+    def _DiskCachePath(self, key: str) -> Path:
+        return self.cache_dir / (key + (".wav.zst" if zstandard is not None else ".wav"))
 
-        except requests.exceptions.ConnectionError:
+    def _LoadFromDisk(self, key: str) -> bytes | None:
+        if self.cache_dir is None:
+            return None
+        path = self._DiskCachePath(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"AivisAdapter: Failed to read cached audio {path}: {e}")
+            return None
+        if zstandard is not None:
+            try:
+                data = zstandard.decompress(data)
+            except zstandard.ZstdError as e:
+                logger.warning(f"AivisAdapter: Cached audio {path} is corrupted: {e}")
+                return None
+        try:
+            os.utime(path) # 最近使ったものとして、古いものの削除の対象から外す
+        except OSError:
+            pass
+        return data
+
+    def _SaveToDisk(self, key: str, wav_data: bytes) -> None:
+        if self.cache_dir is None:
+            return
+        path = self._DiskCachePath(key)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            data = zstandard.compress(wav_data, WAV_DISK_CACHE_ZSTD_LEVEL) if zstandard is not None else wav_data
+            # 一時ファイルに書いてから置き換える (合成スレッド同士で同じ文を書いても壊れない)
+            tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"AivisAdapter: Failed to write cached audio {path}: {e}")
+
+    def _PruneDiskCache(self) -> None:
+        """ディスクキャッシュのファイルが上限を超えていれば、最後に使ったのが古いものから消す"""
+        try:
+            files = [entry for entry in os.scandir(self.cache_dir) if entry.is_file() and entry.name.endswith((".wav", ".wav.zst"))]
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.warning(f"AivisAdapter: Failed to scan audio cache {self.cache_dir}: {e}")
+            return
+        if len(files) <= WAV_DISK_CACHE_MAX_FILES:
+            return
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:len(files) - WAV_DISK_CACHE_MAX_FILES]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        logger.info(f"AivisAdapter: Pruned {len(files) - WAV_DISK_CACHE_MAX_FILES} old cached audio files.")
+
+    def _LogRequestError(self, e: Exception) -> None:
+        if isinstance(e, requests.exceptions.ConnectionError):
             logger.error(f"AivisAdapter: API ({self.URL}) に接続できません。アプリが起動していますか？")
-        except requests.exceptions.Timeout:
+        elif isinstance(e, requests.exceptions.Timeout):
             logger.error(f"AivisAdapter: API がタイムアウトしました。")
-        except requests.exceptions.RequestException as e:
+        elif isinstance(e, requests.exceptions.RequestException):
             logger.error(f"AivisAdapter: API リクエストエラー: {e}")
             if e.response is not None:
                  logger.error(f"       Status: {e.response.status_code}, Body: {e.response.text[:200]}...")
-        except Exception as e:
-            logger.exception(f"AivisAdapter: 音声生成中に予期せぬエラー") # logger.exceptionでトレースバックも記録
-        return None
+        else:
+            logger.exception(f"AivisAdapter: 音声生成中に予期せぬエラー", exc_info=e) # トレースバックも記録
+
+    def _CacheKey(self, text: str) -> str:
+        # 暗号学的な強度は不要なので、短い入力で sha256 より速い blake2b (128bit) を使う
+        return hashlib.blake2b(f"{self.speaker}\x00{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+    def close(self):
+        """保持している HTTP 接続を閉じる (終了時に呼ぶ)"""
+        self._session.close()
 
 
 # --- 音声再生関数 ---
@@ -104,46 +243,136 @@ class AivisAdapter:
 # TODO: このデバイス名を設定ファイルなどで指定できるようにする
 TARGET_OUTPUT_DEVICE_NAME = "Yamaha SYNCROOM Driver"
 
+# デバイス名 -> sounddevice のデバイスID (見つからなければ None) のキャッシュ
+# query_devices() は PortAudio のデバイスを毎回列挙するので、最初の1回だけ実行する (再生エラー時は破棄して列挙し直す)
+_DEVICE_ID_CACHE: "dict[str, int | None]" = {}
+
+def _resolve_output_device(target_device_name) -> "int | None":
+    """名前に部分一致する出力デバイスのIDを返す (指定なし・見つからない場合は None = デフォルトデバイス)"""
+    if not target_device_name:
+        logger.info("ターゲットデバイス名が指定されていないため、デフォルトデバイスを使用します。")
+        return None
+    if target_device_name in _DEVICE_ID_CACHE:
+        return _DEVICE_ID_CACHE[target_device_name]
+
+    device_id = None # sounddeviceで使用するデバイスID (整数)
+    try:
+        devices = sounddevice.query_devices()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("利用可能なオーディオデバイス:\n%s", devices) # デバッグ用に一覧表示
+        target_lower = target_device_name.lower() # ループの外で1回だけ小文字にする
+        for i, dev in enumerate(devices):
+            # 名前に部分一致し、かつ出力チャンネルがあるデバイスを探す
+            if target_lower in dev['name'].lower() and dev['max_output_channels'] > 0:
+                device_id = i
+                logger.info(f"ターゲット出力デバイス発見: '{dev['name']}' (Index: {device_id})")
+                break
+        else:
+            logger.warning(f"ターゲット出力デバイス '{target_device_name}' が見つからないか、出力デバイスではありません。デフォルトデバイスを使用します。")
+    except Exception as e:
+        logger.error(f"オーディオデバイスのクエリ中にエラー: {e}。デフォルトデバイスを使用します。")
+        return None # エラー時もデフォルトにフォールバック (キャッシュせず次回また列挙する)
+    _DEVICE_ID_CACHE[target_device_name] = device_id
+    return device_id
+
+# configure_output_device で sounddevice の既定の出力デバイスに設定したデバイス名 (未設定なら None)
+_configured_device_name = None
+
+def configure_output_device(target_device_name=TARGET_OUTPUT_DEVICE_NAME) -> "int | None":
+    """
+    出力デバイスを名前で解決し、sounddevice の既定の出力デバイスに設定する (起動時に1回呼ぶ)。
+    以降、同じデバイス名での再生は device を指定せずに既定のデバイスで行い、再生ごとの解決を省く。
+    """
+    global _configured_device_name
+    device_id = _resolve_output_device(target_device_name)
+    sounddevice.default.device[1] = device_id # (入力, 出力) の出力側だけを設定する (None ならシステムの既定)
+    _configured_device_name = target_device_name
+    logger.info(f"既定の出力デバイスを設定しました: {device_id if device_id is not None else 'システムの既定'}")
+    return device_id
+
+def _output_device(target_device_name) -> "int | None":
+    """再生時に sounddevice に渡すデバイスID (既定に設定済みのデバイスなら None で既定を使う)"""
+    if _configured_device_name is not None and target_device_name == _configured_device_name:
+        return None
+    return _resolve_output_device(target_device_name)
+
+def _forget_output_devices() -> None:
+    """デバイスが外された可能性があるので、解決済みのデバイスと既定の設定を捨てて次回は列挙し直す"""
+    global _configured_device_name
+    _DEVICE_ID_CACHE.clear()
+    if _configured_device_name is not None:
+        _configured_device_name = None
+        sounddevice.default.device[1] = None
+
+# 音声合成 (HTTP) を再生と並行して行うためのスレッドプール
+# 前の文を再生している間に次の文の WAV を生成しておき、合成の待ち時間を再生時間の裏に隠す
+_TTS_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tts-synth")
+
+def speak_async(adapter: AivisAdapter, text_to_speak: str) -> "Future[bytes | None]":
+    """WAV の生成をバックグラウンドで開始し、結果 (WAV のバイト列、失敗時は None) の Future を返す"""
+    return _TTS_EXECUTOR.submit(adapter.generate_voice_wav, text_to_speak)
+
+def speak_sequence(adapter: AivisAdapter, texts: Iterable[str], target_device_name=TARGET_OUTPUT_DEVICE_NAME):
+    """複数の文を順に読み上げる。全文の合成を先に投入し、前の文の再生中に次の文の合成を進める"""
+    futures = [speak_async(adapter, text) for text in texts]
+    for future in futures:
+        play_wav(future.result(), target_device_name)
+
 # --- 新しい speak 関数 (sounddevice版) ---
 def speak(adapter: AivisAdapter, text_to_speak: str, target_device_name=TARGET_OUTPUT_DEVICE_NAME):
     """
     AivisAdapterで音声を生成し、指定されたオーディオデバイスで再生する (sounddeviceを使用)。
     target_device_name: 再生するデバイスの名前 (部分一致で検索)。Noneの場合はデフォルト。
     """
-    wav_data = adapter.generate_voice_wav(text_to_speak)
-    if not wav_data:
-        logger.warning("AivisAdapterによる音声生成に失敗したため、再生をスキップします。")
-        return
+    device_id = _output_device(target_device_name)
+    logger.info(f"音声再生試行 (ストリーミング) デバイス: {device_id if device_id is not None else 'デフォルト'}")
 
-    device_id = None # sounddeviceで使用するデバイスID (整数)
     try:
-        if target_device_name:
-            devices = sounddevice.query_devices()
-            logger.debug(f"利用可能なオーディオデバイス:\n{devices}") # デバッグ用に一覧表示
-            found = False
-            for i, dev in enumerate(devices):
-                # 名前に部分一致し、かつ出力チャンネルがあるデバイスを探す
-                if target_device_name.lower() in dev['name'].lower() and dev['max_output_channels'] > 0:
-                    device_id = i
-                    found = True
-                    logger.info(f"ターゲット出力デバイス発見: '{dev['name']}' (Index: {device_id})")
-                    break
-            if not found:
-                logger.warning(f"ターゲット出力デバイス '{target_device_name}' が見つからないか、出力デバイスではありません。デフォルトデバイスを使用します。")
-        else:
-             logger.info("ターゲットデバイス名が指定されていないため、デフォルトデバイスを使用します。")
+        # 受信中の WAV をシークせずに先頭から読む。wave はヘッダーを読んだ時点でフレームを返せるので、
+        # 合成結果の受信完了を待たずに再生を始められる (libsndfile はシークできない入力を扱えない)
+        reader = io.BufferedReader(_ChunkReader(adapter.stream_voice_wav(text_to_speak)))
+        try:
+            wav = wave.open(reader, "rb")
+        except (EOFError, wave.Error) as e:
+            logger.warning(f"音声データを受信できなかったため、再生をスキップします: {e}")
+            return
+
+        with wav:
+            dtype = _PCM_DTYPES.get(wav.getsampwidth())
+            if dtype is None:
+                logger.error(f"未対応のサンプル幅です: {wav.getsampwidth()} bytes")
+                return
+            # PCM のバイト列をそのまま PortAudio に渡す (float32 への変換やコピーをしない)
+            with sounddevice.RawOutputStream(samplerate=wav.getframerate(), channels=wav.getnchannels(),
+                                             dtype=dtype, device=device_id) as stream:
+                logger.debug(f"デバイス {device_id if device_id is not None else 'デフォルト'} で再生開始。")
+                while True:
+                    frames = wav.readframes(PLAYBACK_BLOCK_FRAMES)
+                    if not frames:
+                        break
+                    stream.write(frames)
+            # with を抜けるとき (stop) に、書き込んだ分の再生が終わるまで待つ
+        logger.info("音声再生完了。")
 
+    except sounddevice.PortAudioError as pae:
+         logger.error(f"PortAudioエラー: {pae}")
+         _forget_output_devices()
+         logger.error("オーディオデバイスが正しく動作しているか、選択が正しいか確認してください。")
     except Exception as e:
-         logger.error(f"オーディオデバイスのクエリ中にエラー: {e}。デフォルトデバイスを使用します。")
-         device_id = None # エラー時もデフォルトにフォールバック
+        logger.exception("sounddeviceでの音声再生中に予期せぬエラーが発生しました。")
+
+def play_wav(wav_data: bytes | None, target_device_name=TARGET_OUTPUT_DEVICE_NAME):
+    """生成済みの WAV を指定されたオーディオデバイスで再生し、終わるまで待つ"""
+    if not wav_data:
+        logger.warning("AivisAdapterによる音声生成に失敗したため、再生をスキップします。")
+        return
+
+    device_id = _output_device(target_device_name)
 
     logger.info(f"音声再生試行 デバイス: {device_id if device_id is not None else 'デフォルト'}")
 
     try:
-        # BytesIOを使ってメモリ上でWAVデータを読み込み、numpy配列に変換
-        with io.BytesIO(wav_data) as audio_stream:
-            # sounddeviceはfloat32形式を推奨
-            audio_data, samplerate = soundfile.read(audio_stream, dtype='float32')
+        audio_data, samplerate = _decode_wav(wav_data)
 
         # 指定されたデバイス (device_id) またはデフォルト (None) で再生
         # play()は非同期なので、完了を待つために wait() を使う
@@ -154,6 +383,30 @@ def speak(adapter: AivisAdapter, text_to_speak: str, target_device_name=TARGET_O
 
     except sounddevice.PortAudioError as pae:
          logger.error(f"PortAudioエラー: {pae}")
+         _forget_output_devices()
          logger.error("オーディオデバイスが正しく動作しているか、選択が正しいか確認してください。")
     except Exception as e:
-        logger.exception("sounddeviceでの音声再生中に予期せぬエラーが発生しました。")
\ No newline at end of file
+        logger.exception("sounddeviceでの音声再生中に予期せぬエラーが発生しました。")
+
+
+def _decode_wav(wav_data: bytes):
+    """
+    WAV を (サンプル配列, サンプリングレート) にする。
+    PCM (AivisSpeech の出力は 16bit) ならヘッダーだけを読み、データ部分を np.frombuffer でそのまま int16 などの配列として参照する
+    (float32 への変換もコピーもしない。PortAudio は int16 をそのまま再生できる)。
+    それ以外の形式 (float の WAV など) は soundfile で float32 に変換する。
+    """
+    try:
+        with io.BytesIO(wav_data) as audio_stream:
+            with wave.open(audio_stream, "rb") as wav:
+                dtype = _PCM_NUMPY_DTYPES.get(wav.getsampwidth())
+                channels, samplerate, n_frames = wav.getnchannels(), wav.getframerate(), wav.getnframes()
+                data_offset = audio_stream.tell() # ヘッダーを読んだ直後 = data チャンクの先頭
+        if dtype is not None:
+            n_frames = min(n_frames, (len(wav_data) - data_offset) // (np.dtype(dtype).itemsize * channels))
+            pcm = np.frombuffer(wav_data, dtype=dtype, count=n_frames * channels, offset=data_offset)
+            return pcm.reshape(-1, channels), samplerate
+    except (EOFError, wave.Error) as e:
+        logger.debug("wave で読めない WAV のため soundfile で読み込みます: %s", e)
+    with io.BytesIO(wav_data) as audio_stream:
+        return soundfile.read(audio_stream, dtype='float32')
@@ -0,0 +1,70 @@
+import json
+import os
+
+import pytest
+
+from my_local_ai.agent.personality import PersonalityManager
+
+
+def _write(path, name):
+    path.write_text(json.dumps({"profile": {"name": name}}, ensure_ascii=False), encoding="utf-8")
+
+
+def test_refresh_if_changed_skips_when_unchanged(tmp_path):
+    """mtime が変わっていなければ再読み込みしない"""
+    config = tmp_path / "personality.json"
+    _write(config, "星澪")
+    manager = PersonalityManager(str(config))
+
+    assert manager.refresh_if_changed() is False
+    assert manager.GetProfile()["name"] == "星澪"
+
+
+def test_refresh_if_changed_reloads_after_update(tmp_path):
+    """ファイルが更新されたら新しい内容を読み込む"""
+    config = tmp_path / "personality.json"
+    _write(config, "星澪")
+    manager = PersonalityManager(str(config))
+
+    stat = config.stat()
+    _write(config, "Seirei")
+    # 古い mtime に戻しても (cp -p などで起こる) キャッシュ (.pkl) ではなく新しい内容を読む
+    os.utime(config, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10**9))
+
+    assert manager.refresh_if_changed() is True
+    assert manager.GetProfile()["name"] == "Seirei"
+    assert manager.refresh_if_changed() is False
+
+
+def test_cache_is_ignored_when_file_is_restored_with_older_mtime(tmp_path):
+    """キャッシュは元の JSON の mtime とサイズが完全に一致するときだけ使う"""
+    config = tmp_path / "personality.json"
+    _write(config, "A")
+    PersonalityManager(str(config)) # キャッシュ (.pkl) を作る
+    stat = config.stat()
+
+    _write(config, "OLD")
+    os.utime(config, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10**9))
+
+    assert PersonalityManager(str(config)).GetProfile()["name"] == "OLD"
+    # 作り直したキャッシュは次回そのまま使われる
+    assert PersonalityManager(str(config)).GetProfile()["name"] == "OLD"
+
+
+def test_profile_and_examples_are_read_only(tmp_path):
+    """GetProfile / GetSpeechExamples は読み取り専用のビューを返す"""
+    config = tmp_path / "personality.json"
+    config.write_text(json.dumps({"profile": {"name": "星澪"}, "speechExamples": ["こんにちは"]}, ensure_ascii=False), encoding="utf-8")
+    manager = PersonalityManager(str(config))
+
+    with pytest.raises(TypeError):
+        manager.GetProfile()["name"] = "別人"
+    assert manager.GetSpeechExamples() == ("こんにちは",)
+
+
+def test_missing_file_gives_empty_views(tmp_path):
+    """ファイルがない場合は空のビューを返す"""
+    manager = PersonalityManager(str(tmp_path / "missing.json"))
+
+    assert manager.GetProfile().get("name", "AI") == "AI"
+    assert manager.GetSpeechExamples() == ()
@@ -0,0 +1,168 @@
+# tests/agent/test_prompts.py
+import gc
+import weakref
+
+import pytest
+from dataclasses import dataclass
+
+# Modules to test
+from my_local_ai.agent import prompts
+from my_local_ai.agent.prompts import BuildPrompt, PromptBuilder, bump_identity_version
+
+# Minimal stand-ins for MemoryEntry / LogEntry (only the attributes prompts.py reads)
+@dataclass
+class FakeMemory:
+    Content: str
+
+@dataclass
+class FakeLog:
+    UserInput: str
+    AssistantResponse: str
+    Username: str = "Viewer"
+
+@pytest.fixture
+def personality():
+    return {
+        "profile": {"name": "テスト星澪", "gender": "女性的な人格"},
+        "personalityTraits": {"personalityType": "INFJ", "temperament": ["静か"], "likes": ["夜空"]},
+        "physicalAppearance": {"haircolor": "銀髪", "eyecolor": "青色"},
+        "speechExamples": ["こんばんは"],
+    }
+
+@pytest.fixture
+def identity():
+    return {
+        "Beliefs": ["信念A"],
+        "Values": ["価値観B"],
+        "Reflections": [{"Date": "2025-04-19T17:57:27", "Insight": "気づきC"}],
+    }
+
+# --- Test Cases ---
+
+def test_build_prompt_contains_sections(personality, identity):
+    """Prompt includes persona, identity, memories, logs and the user input."""
+    prompt = BuildPrompt(
+        UserInput="こんにちは", Memories=[FakeMemory("記憶D")],
+        Logs=[FakeLog("質問E", "応答F")], Personality=personality, IdentityData=identity
+    )
+
+    assert "「テスト星澪」" in prompt
+    assert "- 信念A" in prompt
+    assert "- 価値観B" in prompt
+    assert "気づきC" in prompt
+    assert "- 記憶D" in prompt
+    assert "Viewer: 質問E\nテスト星澪: 応答F" in prompt
+    assert "ユーザー: こんにちは" in prompt
+    assert prompt.endswith("テスト星澪:")
+
+def test_build_prompt_defaults_without_settings():
+    """Prompt falls back to default name and placeholders when no settings are given."""
+    prompt = BuildPrompt(UserInput="テスト", Memories=[], Logs=[])
+
+    assert "「星澪」" in prompt
+    assert "(設定情報なし)" in prompt
+    assert "(特に関連する長期記憶はありません)" in prompt
+    assert "(関連する会話履歴はありません)" in prompt
+
+def test_static_sections_are_cached(personality, identity, monkeypatch):
+    """Repeated calls with the same settings reuse the cached static block."""
+    calls = []
+    real_format_persona = prompts.format_persona
+    monkeypatch.setattr(prompts, "format_persona", lambda p: calls.append(p) or real_format_persona(p))
+
+    first = BuildPrompt("一回目", [], [], personality, identity)
+    formatted = len(calls)
+    second = BuildPrompt("二回目", [], [], personality, identity)
+
+    # The persona is not formatted again, and only the user input differs between the two prompts
+    assert len(calls) == formatted
+    assert first.replace("一回目", "二回目") == second
+
+def test_bump_identity_version_invalidates_cache(personality, identity):
+    """Mutating identity in place is reflected after bump_identity_version()."""
+    BuildPrompt("テスト", [], [], personality, identity)
+    identity["Beliefs"].append("新しい信念G")
+
+    stale = BuildPrompt("テスト", [], [], personality, identity)
+    assert "新しい信念G" not in stale # Still cached
+
+    bump_identity_version()
+    fresh = BuildPrompt("テスト", [], [], personality, identity)
+    assert "- 新しい信念G" in fresh
+
+def test_bump_identity_version_notifies_listeners(monkeypatch):
+    """Registered listeners (e.g. the response cache) are called on every identity bump."""
+    monkeypatch.setattr(prompts, "_identity_listeners", [])
+    calls = []
+    prompts.add_identity_listener(lambda: calls.append("cleared"))
+
+    bump_identity_version()
+
+    assert calls == ["cleared"]
+
+def test_identity_listeners_do_not_keep_their_owner_alive(monkeypatch):
+    """Bound-method listeners are held weakly and dropped once their object is gone."""
+    monkeypatch.setattr(prompts, "_identity_listeners", [])
+
+    class Cache:
+        cleared = 0
+        def Clear(self):
+            Cache.cleared += 1
+
+    cache = Cache()
+    owner = weakref.ref(cache)
+    prompts.add_identity_listener(cache.Clear)
+    bump_identity_version()
+    assert Cache.cleared == 1
+
+    del cache
+    gc.collect()
+    assert owner() is None
+    bump_identity_version()
+    assert Cache.cleared == 1
+
+def test_build_prompt_keeps_braces_in_user_input(personality, identity):
+    """Braces in user-provided text are inserted verbatim by the template."""
+    prompt = BuildPrompt("{ai_name} {0}", [FakeMemory("{memo}")], [], personality, identity)
+
+    assert "ユーザー: {ai_name} {0}" in prompt
+    assert "- {memo}" in prompt
+
+def test_prompt_builder_matches_build_prompt(personality, identity):
+    """PromptBuilder.Build produces the same prompt as the BuildPrompt wrapper."""
+    builder = PromptBuilder(personality, identity)
+    memories = [FakeMemory("記憶D")]
+    logs = [FakeLog("質問E", "応答F")]
+
+    assert builder.Build("こんにちは", memories, logs) == BuildPrompt("こんにちは", memories, logs, personality, identity)
+    assert builder.ai_name == "テスト星澪"
+
+def test_prompt_builder_refreshes_after_identity_bump(personality, identity):
+    """A long-lived PromptBuilder picks up identity changes after bump_identity_version()."""
+    builder = PromptBuilder(personality, identity)
+    identity["Values"].append("新しい価値観H")
+
+    bump_identity_version()
+    assert "- 新しい価値観H" in builder.Build("テスト", [], [])
+
+
+def test_explicit_ai_name_is_used(personality, identity):
+    """An explicit ai_name is used instead of the name in Personality."""
+    prompt = BuildPrompt("こんにちは", [], [], personality, identity, ai_name="別名")
+
+    assert "あなたはAIアシスタントの「別名」です。" in prompt
+    assert prompt.endswith("別名:")
+    # Without ai_name the name still comes from Personality
+    assert "「テスト星澪」" in BuildPrompt("こんにちは", [], [], personality, identity)
+
+
+def test_persona_formatting_survives_identity_bump(personality, identity, monkeypatch):
+    """Only the identity part is re-formatted after bump_identity_version()."""
+    BuildPrompt("一回目", [], [], personality, identity)
+    calls = []
+    monkeypatch.setattr(prompts, "format_persona", lambda p: calls.append(p) or "")
+
+    bump_identity_version()
+    BuildPrompt("二回目", [], [], personality, identity)
+
+    assert calls == []
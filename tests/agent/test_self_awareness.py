@@ -0,0 +1,133 @@
+import json
+import time
+
+import pytest
+
+from my_local_ai.agent.self_awareness import (
+    MAX_DIFF_LOGS_FOR_PROMPT, ReflectionLog, _bullet_list, _collect_json_object, _decode_reflection,
+    _fit_dialogue_to_budget, _format_bullet_list, _scan_new_logs, parse_timestamp, tail_jsonl,
+)
+
+
+def test_tail_jsonl_returns_last_entries(tmp_path):
+    """Only the last n non-empty lines are parsed, in file order."""
+    path = tmp_path / "logs.jsonl"
+    lines = [json.dumps({"UserInput": f"u{i}"}) for i in range(50)]
+    path.write_text("\n".join(lines) + "\n\n", encoding="utf-8")
+
+    logs = tail_jsonl(path, 3, block_size=16)
+
+    assert [log["UserInput"] for log in logs] == ["u47", "u48", "u49"]
+
+
+def test_tail_jsonl_skips_broken_lines_and_short_files(tmp_path):
+    """Broken lines are skipped and short files return what they have."""
+    path = tmp_path / "logs.jsonl"
+    path.write_text('{"UserInput": "a"}\nnot json\n{"UserInput": "b"}', encoding="utf-8")
+
+    logs = tail_jsonl(path, 10)
+
+    assert [log["UserInput"] for log in logs] == ["a", "b"]
+
+
+def test_dialogue_budget_keeps_latest_logs_in_order():
+    """The token budget drops the oldest logs first and keeps chronological order."""
+    logs = [ReflectionLog(UserInput=f"u{i}" + "あ" * 400, AssistantResponse="い" * 400) for i in range(10)]
+
+    entries = _fit_dialogue_to_budget(logs, 1000)
+
+    assert 0 < len(entries) < len(logs)
+    assert entries[-1].startswith("User: u9")
+    assert [e[6:8] for e in entries] == [f"u{i}" for i in range(10 - len(entries), 10)]
+
+
+def test_dialogue_budget_always_keeps_one_log():
+    """Even a single over-budget log is kept so the prompt is never empty."""
+    entries = _fit_dialogue_to_budget([ReflectionLog(UserInput="長い" * 1000)], 1)
+
+    assert len(entries) == 1
+
+
+def test_collect_json_object_stops_at_closing_brace():
+    """Reading stops once the first object closes; braces inside strings are ignored."""
+    text = '```json\n{"Insight": "a } { \\" b", "RelatedBeliefs": [0]}\n```'
+    chunks = [text[i:i + 4] for i in range(0, len(text), 4)]
+    chunks.append("never read")
+    consumed = []
+
+    def stream():
+        for chunk in chunks:
+            consumed.append(chunk)
+            yield chunk
+
+    result = _collect_json_object(stream())
+
+    assert json.loads(result) == {"Insight": 'a } { " b', "RelatedBeliefs": [0]}
+    assert "never read" not in consumed
+
+
+def test_decode_reflection_validates_schema():
+    """Valid reflections decode to a dict; wrong types or missing keys raise ValueError."""
+    valid = '{"Context": "c", "Insight": "i", "RelatedBeliefs": [0], "RelatedValues": []}'
+    assert _decode_reflection(valid)["RelatedBeliefs"] == [0]
+
+    for broken in (
+        '{"Context": "c", "Insight": "i", "RelatedBeliefs": ["0"], "RelatedValues": []}',
+        '{"Context": "c"}',
+        "not json",
+    ):
+        with pytest.raises(ValueError):
+            _decode_reflection(broken)
+
+
+def test_bullet_list_formatting_is_cached():
+    """Beliefs/Values are formatted once per distinct list; unhashable items still format."""
+    _format_bullet_list.cache_clear()
+
+    assert _bullet_list(["信念A", "信念B"]) == "- 信念A\n- 信念B"
+    assert _bullet_list(["信念A", "信念B"]) == "- 信念A\n- 信念B"
+    assert _format_bullet_list.cache_info().hits == 1
+    assert _bullet_list(None) == "(まだありません)"
+    assert _bullet_list([{"text": "x"}]) == "- {'text': 'x'}"
+
+
+@pytest.fixture
+def tokyo_timezone(monkeypatch):
+    """Run the test with the local time zone set to JST (UTC+9)."""
+    if not hasattr(time, "tzset"):
+        pytest.skip("time.tzset is not available on this platform")
+    monkeypatch.setenv("TZ", "Asia/Tokyo")
+    time.tzset()
+    parse_timestamp.cache_clear()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+    parse_timestamp.cache_clear()
+
+
+def test_naive_log_timestamps_are_local_time(tmp_path, tokyo_timezone):
+    """Naive log timestamps (local time) compare correctly against an aware UTC reflection date."""
+    last_reflection = parse_timestamp("2025-01-01T03:00:00+00:00") # 12:00 JST
+    assert parse_timestamp("2025-01-01 11:00:00") < last_reflection
+    assert parse_timestamp("2025-01-01T13:00:00") > last_reflection
+
+    log_path = tmp_path / "logs.jsonl"
+    log_path.write_text(
+        json.dumps({"Timestamp": "2025-01-01 11:00:00", "UserInput": "before"}) + "\n"
+        + json.dumps({"Timestamp": "2025-01-01 13:00:00", "UserInput": "after"}) + "\n",
+        encoding="utf-8",
+    )
+    new_logs, _ = _scan_new_logs(log_path, {}, last_reflection)
+    assert [log.UserInput for log in new_logs] == ["after"]
+
+
+def test_first_scan_reads_only_the_tail(tmp_path):
+    """Without a cursor or a previous reflection, only the last logs are read and the cursor skips a partial line."""
+    log_path = tmp_path / "logs.jsonl"
+    complete = "".join(json.dumps({"Timestamp": "2025-01-01 12:00:00", "UserInput": f"q{i}"}) + "\n" for i in range(30))
+    log_path.write_text(complete + '{"UserInput": "half-writ', encoding="utf-8")
+
+    new_logs, cursor = _scan_new_logs(log_path, {}, None)
+
+    assert [log.UserInput for log in new_logs] == [f"q{i}" for i in range(30 - MAX_DIFF_LOGS_FOR_PROMPT, 30)]
+    assert cursor["offset"] == len(complete.encode("utf-8"))
@@ -0,0 +1,64 @@
+# tests/llm/test_semantic_cache.py
+from my_local_ai.llm.semantic_cache import SemanticCache
+
+
+def test_lookup_returns_response_for_similar_embedding():
+    """A near-identical embedding hits; a different one misses."""
+    cache = SemanticCache(threshold=0.95)
+    cache.Store([1.0, 0.0, 0.0], "こんにちは！")
+
+    assert cache.Lookup([0.99, 0.05, 0.0]) == "こんにちは！"
+    assert cache.Lookup([0.0, 1.0, 0.0]) is None
+    assert cache.Lookup([1.0, 0.0]) is None # Dimension mismatch never hits
+
+
+def test_least_recently_used_entry_is_evicted():
+    """When full, the entry used longest ago is replaced."""
+    cache = SemanticCache(threshold=0.95, max_entries=2)
+    cache.Store([1.0, 0.0, 0.0], "a")
+    cache.Store([0.0, 1.0, 0.0], "b")
+    assert cache.Lookup([1.0, 0.0, 0.0]) == "a" # "b" is now the oldest
+
+    cache.Store([0.0, 0.0, 1.0], "c")
+
+    assert len(cache) == 2
+    assert cache.Lookup([0.0, 1.0, 0.0]) is None
+    assert cache.Lookup([1.0, 0.0, 0.0]) == "a"
+    assert cache.Lookup([0.0, 0.0, 1.0]) == "c"
+
+
+def test_save_and_load_round_trip(tmp_path):
+    """Entries survive a Save/load cycle through the .npy/.json pair."""
+    path = tmp_path / "response_cache"
+    cache = SemanticCache(path=path)
+    cache.Store([0.6, 0.8], "応答")
+    cache.Save()
+
+    reloaded = SemanticCache(path=path)
+
+    assert len(reloaded) == 1
+    assert reloaded.Lookup([0.6, 0.8]) == "応答"
+    assert (tmp_path / "response_cache.npy").exists() and (tmp_path / "response_cache.json").exists()
+
+
+def test_clear_drops_all_entries():
+    cache = SemanticCache()
+    cache.Store([1.0, 0.0], "a")
+    cache.Clear()
+
+    assert len(cache) == 0
+    assert cache.Lookup([1.0, 0.0]) is None
+
+
+def test_saved_entries_are_dropped_when_fingerprint_changes(tmp_path):
+    """A cache saved under other settings (or without a fingerprint) loads empty."""
+    path = tmp_path / "response_cache"
+    cache = SemanticCache(path=path, fingerprint="persona-1|2025-04-18")
+    cache.Store([0.6, 0.8], "応答")
+    cache.Save()
+
+    assert len(SemanticCache(path=path, fingerprint="persona-1|2025-04-18")) == 1
+    assert len(SemanticCache(path=path, fingerprint="persona-1|2025-04-19")) == 0
+
+    (tmp_path / "response_cache.json").write_text('["応答"]', encoding="utf-8") # Legacy list format
+    assert len(SemanticCache(path=path, fingerprint="persona-1|2025-04-18")) == 0
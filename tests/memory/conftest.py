@@ -0,0 +1,12 @@
+# tests/memory/conftest.py
+import pytest
+
+from my_local_ai.memory.embedder import Embedder
+
+
+@pytest.fixture(scope="session")
+def shared_embedder():
+    """One warmed-up Embedder for the whole test run, so the model is loaded only once, before any test."""
+    embedder = Embedder()
+    embedder.Warmup()
+    return embedder
@@ -0,0 +1,95 @@
+# tests/memory/test_embedder.py
+import threading
+import time
+
+import numpy as np
+
+from my_local_ai.memory.embedder import Embedder
+
+
+class FakeModel:
+    """encode の呼び出しごとの件数を記録し、テキスト長を Embedding として返す"""
+    def __init__(self):
+        self.batch_sizes = []
+
+    def encode(self, texts, **kwargs):
+        self.batch_sizes.append(len(texts))
+        time.sleep(0.01)
+        return np.array([[float(len(t)), 1.0] for t in texts])
+
+
+def test_concurrent_single_embeds_are_coalesced():
+    """Single-text Embed calls from several threads share encode calls and get their own results."""
+    embedder = Embedder()
+    embedder.model = FakeModel()
+    results = {}
+
+    def worker(n):
+        results[n] = embedder.Embed("x" * n)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(1, 11)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert all(results[n][0].tolist() == [float(n), 1.0] for n in range(1, 11))
+    assert sum(embedder.model.batch_sizes) == 10
+    assert len(embedder.model.batch_sizes) < 10
+
+
+def test_list_input_is_encoded_directly():
+    """List input keeps its own single encode call and order."""
+    embedder = Embedder()
+    embedder.model = FakeModel()
+
+    assert [e.tolist() for e in embedder.Embed(["a", "bbb"])] == [[1.0, 1.0], [3.0, 1.0]]
+    assert embedder.model.batch_sizes == [2]
+
+
+def test_list_input_is_deduplicated_and_length_sorted():
+    """Duplicates are encoded once, shortest first, and results come back in input order."""
+    embedder = Embedder()
+    calls = []
+
+    class RecordingModel(FakeModel):
+        def encode(self, texts, **kwargs):
+            calls.append(list(texts))
+            return super().encode(texts, **kwargs)
+
+    embedder.model = RecordingModel()
+
+    result = embedder.Embed(["ccc", "a", "ccc", "bb"])
+
+    assert calls == [["a", "bb", "ccc"]]
+    assert [e.tolist() for e in result] == [[3.0, 1.0], [1.0, 1.0], [3.0, 1.0], [2.0, 1.0]]
+
+
+def test_embeddings_are_float32_arrays():
+    """Embed returns 1-D float32 ndarrays (no conversion to Python float lists)."""
+    embedder = Embedder()
+    embedder.model = FakeModel()
+
+    result = embedder.Embed(["a", "bb"])
+
+    assert all(isinstance(e, np.ndarray) and e.dtype == np.float32 and e.ndim == 1 for e in result)
+
+
+def test_warmup_loads_model_once_in_background():
+    """Warmup(background=True) loads the model on a thread, and concurrent Embed calls do not load it twice."""
+    embedder = Embedder()
+    loads = []
+
+    def fake_load():
+        loads.append(1)
+        time.sleep(0.02)
+        embedder.model = FakeModel()
+
+    embedder._load_model = fake_load
+    thread = embedder.Warmup(background=True)
+    result = embedder.Embed(["abc"]) # Waits for the background load instead of starting another
+    thread.join()
+
+    assert loads == [1]
+    assert result[0].tolist() == [3.0, 1.0]
+    assert embedder.model.batch_sizes[0] == 1 # The warmup encode
@@ -0,0 +1,79 @@
+# tests/memory/test_embedding_store.py
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from my_local_ai.memory.embedding_store import (
+    SidecarReader, append_embeddings, decode_inline, encode_inline, load_embeddings, remove_stale_sidecars,
+    save_embeddings, sidecar_path_for,
+)
+
+
+def test_sidecar_path_replaces_suffix():
+    assert sidecar_path_for(Path("data/stream_logs.json")) == Path("data/stream_logs.f16.npy")
+    assert sidecar_path_for(Path("data/stream_logs.json"), 3) == Path("data/stream_logs.g3.f16.npy")
+
+
+def test_reader_follows_the_generation_of_each_record(tmp_path):
+    """Rows are looked up in the sidecar generation the JSON record points to."""
+    data_path = tmp_path / "logs.json"
+    save_embeddings(sidecar_path_for(data_path), [[1.0, 0.0]])
+    save_embeddings(sidecar_path_for(data_path, 1), [[0.0, 1.0]])
+
+    reader = SidecarReader(data_path)
+    assert reader.Get({"EmbeddingRow": 0}).tolist() == [1.0, 0.0]
+    assert reader.Get({"EmbeddingRow": 0, "EmbeddingGen": 1}).tolist() == [0.0, 1.0]
+    assert reader.Get({"EmbeddingRow": 1, "EmbeddingGen": 1}) is None
+    assert reader.Get({"EmbeddingRow": 0, "EmbeddingGen": 2}) is None # generation left behind by an interrupted rewrite
+    assert reader.LatestGeneration == 2
+
+
+def test_remove_stale_sidecars_keeps_current_generation(tmp_path):
+    data_path = tmp_path / "logs.json"
+    for generation in (0, 1, 2):
+        save_embeddings(sidecar_path_for(data_path, generation), [[1.0]])
+    save_embeddings(tmp_path / "logs.backup.f16.npy", [[1.0]]) # sidecar of a different data file
+
+    remove_stale_sidecars(data_path, 2)
+    assert sorted(path.name for path in tmp_path.glob("*.npy")) == ["logs.backup.f16.npy", "logs.g2.f16.npy"]
+
+
+def test_append_grows_sidecar_in_place(tmp_path):
+    """Appends return the first new row and keep earlier rows intact."""
+    path = tmp_path / "logs.f16.npy"
+
+    assert append_embeddings(path, [[1.0, 2.0, 3.0]]) == 0
+    assert append_embeddings(path, [[4.0, 5.0, 6.0], [7.0, 8.0, 9.0]]) == 1
+
+    matrix = load_embeddings(path)
+    assert matrix.dtype == np.float16
+    assert matrix.tolist() == [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0], [7.0, 8.0, 9.0]]
+
+
+def test_append_rejects_mismatched_dimensions(tmp_path):
+    path = tmp_path / "logs.f16.npy"
+    save_embeddings(path, [[1.0, 2.0]])
+
+    with pytest.raises(ValueError):
+        append_embeddings(path, [[1.0, 2.0, 3.0]])
+    assert load_embeddings(path).shape == (1, 2)
+
+
+def test_load_missing_or_broken_sidecar(tmp_path):
+    assert load_embeddings(tmp_path / "missing.f16.npy") is None
+    broken = tmp_path / "broken.f16.npy"
+    broken.write_bytes(b"not an npy file")
+    assert load_embeddings(broken) is None
+
+
+def test_inline_roundtrip_is_float16_base64():
+    """Embeddings that cannot go to the sidecar are written as base64 float16 bytes."""
+    encoded = encode_inline([0.5, -1.0, 2.0])
+    assert isinstance(encoded, str)
+
+    decoded = decode_inline(encoded)
+    assert decoded.dtype == np.float32
+    assert decoded.tolist() == [0.5, -1.0, 2.0]
+    assert decode_inline(None) is None
+    assert decode_inline("not base64!") is None
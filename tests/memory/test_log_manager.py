@@ -6,32 +6,33 @@ from datetime import datetime
 from pathlib import Path
 import time # For debug prints
 
+import numpy as np
+
 # Modules to test
 from my_local_ai.memory.log_manager import LogManager, LogEntry
-# Dependencies needed
-from my_local_ai.memory.embedder import Embedder
+# The shared Embedder comes from the session fixture in conftest.py
 
 # Use pytest's tmp_path fixture for cleaner temporary file handling
 @pytest.fixture
-def log_manager_fixture(tmp_path):
+def log_manager_fixture(tmp_path, shared_embedder):
     """Fixture to create a LogManager instance with a temporary log file."""
     test_log_file = tmp_path / "test_logs.jsonl" # Use .jsonl extension
     print(f"\n[{time.time():.3f}] Fixture setup: Creating LogManager instance using {test_log_file}")
-    embedder = Embedder() # Create embedder instance
-    log_manager = LogManager(log_path=str(test_log_file), embedder=embedder)
+    log_manager = LogManager(log_path=str(test_log_file), embedder=shared_embedder)
     # Yield both manager and path for potential direct file inspection in tests
     yield log_manager, test_log_file
-    print(f"\n[{time.time():.3f}] Fixture teardown: LogManager instance goes out of scope, tmp_path cleans up file.")
+    log_manager.close() # Release the append handle before tmp_path cleanup
+    print(f"\n[{time.time():.3f}] Fixture teardown: LogManager closed, tmp_path cleans up file.")
     # tmp_path automatically handles cleanup
 
 # --- Test Cases ---
 
-def test_log_manager_init_empty(tmp_path):
+def test_log_manager_init_empty(tmp_path, shared_embedder):
     """Test LogManager initializes empty if file doesn't exist."""
     non_existent_file = tmp_path / "non_existent.jsonl"
-    embedder = Embedder()
-    lm = LogManager(log_path=str(non_existent_file), embedder=embedder)
-    assert lm.GetAllLogs() == []
+    lm = LogManager(log_path=str(non_existent_file), embedder=shared_embedder)
+    assert lm.GetAllLogs() == ()
+    assert lm.CountLogs() == 0
 
 def test_save_log_single(log_manager_fixture):
     """Test saving a single log entry."""
@@ -60,7 +61,7 @@ def test_save_log_single(log_manager_fixture):
         timestamp_valid = False
     assert timestamp_valid
     # Check embedding
-    assert isinstance(saved_log.Embedding, list)
+    assert isinstance(saved_log.Embedding, np.ndarray)
     assert len(saved_log.Embedding) > 0
 
     # Assert File Content
@@ -72,8 +73,10 @@ def test_save_log_single(log_manager_fixture):
     assert log_data["UserInput"] == user_input
     assert log_data["AssistantResponse"] == assistant_response
     assert log_data["Username"] == username
-    assert "Embedding" in log_data
-    assert isinstance(log_data["Embedding"], list)
+    # The embedding goes to the float16 sidecar; the JSON line only keeps its row number
+    assert "Embedding" not in log_data
+    assert log_data["EmbeddingRow"] == 0
+    assert (test_log_file.parent / "test_logs.f16.npy").exists()
 
 def test_save_log_multiple(log_manager_fixture):
     """Test saving multiple log entries."""
@@ -92,6 +95,9 @@ def test_save_log_multiple(log_manager_fixture):
     assert logs[0].UserInput == inputs[0]
     assert logs[1].UserInput == inputs[1]
     assert logs[2].UserInput == inputs[2]
+    assert isinstance(logs, tuple) # Read-only view of the internal list
+    assert log_manager.CountLogs() == 3
+    assert [log.UserInput for log in log_manager.GetLogsSlice(-2)] == inputs[1:]
 
     # Assert File Content
     assert test_log_file.exists()
@@ -103,7 +109,24 @@ def test_save_log_multiple(log_manager_fixture):
     assert log_data["UserInput"] == inputs[2]
 
 
-def test_load_logs_cycle(log_manager_fixture):
+def test_save_log_reuses_append_handle(tmp_path, shared_embedder):
+    """SaveLog keeps one append handle open, flushes every entry, and reopens after close()."""
+    test_log_file = tmp_path / "handle_logs.jsonl"
+    with LogManager(log_path=str(test_log_file), embedder=shared_embedder) as log_manager:
+        log_manager.SaveLog("First", "Resp1")
+        handle = log_manager._fp
+        log_manager.SaveLog("Second", "Resp2")
+        assert log_manager._fp is handle
+        assert len(test_log_file.read_text(encoding="utf-8").splitlines()) == 2 # Flushed without closing
+
+        log_manager.close()
+        assert log_manager._fp is None
+        log_manager.SaveLog("Third", "Resp3")
+    assert log_manager._fp is None # Closed by the context manager
+    assert len(test_log_file.read_text(encoding="utf-8").splitlines()) == 3
+
+
+def test_load_logs_cycle(log_manager_fixture, shared_embedder):
     """Test saving logs and reloading them in a new instance."""
     log_manager_saver, test_log_file = log_manager_fixture
     inputs = ["Apple", "Banana"]
@@ -115,8 +138,7 @@ def test_load_logs_cycle(log_manager_fixture):
     log_manager_saver.SaveLog(inputs[1], outputs[1], usernames[1])
 
     # Act (Load in new instance)
-    embedder = Embedder() # Need a new embedder for the loader
-    log_manager_loader = LogManager(log_path=str(test_log_file), embedder=embedder)
+    log_manager_loader = LogManager(log_path=str(test_log_file), embedder=shared_embedder)
     loaded_logs = log_manager_loader.GetAllLogs()
 
     # Assert
@@ -124,19 +146,19 @@ def test_load_logs_cycle(log_manager_fixture):
     assert loaded_logs[0].UserInput == inputs[0]
     assert loaded_logs[0].AssistantResponse == outputs[0]
     assert loaded_logs[0].Username == usernames[0]
-    assert isinstance(loaded_logs[0].Embedding, list) # Check embedding loaded/created
+    assert isinstance(loaded_logs[0].Embedding, np.ndarray) # Check embedding loaded/created
     assert len(loaded_logs[0].Embedding) > 0
     assert loaded_logs[1].UserInput == inputs[1]
     assert loaded_logs[1].AssistantResponse == outputs[1]
     assert loaded_logs[1].Username == usernames[1]
-    assert isinstance(loaded_logs[1].Embedding, list)
+    assert isinstance(loaded_logs[1].Embedding, np.ndarray)
     assert len(loaded_logs[1].Embedding) > 0
 
 
-def test_load_recalculates_missing_embedding(tmp_path):
-    """Test that LoadLogs recalculates missing embeddings."""
+def test_load_recalculates_missing_embedding(tmp_path, shared_embedder):
+    """Test that missing embeddings are calculated on the first search and written back."""
     # Arrange
-    embedder = Embedder()
+    embedder = shared_embedder
     test_log_file = tmp_path / "test_missing_embedding.jsonl"
     log_data_no_embedding = [
         {"Timestamp": "2025-04-18 10:00:00", "UserInput": "Input without embedding", "AssistantResponse": "Resp1", "Username": "UserX", "Embedding": None},
@@ -149,17 +171,60 @@ def test_load_recalculates_missing_embedding(tmp_path):
     # Act
     log_manager = LogManager(log_path=str(test_log_file), embedder=embedder)
     loaded_logs = log_manager.GetAllLogs()
+    # Loading alone does not embed anything; the first search does
+    assert all(log.Embedding is None for log in loaded_logs)
+    log_manager.SearchRelevantLogs("Input", topK=2)
 
     # Assert
     assert len(loaded_logs) == 2
     assert loaded_logs[0].UserInput == "Input without embedding"
-    assert isinstance(loaded_logs[0].Embedding, list)
+    assert isinstance(loaded_logs[0].Embedding, np.ndarray)
     assert len(loaded_logs[0].Embedding) > 0 # Should be recalculated
 
     assert loaded_logs[1].UserInput == "Input missing embedding key"
-    assert isinstance(loaded_logs[1].Embedding, list)
+    assert isinstance(loaded_logs[1].Embedding, np.ndarray)
     assert len(loaded_logs[1].Embedding) > 0 # Should be recalculated
 
+    # The calculated embeddings are persisted to the sidecar
+    with open(test_log_file, "r", encoding="utf-8") as f:
+        rows = [json.loads(line)["EmbeddingRow"] for line in f]
+    assert rows == [0, 1]
+    reloaded = LogManager(log_path=str(test_log_file), embedder=embedder)
+    assert all(isinstance(log.Embedding, np.ndarray) for log in reloaded.GetAllLogs())
+
+
+def test_interrupted_rewrite_keeps_rows_matched(log_manager_fixture, shared_embedder, monkeypatch):
+    """A crash between writing the new sidecar and replacing the log file must not renumber the old rows."""
+    log_manager, test_log_file = log_manager_fixture
+    log_manager.SaveLog("first input", "r1")
+    log_manager.SaveLog("second input", "r2")
+    expected = [np.array(log.Embedding, dtype=np.float32) for log in log_manager.GetAllLogs()]
+
+    # Renumber the rows (the first log loses its embedding) and fail right before the log file is replaced
+    log_manager.Logs[0].Embedding = None
+    real_replace = os.replace
+    def failing_replace(src, dst):
+        if Path(dst) == test_log_file:
+            raise OSError("simulated crash")
+        real_replace(src, dst)
+    monkeypatch.setattr(os, "replace", failing_replace)
+    log_manager._RewriteLogFile()
+    monkeypatch.undo()
+    log_manager.close()
+
+    reloaded = LogManager(log_path=str(test_log_file), embedder=shared_embedder)
+    for log, embedding in zip(reloaded.GetAllLogs(), expected):
+        np.testing.assert_allclose(log.Embedding, embedding, atol=1e-2)
+
+    # A completed rewrite switches to the new generation and removes the old sidecar
+    reloaded._RewriteLogFile()
+    reloaded.close()
+    assert sorted(path.name for path in test_log_file.parent.glob("*.npy")) == ["test_logs.g1.f16.npy"]
+    again = LogManager(log_path=str(test_log_file), embedder=shared_embedder)
+    for log, embedding in zip(again.GetAllLogs(), expected):
+        np.testing.assert_allclose(log.Embedding, embedding, atol=1e-2)
+    again.close()
+
 
 def test_search_relevant_logs(log_manager_fixture):
     """Test searching for relevant logs."""
@@ -173,10 +238,6 @@ def test_search_relevant_logs(log_manager_fixture):
     # time.sleep(0.1)
 
     # Act: Search for something related to apples
-    # Ensure embedder model is loaded before search if lazy loading
-    if log_manager.Embedder.model is None:
-         log_manager.Embedder.Embed("preload query") # Trigger load
-
     query = "What kind of fruit?"
     relevant_logs = log_manager.SearchRelevantLogs(query, topK=2)
 
@@ -194,9 +255,6 @@ def test_search_relevant_logs_no_match(log_manager_fixture):
     # Arrange: Save unrelated logs
     log_manager.SaveLog("The weather today is sunny.", "A great day!", "WeatherWatcher")
     log_manager.SaveLog("How to learn Python?", "Try the official tutorial.", "DevHelper")
-    # Ensure embedder model is loaded
-    if log_manager.Embedder.model is None:
-         log_manager.Embedder.Embed("preload query")
 
     # Act: Search for something completely different
     query = "Tell me about quantum physics"
@@ -216,9 +274,6 @@ def test_search_relevant_logs_empty_log(log_manager_fixture):
     """Test searching when log manager has no logs."""
     log_manager, _ = log_manager_fixture
     # Arrange: No logs saved
-    # Ensure embedder model is loaded
-    if log_manager.Embedder.model is None:
-         log_manager.Embedder.Embed("preload query")
 
     # Act
     query = "Anything?"
@@ -1,29 +1,32 @@
 # tests/memory/test_memory_manager.py
 import pytest
 import os
+import glob
 import json
 from pathlib import Path
+
+import numpy as np
 # テスト対象のクラスをインポート (絶対パスで)
 from my_local_ai.memory.memory_manager import MemoryManager
-# Embedderも必要になるかもしれないのでインポート
-from my_local_ai.memory.embedder import Embedder
+# Embedder は conftest.py の shared_embedder フィクスチャから受け取る
 
 # テストで使用する一時的なファイルパスを定義
 # pytestのフィクスチャを使うとより綺麗に書けますが、まずはシンプルに
 TEST_MEMORY_FILE = "test_memories.json"
+TEST_EMBEDDING_GLOB = "test_memories*.f16.npy" # SaveToFile が書く Embedding のサイドカー (書き直すと世代番号が付く)
 
 @pytest.fixture # テスト実行前に呼ばれ、後処理も行う pytest の機能
-def memory_manager_instance():
+def memory_manager_instance(shared_embedder):
     """テスト用のMemoryManagerインスタンスを作成し、テスト後にファイルを削除する"""
-    # Embedderのインスタンスも作成 (テストによってはモック化することもあります)
-    embedder = Embedder()
+    # Embedder はセッション全体で共有する (conftest.py の shared_embedder。モデルの読み込みは1回だけ)
     # テスト用のファイルパスを指定して MemoryManager を初期化
-    mm = MemoryManager(memory_path=TEST_MEMORY_FILE, embedder=embedder)
+    mm = MemoryManager(memory_path=TEST_MEMORY_FILE, embedder=shared_embedder)
     # テスト関数にインスタンスを渡す
     yield mm
     # テスト関数の実行後にここが呼ばれる (後処理)
-    if os.path.exists(TEST_MEMORY_FILE):
-        os.remove(TEST_MEMORY_FILE) # テスト用に作成したファイルを削除
+    for path in [TEST_MEMORY_FILE, *glob.glob(TEST_EMBEDDING_GLOB)]:
+        if os.path.exists(path):
+            os.remove(path) # テスト用に作成したファイル (各世代の Embedding のサイドカーも) を削除
 
 def test_save_and_get_memory(memory_manager_instance):
     """記憶を保存し、取得できるかテスト"""
@@ -38,8 +41,9 @@ def test_save_and_get_memory(memory_manager_instance):
     assert len(all_memories) == 1 # 記憶が1件になっているはず
     assert all_memories[0].Content == test_content # 保存した内容と一致するはず
     assert all_memories[0].Id == 0 # 最初のIDは0のはず
-    assert isinstance(all_memories[0].Embedding, list) # Embeddingがリスト形式であるはず
+    assert isinstance(all_memories[0].Embedding, np.ndarray) # Embeddingが ndarray であるはず
     assert len(all_memories[0].Embedding) > 0 # Embeddingが空でないはず
+    assert isinstance(all_memories, tuple) # 内部のリストではなく読み取り専用のタプル
 
 def test_save_multiple_memories(memory_manager_instance):
     """複数の記憶を保存し、IDが正しく付与されるかテスト"""
@@ -77,7 +81,7 @@ def test_edit_memory_successful(memory_manager_instance):
     assert len(edited_memories) == 1 # 記憶の総数は変わらないはず
     assert edited_memories[0].Id == 0 # IDも変わらないはず
     assert edited_memories[0].Content == new_content # 内容が新しいものに更新されているはず
-    assert isinstance(edited_memories[0].Embedding, list) # Embeddingはリスト型のはず
+    assert isinstance(edited_memories[0].Embedding, np.ndarray) # Embeddingは ndarray のはず
     # Embeddingが再計算されていることを確認 (単純比較は難しいが、少なくとも違うオブジェクトにはなるはず)
     assert edited_memories[0].Embedding is not original_embedding
     # assert edited_memories[0].Embedding != original_embedding # 値自体が違うことも確認したい場合
@@ -119,7 +123,7 @@ def test_delete_memory_invalid_index(memory_manager_instance):
     mm = memory_manager_instance
     original_content = "唯一の記憶"
     mm.SaveMemory(original_content)
-    memories_before_delete = mm.GetAllMemories().copy()
+    memories_before_delete = mm.GetAllMemories() # タプルなので削除後も変わらない
 
     # Act
     mm.DeleteMemoryByIndex(1) # 存在しないインデックス
@@ -145,17 +149,17 @@ def test_delete_only_memory(memory_manager_instance):
 
 # --- Tests for SaveToFile and LoadFromFile ---
 
-def test_save_and_load_cycle(memory_manager_instance):
+def test_save_and_load_cycle(memory_manager_instance, shared_embedder):
     """ファイルに保存し、別のインスタンスで正しく読み込めるかテスト"""
     # Arrange
     mm_saver = memory_manager_instance # 保存用インスタンス (fixtureが提供)
     content1 = "記憶内容１"
     content2 = "記憶内容２"
-    embedder = Embedder() # ローダー用にもEmbedderが必要
+    embedder = shared_embedder # ローダー用にもEmbedderが必要
 
     mm_saver.SaveMemory(content1)
     mm_saver.SaveMemory(content2)
-    saved_memories = mm_saver.GetAllMemories().copy() # 保存した内容をコピー
+    saved_memories = mm_saver.GetAllMemories() # 保存した内容 (タプルのスナップショット)
 
     # Act: 保存を実行
     mm_saver.SaveToFile()
@@ -172,10 +176,10 @@ def test_save_and_load_cycle(memory_manager_instance):
     for i in range(len(saved_memories)):
         assert loaded_memories[i].Id == saved_memories[i].Id
         assert loaded_memories[i].Content == saved_memories[i].Content
-        assert isinstance(loaded_memories[i].Embedding, list) # ロード後もEmbeddingがあるか
+        assert isinstance(loaded_memories[i].Embedding, np.ndarray) # ロード後もEmbeddingがあるか
         assert len(loaded_memories[i].Embedding) > 0
 
-def test_load_from_non_existent_file():
+def test_load_from_non_existent_file(shared_embedder):
     """存在しないファイルからロードしようとしてもエラーにならず空のリストを返すテスト"""
     # Arrange
     non_existent_file = "non_existent_memory_file.json"
@@ -183,8 +187,7 @@ def test_load_from_non_existent_file():
     if os.path.exists(non_existent_file):
         os.remove(non_existent_file)
 
-    embedder = Embedder()
-    mm = MemoryManager(memory_path=non_existent_file, embedder=embedder)
+    mm = MemoryManager(memory_path=non_existent_file, embedder=shared_embedder)
 
     # Act: LoadFromFileは__init__で呼ばれる
 
@@ -199,10 +202,10 @@ def test_load_from_non_existent_file():
 
 # Optional: Test for recalculating missing embeddings during load
 # This requires manually creating a test file
-def test_load_recalculates_embedding(tmp_path):
-    """ロード時にEmbeddingがない場合、再計算されるかテスト"""
+def test_load_recalculates_embedding(tmp_path, shared_embedder):
+    """ロード時にEmbeddingがない場合、最初の検索時に計算されてファイルに書き戻されるかテスト"""
     # Arrange
-    embedder = Embedder()
+    embedder = shared_embedder
     test_file = tmp_path / "test_missing_embedding.json"
     # Embeddingがない、またはnullのデータを作成
     data_without_embedding = [
@@ -214,15 +217,55 @@ def test_load_recalculates_embedding(tmp_path):
 
     mm = MemoryManager(memory_path=str(test_file), embedder=embedder)
 
-    # Act: LoadFromFileは__init__で呼ばれる
+    # Act: LoadFromFileは__init__で呼ばれる (この時点では Embedding は計算しない)
     loaded_memories = mm.GetAllMemories()
+    assert all(m.Embedding is None for m in loaded_memories)
+    mm.SearchMemory("Embedding")
 
     # Assert
     assert len(loaded_memories) == 2
     assert loaded_memories[0].Content == "Embedding is missing"
-    assert isinstance(loaded_memories[0].Embedding, list)
+    assert isinstance(loaded_memories[0].Embedding, np.ndarray)
     assert len(loaded_memories[0].Embedding) > 0 # Embeddingが再計算されたはず
     assert loaded_memories[1].Content == "No Embedding key"
-    assert isinstance(loaded_memories[1].Embedding, list)
+    assert isinstance(loaded_memories[1].Embedding, np.ndarray)
     assert len(loaded_memories[1].Embedding) > 0 # Embeddingが再計算されたはず
-    assert mm.NextId == 2 # NextIdも正しく設定されるか
\ No newline at end of file
+    assert mm.NextId == 2 # NextIdも正しく設定されるか
+    reloaded = MemoryManager(memory_path=str(test_file), embedder=embedder)
+    assert all(isinstance(m.Embedding, np.ndarray) for m in reloaded.GetAllMemories()) # 書き戻されているか
+
+def test_save_memory_appends_jsonl_line(memory_manager_instance, shared_embedder):
+    """SaveMemory は SaveToFile を呼ばなくても1行ずつ追記し、別インスタンスで読み込めるかテスト"""
+    # Arrange
+    mm = memory_manager_instance
+
+    # Act
+    mm.SaveMemory("追記1")
+    mm.SaveMemory("追記2")
+    mm_loader = MemoryManager(memory_path=TEST_MEMORY_FILE, embedder=shared_embedder)
+
+    # Assert
+    with open(TEST_MEMORY_FILE, encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    assert [line["Content"] for line in lines] == ["追記1", "追記2"]
+    assert all("Embedding" not in line for line in lines) # Embedding はサイドカー側
+    assert [m.Content for m in mm_loader.GetAllMemories()] == ["追記1", "追記2"]
+    assert mm_loader.NextId == 2
+
+def test_legacy_json_list_is_migrated(tmp_path, shared_embedder):
+    """旧形式 (JSON リスト) のファイルは、次の保存時に JSON Lines 形式へ書き直されるかテスト"""
+    # Arrange
+    test_file = tmp_path / "legacy_memories.json"
+    with open(test_file, "w", encoding="utf-8") as f:
+        json.dump([{"Id": 0, "Content": "旧形式の記憶"}], f, ensure_ascii=False, indent=2)
+    mm = MemoryManager(memory_path=str(test_file), embedder=shared_embedder)
+
+    # Act
+    mm.SaveMemory("新しい記憶")
+    mm.DeleteMemoryByIndex(0)
+    mm.SaveToFile()
+    mm_loader = MemoryManager(memory_path=str(test_file), embedder=shared_embedder)
+
+    # Assert
+    assert not test_file.read_text(encoding="utf-8").lstrip().startswith("[")
+    assert [(m.Id, m.Content) for m in mm_loader.GetAllMemories()] == [(1, "新しい記憶")]
@@ -0,0 +1,94 @@
+# tests/memory/test_retriever.py
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from my_local_ai.memory.retriever import Retriever, normalize_query
+
+
+class FakeManager:
+    """SearchMemory / SearchRelevantLogs の呼び出しを記録するだけの Manager"""
+    def __init__(self):
+        self.Version = 0
+        self.calls = []
+        self.embeddings = []
+
+    def SearchMemory(self, query, topK=3, similarity_threshold=0.5, query_embedding=None):
+        self.calls.append(query)
+        self.embeddings.append(query_embedding)
+        return ["memory"]
+
+    SearchRelevantLogs = SearchMemory
+
+    def close(self):
+        self.closed = True
+
+
+class FakeEmbedder:
+    """Embed の呼び出しを記録し、固定の Embedding を返す"""
+    def __init__(self):
+        self.calls = []
+
+    def Embed(self, texts):
+        self.calls.append(texts)
+        return [[1.0, 0.0]]
+
+
+def _retriever():
+    # Embedder (モデル読み込み) を避けるため __init__ を通さずに組み立てる
+    retriever = object.__new__(Retriever)
+    retriever.Embedder = FakeEmbedder()
+    retriever.MemoryManager = FakeManager()
+    retriever.LogManager = FakeManager()
+    retriever._Cache = OrderedDict()
+    retriever._CacheLock = threading.Lock()
+    retriever._SearchPool = ThreadPoolExecutor(max_workers=1)
+    return retriever
+
+
+def test_normalize_query_ignores_case_width_and_punctuation():
+    """記号・空白・全角半角・大文字小文字の違いは同じキーになる"""
+    assert normalize_query("こんにちは！") == normalize_query(" こんにちは ") == "こんにちは"
+    assert normalize_query("ＨＥＬＬＯ!!") == "hello"
+    assert normalize_query("！？") == "!?"
+
+
+def test_memory_results_are_cached_until_version_changes():
+    """同じコメントでは記憶を検索し直さない (ログは応答のたびに増えるので毎回検索する)"""
+    retriever = _retriever()
+
+    retriever.RetrieveRelevantInfo("こんにちは！")
+    memories, logs = retriever.RetrieveRelevantInfo("こんにちは")
+    assert retriever.MemoryManager.calls == ["こんにちは！"]
+    assert retriever.LogManager.calls == ["こんにちは！", "こんにちは"]
+
+    memories.append("書き換え")
+    assert retriever.RetrieveRelevantInfo("こんにちは")[0] == ["memory"]
+
+    retriever.MemoryManager.Version += 1
+    retriever.RetrieveRelevantInfo("こんにちは")
+    assert retriever.MemoryManager.calls == ["こんにちは！", "こんにちは"]
+
+
+def test_close_stops_the_search_pool_and_closes_the_log():
+    retriever = _retriever()
+    retriever.close()
+
+    assert retriever.LogManager.closed
+    with pytest.raises(RuntimeError):
+        retriever._SearchPool.submit(print)
+
+
+def test_query_is_embedded_once_for_both_searches():
+    """記憶とログの検索はクエリの Embedding を共有し、渡された Embedding があれば計算しない"""
+    retriever = _retriever()
+
+    retriever.RetrieveRelevantInfo("こんにちは")
+    assert retriever.Embedder.calls == ["こんにちは"]
+    assert retriever.MemoryManager.embeddings == retriever.LogManager.embeddings == [[1.0, 0.0]]
+
+    retriever.RetrieveRelevantInfo("こんばんは", query_embedding=[0.0, 1.0])
+    assert retriever.Embedder.calls == ["こんにちは"]
+    assert retriever.LogManager.embeddings[-1] == [0.0, 1.0]
@@ -0,0 +1,103 @@
+# tests/memory/test_vector_search.py
+import numpy as np
+import pytest
+
+from my_local_ai.memory import vector_search
+from my_local_ai.memory.vector_search import EmbeddingMatrix, build_embedding_matrix, normalize_rows, normalize_vector, top_k
+
+
+def test_build_embedding_matrix_skips_missing_and_normalizes():
+    """Entries without (or with mismatched) embeddings are skipped; rows are unit length."""
+    matrix, index = build_embedding_matrix([[3.0, 4.0], None, [], [1.0, 0.0], [1.0, 2.0, 3.0]])
+
+    assert index.tolist() == [0, 3]
+    assert np.allclose(np.linalg.norm(matrix, axis=1), 1.0)
+    assert np.allclose(matrix[0], [0.6, 0.8])
+
+
+def test_top_k_matches_cosine_ranking():
+    """top_k returns the same order as a brute-force cosine ranking, with threshold and count."""
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(50, 8)).tolist()
+    query = rng.normal(size=8)
+    matrix, index = build_embedding_matrix(embeddings)
+
+    hits, n_above = top_k(matrix, index, query, topK=5, threshold=0.0)
+
+    q = normalize_vector(query)
+    expected = sorted(
+        ((i, float(np.dot(q, normalize_vector(e)))) for i, e in enumerate(embeddings)),
+        key=lambda x: x[1], reverse=True,
+    )
+    assert [i for i, _ in hits] == [i for i, _ in expected[:5]]
+    assert np.allclose([s for _, s in hits], [s for _, s in expected[:5]], atol=1e-5)
+    assert n_above == sum(1 for _, s in expected if s >= 0.0)
+
+
+def test_top_k_handles_empty_and_no_hits():
+    """Empty matrices and thresholds nobody reaches give no hits."""
+    empty_matrix, empty_index = build_embedding_matrix([None])
+    assert top_k(empty_matrix, empty_index, [1.0, 0.0], 3, 0.5) == ([], 0)
+
+    matrix, index = build_embedding_matrix([[1.0, 0.0]])
+    assert top_k(matrix, index, [0.0, 1.0], 3, 0.5) == ([], 0)
+
+
+def test_embedding_matrix_tracks_incremental_updates():
+    """Append/Replace/Remove keep the matrix equal to a full rebuild."""
+    rng = np.random.default_rng(1)
+    entries = [rng.normal(size=4).tolist() for _ in range(40)]
+    entries[5] = None
+    m = EmbeddingMatrix()
+    for i, e in enumerate(entries):
+        m.Append(i, e)
+
+    entries[3] = rng.normal(size=4).tolist()
+    m.Replace(3, entries[3])
+    entries[7] = None
+    m.Replace(7, None)
+    del entries[10]
+    m.Remove(10)
+
+    expected_matrix, expected_index = build_embedding_matrix(entries)
+    order = np.argsort(m.index)
+    assert m.index[order].tolist() == expected_index.tolist()
+    assert np.allclose(m.matrix[order], expected_matrix)
+
+
+def test_normalize_rows_keeps_zero_rows_and_input():
+    """Rows become unit vectors, zero rows stay zero and the input array is not modified."""
+    source = np.array([[3.0, 4.0], [0.0, 0.0]], dtype=np.float16)
+
+    result = normalize_rows(source)
+
+    assert result.dtype == np.float32
+    assert np.allclose(result, [[0.6, 0.8], [0.0, 0.0]])
+    assert source[0, 0] == 3.0
+
+
+def test_embedding_matrix_search_matches_top_k():
+    """Below the ANN threshold, EmbeddingMatrix.Search is the exact top_k ranking."""
+    rng = np.random.default_rng(2)
+    entries = rng.normal(size=(50, 8)).tolist()
+    m = EmbeddingMatrix()
+    m.Rebuild(entries)
+    query = rng.normal(size=8)
+
+    assert m.Search(query, 5, 0.0) == top_k(m.matrix, m.index, query, 5, 0.0)
+
+
+def test_embedding_matrix_search_uses_hnsw_above_threshold(monkeypatch):
+    """With faiss installed, large matrices are searched through HNSW, including rows appended later."""
+    pytest.importorskip("faiss")
+    monkeypatch.setattr(vector_search, "ANN_MIN_ENTRIES", 10)
+    rng = np.random.default_rng(3)
+    entries = rng.normal(size=(200, 8)).tolist()
+    m = EmbeddingMatrix()
+    m.Rebuild(entries)
+    m.Search(entries[0], 1, 0.0) # build the index
+    m.Append(200, entries[5])
+
+    hits, _ = m.Search(entries[5], 2, 0.99)
+
+    assert sorted(pos for pos, _ in hits) == [5, 200]
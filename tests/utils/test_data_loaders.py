@@ -0,0 +1,63 @@
+import json
+import os
+
+from my_local_ai.utils.data_loaders import append_reflections, load_identity_data, store_identity_cache, write_identity_file
+
+
+def _write(path, beliefs):
+    path.write_text(json.dumps({"Beliefs": beliefs}, ensure_ascii=False), encoding="utf-8")
+
+
+def test_identity_is_cached_until_file_changes(tmp_path):
+    """Unchanged identity.json is not parsed again; a rewrite is picked up."""
+    path = tmp_path / "identity.json"
+    _write(path, ["a"])
+
+    first = load_identity_data(path)
+    # Same parsed object underneath (the loader returns a shallow copy)
+    assert load_identity_data(path)["Beliefs"] is first["Beliefs"]
+
+    _write(path, ["a", "b"])
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert load_identity_data(path)["Beliefs"] == ["a", "b"]
+
+
+def test_store_identity_cache_primes_the_cache(tmp_path):
+    """The writer's object is returned on the next load without re-reading."""
+    path = tmp_path / "identity.json"
+    identity = {"Beliefs": ["x"], "Values": [], "Reflections": []}
+    path.write_text(json.dumps(identity), encoding="utf-8")
+
+    store_identity_cache(path, identity)
+
+    assert load_identity_data(path)["Beliefs"] is identity["Beliefs"]
+
+
+def test_latest_reflection_comes_from_sidecar(tmp_path):
+    """load_identity_data exposes only the newest reflection from reflections.jsonl."""
+    path = tmp_path / "identity.json"
+    path.write_text(json.dumps({"Beliefs": [], "Reflections": [{"Insight": "legacy"}]}), encoding="utf-8")
+    assert load_identity_data(path)["Reflections"] == [{"Insight": "legacy"}]
+
+    append_reflections(path, [{"Insight": "first"}, {"Insight": "second"}])
+
+    assert load_identity_data(path)["Reflections"] == [{"Insight": "second"}]
+
+
+def test_write_identity_file_replaces_atomically(tmp_path):
+    """The identity file is rewritten via a temp file that does not linger."""
+    path = tmp_path / "identity.json"
+    write_identity_file(path, {"Beliefs": ["a"], "Values": []})
+
+    assert json.loads(path.read_text(encoding="utf-8"))["Beliefs"] == ["a"]
+    assert not (tmp_path / "identity.json.tmp").exists()
+
+
+def test_write_identity_file_keeps_readable_formatting(tmp_path):
+    """Output stays 2-space indented UTF-8 (no \\u escapes), matching the old json.dump format."""
+    path = tmp_path / "identity.json"
+    identity = {"Beliefs": ["星を見るのが好き"], "Values": []}
+    write_identity_file(path, identity)
+
+    assert path.read_text(encoding="utf-8") == json.dumps(identity, ensure_ascii=False, indent=2)
@@ -0,0 +1,31 @@
+# tests/utils/test_fast_json.py
+import json
+
+import numpy as np
+import pytest
+
+from my_local_ai.utils import fast_json
+
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request, monkeypatch):
+    """Run each test with orjson (when installed) and with the stdlib fallback."""
+    if request.param == "orjson":
+        if fast_json.orjson is None:
+            pytest.skip("orjson is not installed")
+    else:
+        monkeypatch.setattr(fast_json, "orjson", None)
+    return request.param
+
+
+def test_roundtrip_keeps_non_ascii(backend):
+    data = {"UserInput": "こんにちは", "Id": 3}
+    encoded = fast_json.dumps(data)
+    assert isinstance(encoded, bytes)
+    assert "こんにちは" in encoded.decode("utf-8")
+    assert fast_json.loads(encoded) == data
+
+
+def test_numpy_values_are_serialized(backend):
+    data = {"vec": np.array([0.5, -1.0], dtype=np.float32), "n": np.int64(7)}
+    assert json.loads(fast_json.dumps(data)) == {"vec": [0.5, -1.0], "n": 7}
@@ -0,0 +1,209 @@
+# tests/utils/test_tts.py
+import io
+import os
+import sys
+import types
+import wave
+
+import numpy as np
+import pytest
+
+# sounddevice / soundfile need PortAudio / libsndfile (and an audio device); these tests only cover
+# WAV parsing and the caches, so minimal stand-ins are used when the real modules cannot be imported
+try:
+    import sounddevice # noqa: F401
+except (ImportError, OSError):
+    sys.modules["sounddevice"] = types.SimpleNamespace(PortAudioError=OSError)
+try:
+    import soundfile # noqa: F401
+except (ImportError, OSError):
+    sys.modules["soundfile"] = types.SimpleNamespace(read=None)
+
+from my_local_ai.utils import tts
+from my_local_ai.utils.tts import AivisAdapter, _ChunkReader, _decode_wav
+
+
+def _make_wav(samples: bytes, sampwidth: int = 2, channels: int = 1, rate: int = 24000) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(sampwidth)
+        w.setframerate(rate)
+        w.writeframes(samples)
+    return buf.getvalue()
+
+
+class FakeResponse:
+    def __init__(self, body: bytes = b"", json_data=None):
+        self.body = body
+        self.json_data = json_data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.json_data
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+
+class FakeSession:
+    """Stands in for requests.Session: /synthesis returns a WAV derived from the queried text."""
+    def __init__(self):
+        self.synthesized = []
+
+    def post(self, url, params=None, data=None, **kwargs):
+        if url.endswith("/audio_query"):
+            return FakeResponse(json_data={"text": params["text"]})
+        text = tts.json.loads(data)["text"]
+        self.synthesized.append(text)
+        return FakeResponse(body=_make_wav(text.encode("utf-8").ljust(8, b"\0")))
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def make_adapter(monkeypatch):
+    """Build AivisAdapters whose HTTP session is a FakeSession (and close them afterwards)."""
+    monkeypatch.setattr(tts, "zstandard", None) # Uncompressed disk cache unless a test opts in
+    adapters = []
+
+    def build(cache_dir=None):
+        adapter = AivisAdapter(cache_dir=cache_dir)
+        adapter._session = FakeSession()
+        adapters.append(adapter)
+        return adapter
+
+    yield build
+    for adapter in adapters:
+        adapter.close()
+
+
+def test_decode_16bit_pcm_is_a_view_of_the_data():
+    samples = np.array([0, 1, -1, 32767, -32768, 5], dtype="<i2")
+    wav_data = _make_wav(samples.tobytes(), channels=2)
+
+    audio, rate = _decode_wav(wav_data)
+
+    assert rate == 24000
+    assert audio.shape == (3, 2)
+    assert audio.ravel().tolist() == samples.tolist()
+    assert audio.base is not None # np.frombuffer over the WAV bytes, not a copy
+
+
+def test_decode_truncated_data_chunk_stops_at_the_last_whole_frame():
+    """The header claims more frames than were received; only complete frames are returned."""
+    wav_data = _make_wav(np.arange(10, dtype="<i2").tobytes())
+
+    audio, _ = _decode_wav(wav_data[:-5]) # 15 of 20 data bytes remain
+
+    assert audio.ravel().tolist() == list(range(7))
+
+
+def test_decode_8bit_pcm_is_unsigned():
+    audio, _ = _decode_wav(_make_wav(bytes([0, 128, 255]), sampwidth=1))
+
+    assert audio.dtype == np.uint8
+    assert audio.ravel().tolist() == [0, 128, 255]
+
+
+def test_decode_falls_back_to_soundfile(monkeypatch):
+    """24-bit PCM (no numpy dtype) and non-PCM WAVs are handed to soundfile."""
+    calls = []
+    def fake_read(stream, dtype):
+        calls.append((stream.read(), dtype))
+        return np.zeros((1, 1), dtype=np.float32), 16000
+    monkeypatch.setattr(tts, "soundfile", types.SimpleNamespace(read=fake_read))
+
+    wav_24bit = _make_wav(b"\0\0\1" * 4, sampwidth=3)
+    assert _decode_wav(wav_24bit)[1] == 16000
+    float_wav = bytearray(_make_wav(b"\0" * 8, sampwidth=4))
+    float_wav[20:22] = (3).to_bytes(2, "little") # WAVE_FORMAT_IEEE_FLOAT, which wave cannot read
+    _decode_wav(bytes(float_wav))
+
+    assert calls == [(wav_24bit, "float32"), (bytes(float_wav), "float32")]
+
+
+def test_chunk_reader_reads_across_chunk_boundaries():
+    reader = _ChunkReader([b"abc", b"", b"de"])
+    buf = bytearray(2)
+
+    reads = []
+    while (n := reader.readinto(buf)):
+        reads.append(bytes(buf[:n]))
+
+    assert reads == [b"ab", b"c", b"de"]
+    assert io.BufferedReader(_ChunkReader([b"ab", b"cd", b"e"])).read() == b"abcde"
+
+
+def test_memory_cache_evicts_least_recently_used(make_adapter, monkeypatch):
+    monkeypatch.setattr(tts, "WAV_CACHE_MAX_ENTRIES", 2)
+    adapter = make_adapter()
+
+    for text in ("a", "b", "a", "c"): # "b" is the oldest when "c" is added
+        adapter.generate_voice_wav(text)
+    assert adapter._session.synthesized == ["a", "b", "c"]
+
+    adapter.generate_voice_wav("a")
+    adapter.generate_voice_wav("b")
+    assert adapter._session.synthesized == ["a", "b", "c", "b"]
+
+
+def test_stream_and_generate_share_the_cache(make_adapter):
+    adapter = make_adapter()
+    streamed = b"".join(adapter.stream_voice_wav("こんにちは"))
+
+    assert adapter.generate_voice_wav("こんにちは") == streamed
+    assert adapter._session.synthesized == ["こんにちは"]
+    assert adapter.generate_voice_wav("") is None
+
+
+def test_disk_cache_survives_a_new_adapter(make_adapter, tmp_path):
+    first = make_adapter(cache_dir=tmp_path)
+    wav_data = first.generate_voice_wav("おはよう")
+    assert [path.suffix for path in tmp_path.iterdir()] == [".wav"]
+
+    second = make_adapter(cache_dir=tmp_path)
+    assert second.generate_voice_wav("おはよう") == wav_data
+    assert second._session.synthesized == []
+
+
+def test_zstd_disk_cache_roundtrip_and_corruption(make_adapter, tmp_path, monkeypatch):
+    zstandard = pytest.importorskip("zstandard")
+    monkeypatch.setattr(tts, "zstandard", zstandard)
+    first = make_adapter(cache_dir=tmp_path)
+    wav_data = first.generate_voice_wav("おはよう")
+    (cached,) = tmp_path.glob("*.wav.zst")
+    assert zstandard.decompress(cached.read_bytes()) == wav_data
+
+    second = make_adapter(cache_dir=tmp_path)
+    assert second.generate_voice_wav("おはよう") == wav_data
+    assert second._session.synthesized == []
+
+    # A corrupted file is ignored and the audio is synthesized again
+    cached.write_bytes(b"not zstd")
+    third = make_adapter(cache_dir=tmp_path)
+    assert third.generate_voice_wav("おはよう") == wav_data
+    assert third._session.synthesized == ["おはよう"]
+
+
+def test_prune_disk_cache_removes_least_recently_used_files(make_adapter, tmp_path, monkeypatch):
+    monkeypatch.setattr(tts, "WAV_DISK_CACHE_MAX_FILES", 2)
+    for name, mtime in [("older.wav.zst", 1), ("old.wav", 2), ("new.wav", 3), ("newer.wav.zst", 4)]:
+        path = tmp_path / name
+        path.write_bytes(b"x")
+        os.utime(path, (mtime, mtime))
+    (tmp_path / "notes.txt").write_text("not audio")
+
+    make_adapter(cache_dir=tmp_path)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["new.wav", "newer.wav.zst", "notes.txt"]